@@ -0,0 +1,305 @@
+"""
+Benchmark `take_reading` with each way of persisting readings, against SQLite or Postgres,
+for 1, 10 and 100 environments:
+
+    python -m benchmarks.take_reading --backend sqlite --output results.json
+    python -m benchmarks.take_reading --backend postgres --compare results.json
+
+Postgres runs use a throwaway `hothouse_benchmark` database, copied from the test template
+database by `hothouse.bootstrap.create_test_database` using the usual `.env` settings, and
+dropped afterwards unless `--keep-database` is given. Results are written as JSON, so runs
+can be compared over time.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import tracemalloc
+import warnings
+from datetime import date, datetime, time, timedelta
+from math import sin
+from time import perf_counter, process_time
+from typing import Callable, Dict, List
+from uuid import uuid4
+from sqlalchemy import create_engine, event
+from hothouse import Device, Environment, Reading, Schedule
+from hothouse.hothouse import Base, DeviceUsage
+from hothouse.pipeline import Pipeline
+from hothouse.postgres import BatchWriter, Spool, configure, get_session, register_engine
+
+BENCHMARK_DB_NAME = 'hothouse_benchmark'
+MODES = {
+    # Commit each reading in its own transaction, loading the schedule and devices every time
+    'commit': ['sqlite', 'postgres'],
+    # Keep the schedule and devices in memory between readings
+    'cached': ['sqlite', 'postgres'],
+    # Cached rows, with readings and device usages written by `BatchWriter`s
+    'batch': ['postgres'],
+    # Cached rows, with readings and device usages written to a local `Spool`
+    'spool': ['postgres'],
+    # Control right away, and write from a background thread
+    'pipeline': ['sqlite', 'postgres'],
+}
+
+
+class BenchmarkDevice(Device):
+    def _on(self, level) -> None:
+        pass
+
+    def _off(self) -> None:
+        pass
+
+
+class BenchmarkEnvironment(Environment):
+    """An environment whose temperature and humidity swing back and forth every 20 readings."""
+    fan_class = BenchmarkDevice
+    heater_class = BenchmarkDevice
+    humidifier_class = BenchmarkDevice
+    light_class = BenchmarkDevice
+    ticks = 0
+
+    def get_temp(self) -> float:
+        self.ticks += 1
+        return 70 + 10 * sin(self.ticks * 0.314)
+
+    def get_humidity(self) -> float:
+        return 0.5 + 0.3 * sin(self.ticks * 0.314)
+
+
+def use_sqlite(directory: str) -> None:
+    """Point `hothouse` at a new SQLite database, with the `hh` schema attached as a second file."""
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'main.db')}")
+
+    @event.listens_for(engine, 'connect')
+    def attach_schema(dbapi_connection, connection_record) -> None:
+        dbapi_connection.execute(
+            f"ATTACH DATABASE '{os.path.join(directory, 'hh.db')}' AS hh")
+
+    Base.metadata.create_all(engine)
+    configure(DB_NAME='sqlite')
+    register_engine('sqlite', engine)
+
+
+def use_postgres() -> None:
+    """Point `hothouse` at a new, empty Postgres database."""
+    from hothouse.bootstrap import create_test_database
+
+    configure(DB_NAME=BENCHMARK_DB_NAME)
+    create_test_database(BENCHMARK_DB_NAME)
+
+
+def drop_postgres() -> None:
+    from hothouse.bootstrap import drop_database
+
+    drop_database(BENCHMARK_DB_NAME)
+
+
+def create_environments(count: int, start_at: datetime) -> List[BenchmarkEnvironment]:
+    environments = []
+    with get_session() as session:
+        session.expire_on_commit = False
+        for i in range(count):
+            devices = {
+                device_type: BenchmarkDevice(
+                    id=str(uuid4()), name=f'{device_type} {i}', watts=100, active=False)
+                for device_type in ('fan', 'heater', 'humidifier', 'light')
+            }
+            environment = BenchmarkEnvironment(
+                id=str(uuid4()),
+                name=f'Environment {i}',
+                temp_tolerance=3,
+                humidity_tolerance=0.1,
+                **{f'{device_type}_id': device.id for device_type, device in devices.items()}
+            )
+            schedule = Schedule(
+                id=str(uuid4()),
+                environment_id=environment.id,
+                start_date=start_at.date() - timedelta(days=1),
+                temp=70,
+                humidity=0.5,
+                fan_on_seconds=300,
+                fan_off_seconds=600,
+                light_on_at=time(hour=8),
+                light_off_at=time(hour=20)
+            )
+            session.add_all([*devices.values(), environment, schedule])
+            environments.append(environment)
+        session.commit()
+
+    return environments
+
+
+def configure_mode(mode: str, environments: List[BenchmarkEnvironment], directory: str) -> Callable[[], None]:
+    """Set up `environments` to persist readings in `mode`, returning a function that finishes writing."""
+    BenchmarkEnvironment.cache_rows = mode != 'commit'
+    BenchmarkEnvironment.reading_writer = None
+    BenchmarkDevice.usage_writer = None
+
+    if mode == 'batch':
+        readings = BenchmarkEnvironment.reading_writer = BatchWriter(Reading)
+        device_usages = BenchmarkDevice.usage_writer = BatchWriter(DeviceUsage)
+
+        def close_writers() -> None:
+            # Closing writes what's left, and stops each writer's flush timer
+            readings.close()
+            device_usages.close()
+        return close_writers
+
+    if mode == 'spool':
+        spool = Spool(os.path.join(directory, 'spool'),
+                      [Reading, DeviceUsage])
+        BenchmarkEnvironment.reading_writer = BenchmarkDevice.usage_writer = spool
+        return spool.close
+
+    if mode == 'pipeline':
+        pipelines = [Pipeline(environment) for environment in environments]
+        environments[:] = pipelines
+
+        def close_pipelines() -> None:
+            # Stop them all at once, rather than waiting for each writer to notice in turn
+            for pipeline in pipelines:
+                pipeline.closed.set()
+            for pipeline in pipelines:
+                pipeline.close()
+        return close_pipelines
+
+    return lambda: None
+
+
+def run(backend: str, mode: str, environment_count: int, ticks: int, keep_database: bool = False) -> dict:
+    """Take `ticks` readings in each of `environment_count` environments, one minute apart."""
+    try:
+        return measure(backend, mode, environment_count, ticks)
+    finally:
+        if backend == 'postgres' and not keep_database:
+            drop_postgres()
+
+
+def measure(backend: str, mode: str, environment_count: int, ticks: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        if backend == 'sqlite':
+            use_sqlite(directory)
+        else:
+            use_postgres()
+
+        start_at = datetime.combine(date.today(), time(hour=6))
+        environments = create_environments(environment_count, start_at)
+        finish = configure_mode(mode, environments, directory)
+
+        # Warm up, so every environment has its rows cached (if it caches them)
+        for environment in environments:
+            environment.take_reading(start_at)
+
+        # Measure memory separately, since tracing slows everything down
+        tracemalloc.start()
+        for environment in environments:
+            environment.take_reading(start_at + timedelta(seconds=30))
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies = []
+        gc.collect()
+        blocks_before = sys.getallocatedblocks()
+        started_at, cpu_started_at = perf_counter(), process_time()
+        for tick in range(1, ticks + 1):
+            at = start_at + timedelta(minutes=tick)
+            for environment in environments:
+                reading_started_at = perf_counter()
+                environment.take_reading(at)
+                latencies.append(perf_counter() - reading_started_at)
+        finish()
+        elapsed, cpu_elapsed = perf_counter() - \
+            started_at, process_time() - cpu_started_at
+        gc.collect()
+        blocks_after = sys.getallocatedblocks()
+
+    readings = len(latencies)
+    percentiles = statistics.quantiles(
+        latencies, n=100, method='inclusive')
+    return {
+        'backend': backend,
+        'mode': mode,
+        'environments': environment_count,
+        'readings': readings,
+        'p50_ms': percentiles[49] * 1000,
+        'p90_ms': percentiles[89] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+        'max_ms': max(latencies) * 1000,
+        # Including time spent finishing writes in the background
+        'readings_per_second': readings / elapsed,
+        'readings_per_cpu_second': readings / cpu_elapsed,
+        # Memory blocks still allocated afterwards, per reading (a leak shows up here)
+        'retained_blocks_per_reading': (blocks_after - blocks_before) / readings,
+        'peak_traced_bytes_per_reading': peak_bytes / environment_count
+    }
+
+
+def compare(results: List[dict], baseline: List[dict]) -> None:
+    """Print how much slower (+) or faster (-) each result is than the same run in `baseline`."""
+    baseline_by_key = {(result['backend'], result['mode'], result['environments']): result
+                       for result in baseline}
+    for result in results:
+        previous = baseline_by_key.get(
+            (result['backend'], result['mode'], result['environments']))
+        if previous is None:
+            continue
+        changes = ', '.join(
+            f"{key} {100 * (result[key] / previous[key] - 1):+.1f}%"
+            for key in ('p50_ms', 'p99_ms')
+        )
+        throughput = 100 * \
+            (result['readings_per_second'] /
+             previous['readings_per_second'] - 1)
+        print(f"{result['backend']:>8} {result['mode']:>8} {result['environments']:>4} environments: "
+              f"{changes}, readings/s {throughput:+.1f}%")
+
+
+def main(args: List[str] = None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', choices=('sqlite', 'postgres'),
+                        action='append', dest='backends',
+                        help='Database to write to (can be repeated, default: sqlite)')
+    parser.add_argument('--mode', choices=list(MODES), action='append', dest='modes',
+                        help='How to persist readings (can be repeated, default: all)')
+    parser.add_argument('--environments', type=int, nargs='+', default=[1, 10, 100],
+                        help='Numbers of environments to run (default: 1 10 100)')
+    parser.add_argument('--ticks', type=int, default=20,
+                        help='Readings to take in each environment (default: 20)')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Compare results to an earlier JSON file')
+    parser.add_argument('--keep-database', action='store_true',
+                        help=f'Keep the {BENCHMARK_DB_NAME} database after a Postgres run, to look at its rows')
+    options = parser.parse_args(args)
+    warnings.filterwarnings('ignore', message='.*Decimal objects natively')
+
+    results = []
+    for backend in options.backends or ['sqlite']:
+        for mode in options.modes or list(MODES):
+            if backend not in MODES[mode]:
+                continue
+            for environment_count in options.environments:
+                result = run(backend, mode, environment_count, options.ticks, options.keep_database)
+                print(json.dumps(result))
+                results.append(result)
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results
+    }
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if options.compare:
+        with open(options.compare) as baseline:
+            compare(results, json.load(baseline)['results'])
+    return report
+
+
+if __name__ == '__main__':
+    main()
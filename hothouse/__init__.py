@@ -1,2 +1,3 @@
 """hothouse main exports"""
 from .hothouse import Environment, Device, Schedule, Reading
+from .monitor import Monitor
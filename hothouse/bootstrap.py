@@ -0,0 +1,311 @@
+"""
+Create and upgrade `hothouse` databases from Python, without the `psql` command line tool:
+
+    python -m hothouse.bootstrap
+
+A new database gets the schema in `create_hothouse_db_schema.psql`, which already includes
+every migration. An existing one gets the files in `migrations/` it hasn't had yet, in
+order. Both are installed with the package. Applied migrations are recorded in
+`hh.schema_migrations`, so bootstrapping an up-to-date database is a single query.
+
+Test databases are cloned from a template database that's bootstrapped once, which takes a
+fraction of a second instead of loading the schema every time.
+"""
+import argparse
+import hashlib
+import os
+import re
+from importlib.resources import files
+from typing import Dict, Iterator, List
+from hothouse.postgres import CONFIG, get_raw_connection
+from hothouse.postgres.postgres_connector import engines, session_factories
+
+SCHEMA_FILE = str(files('hothouse') / 'create_hothouse_db_schema.psql')
+MIGRATIONS_DIRECTORY = str(files('hothouse') / 'migrations')
+TEMPLATE_DB_NAME = 'hothouse_template'
+# Databases that `CREATE DATABASE` and `DROP DATABASE` connect to
+MAINTENANCE_DB_NAME = 'postgres'
+# Held while bootstrapping, so processes starting at the same time take turns
+LOCK_KEY = int.from_bytes(hashlib.sha1(
+    b'hothouse.bootstrap').digest()[:8], 'big', signed=True)
+
+TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<quoted>'(?:[^']|'')*'|"(?:[^"]|"")*")
+    | (?P<dollar_quoted>(?P<tag>\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$).*?(?P=tag))
+    | (?P<meta>\\[^\n]*)
+    | (?P<end>;)
+""", re.DOTALL | re.VERBOSE)
+
+
+def split_script(script: str) -> Iterator[str]:
+    """
+    Split a `psql` script into statements, ending at semicolons outside of quotes, comments
+    and function bodies. `psql` meta-commands are yielded as they are, starting with `\\`.
+    """
+    statement = []
+    position = 0
+    for match in TOKEN.finditer(script):
+        statement.append(script[position:match.start()])
+        position = match.end()
+        if match.group('comment'):
+            continue
+        if match.group('meta'):
+            # A meta-command like `\gexec` applies to the statement before it
+            if ''.join(statement).strip():
+                yield ''.join(statement).strip()
+            statement = []
+            yield match.group('meta').strip()
+        elif match.group('end'):
+            if ''.join(statement).strip():
+                yield ''.join(statement).strip()
+            statement = []
+        else:
+            statement.append(match.group())
+
+    statement.append(script[position:])
+    if ''.join(statement).strip():
+        yield ''.join(statement).strip()
+
+
+def run_script(db_name: str, script: str) -> None:
+    """
+    Run a `psql` script (the schema or a migration) on a pooled connection to `db_name`.
+    Statements run one at a time outside of a transaction, as they do in `psql`, so scripts
+    can use `BEGIN`, `COMMIT`, `CREATE INDEX CONCURRENTLY` and procedures that commit.
+    `\\gexec` is supported, and `\\set` is ignored; the script stops at the first error.
+    """
+    connection = get_raw_connection(db_name)
+    dbapi_connection = connection.driver_connection
+    # End the transaction the pool's pre-ping may have started
+    dbapi_connection.rollback()
+    dbapi_connection.autocommit = True
+    try:
+        cursor = connection.cursor()
+        previous = None
+        for statement in split_script(script):
+            if statement.startswith('\\'):
+                command = statement.split()[0]
+                if command not in ('\\gexec', '\\set'):
+                    raise ValueError(
+                        f"psql command {command} isn't supported, only \\gexec and \\set")
+                if previous is not None:
+                    cursor.execute(previous)
+                    previous = None
+                if command == '\\gexec':
+                    # Run each value the statement before returned as a statement of its own
+                    for row in cursor.fetchall():
+                        for generated in row:
+                            if generated is not None:
+                                cursor.execute(generated)
+                continue
+
+            # Statements run one behind, so `\gexec` can get the rows of the one before it
+            if previous is not None:
+                cursor.execute(previous)
+            previous = statement
+
+        if previous is not None:
+            cursor.execute(previous)
+        # Undo session settings the script made, e.g. the schema's `search_path`
+        cursor.execute('RESET ALL')
+        cursor.close()
+    except Exception:
+        # Don't hand a connection in an unknown state back to the pool
+        connection.invalidate()
+        raise
+    finally:
+        dbapi_connection.autocommit = False
+        connection.close()
+
+
+def read_script(path: str) -> str:
+    with open(path) as file:
+        return file.read()
+
+
+def get_checksum(path: str) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.md5(file.read()).hexdigest()
+
+
+def get_migrations(directory: str = MIGRATIONS_DIRECTORY) -> Dict[str, str]:
+    """The paths of the migrations in `directory` by name, in the order they're applied."""
+    return {name: os.path.join(directory, name)
+            for name in sorted(os.listdir(directory)) if name.endswith('.psql')}
+
+
+def get_applied(db_name: str = None) -> Dict[str, str]:
+    """The checksums of the schema and migrations applied to `db_name`, by name."""
+    connection = get_raw_connection(db_name)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT to_regclass('hh.schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return {}
+        cursor.execute('SELECT name, checksum FROM hh.schema_migrations')
+        return dict(cursor.fetchall())
+    finally:
+        connection.commit()
+        connection.close()
+
+
+def record_applied(db_name: str, paths: Dict[str, str]) -> None:
+    connection = get_raw_connection(db_name)
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS hh.schema_migrations (
+                name text PRIMARY KEY,
+                checksum text NOT NULL,
+                applied_at timestamp DEFAULT now() NOT NULL
+            )
+        """)
+        for name, path in paths.items():
+            cursor.execute(
+                'INSERT INTO hh.schema_migrations (name, checksum) VALUES (%s, %s)',
+                (name, get_checksum(path)))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def bootstrap(
+    db_name: str = None,
+    baseline: str = None,
+    migrations_directory: str = MIGRATIONS_DIRECTORY
+) -> List[str]:
+    """
+    Bring the database `db_name` (which must exist) up to date, returning the names of the
+    migrations applied. An empty database gets the whole schema. A database that was set up
+    before migrations were recorded needs `baseline`, the last migration already applied to it.
+    """
+    db_name = db_name or CONFIG['DB_NAME']
+    migrations = get_migrations(migrations_directory)
+    if baseline is not None and baseline not in migrations:
+        raise ValueError(f'{baseline} is not in {migrations_directory}')
+
+    # Lock on a connection of its own, since scripts run on whichever pooled connection is free
+    lock_connection = get_raw_connection(db_name)
+    lock_cursor = lock_connection.cursor()
+    lock_cursor.execute('SELECT pg_advisory_lock(%s)', (LOCK_KEY,))
+    lock_connection.commit()
+    try:
+        applied = get_applied(db_name)
+        if not applied:
+            cursor = lock_connection.cursor()
+            cursor.execute("SELECT to_regnamespace('hh') IS NOT NULL")
+            has_schema = cursor.fetchone()[0]
+            lock_connection.commit()
+
+            if not has_schema:
+                # The schema file already has every migration in it
+                run_script(db_name, read_script(SCHEMA_FILE))
+                record_applied(db_name, {os.path.basename(SCHEMA_FILE): SCHEMA_FILE, **migrations})
+                return []
+            if baseline is None:
+                raise RuntimeError(
+                    f"{db_name} has a schema, but no record of which migrations have been "
+                    "applied to it. Bootstrap it with the last migration already applied as `baseline`.")
+            names = list(migrations)
+            record_applied(db_name, {name: migrations[name]
+                                     for name in names[:names.index(baseline) + 1]})
+            applied = get_applied(db_name)
+
+        pending = [name for name in migrations if name not in applied]
+        for name in pending:
+            run_script(db_name, read_script(migrations[name]))
+            record_applied(db_name, {name: migrations[name]})
+        return pending
+    finally:
+        lock_cursor.execute('SELECT pg_advisory_unlock(%s)', (LOCK_KEY,))
+        lock_connection.commit()
+        lock_connection.close()
+
+
+def run_on_server(sql: str) -> None:
+    """Run a statement that can't be run in a transaction, like `CREATE DATABASE`."""
+    run_script(MAINTENANCE_DB_NAME, sql)
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def database_exists(db_name: str) -> bool:
+    connection = get_raw_connection(MAINTENANCE_DB_NAME)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            'SELECT EXISTS (SELECT FROM pg_database WHERE datname = %s)', (db_name,))
+        return cursor.fetchone()[0]
+    finally:
+        connection.commit()
+        connection.close()
+
+
+def close_connections(db_name: str) -> None:
+    """Close this process's pooled connections to `db_name`."""
+    session_factories.pop(db_name, None)
+    engine = engines.pop(db_name, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def create_database(db_name: str, template: str = None) -> None:
+    """Create an empty database, or a copy of the database `template`."""
+    sql = f'CREATE DATABASE {quote(db_name)}'
+    if template is not None:
+        # Postgres only copies a database that nothing else is connected to
+        close_connections(template)
+        sql += f' TEMPLATE {quote(template)}'
+    run_on_server(sql)
+
+
+def drop_database(db_name: str) -> None:
+    """Drop a database if it exists, disconnecting anything still connected to it."""
+    close_connections(db_name)
+    run_on_server(f'DROP DATABASE IF EXISTS {quote(db_name)} WITH (FORCE)')
+
+
+def create_template(template: str = TEMPLATE_DB_NAME) -> None:
+    """
+    Create or update the template database that test databases are copied from. It's made
+    again from scratch if `create_hothouse_db_schema.psql` has changed since it was made.
+    """
+    schema_name = os.path.basename(SCHEMA_FILE)
+    if database_exists(template) and \
+            get_applied(template).get(schema_name) != get_checksum(SCHEMA_FILE):
+        drop_database(template)
+    if not database_exists(template):
+        create_database(template)
+    bootstrap(template)
+    close_connections(template)
+
+
+def create_test_database(db_name: str, template: str = TEMPLATE_DB_NAME) -> None:
+    """Replace `db_name` with a new copy of the (up to date) template database."""
+    create_template(template)
+    drop_database(db_name)
+    create_database(db_name, template)
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--db-name', help='Database to bootstrap (default: DB_NAME)')
+    parser.add_argument('--create', action='store_true',
+                        help="Create the database first if it doesn't exist")
+    parser.add_argument('--baseline',
+                        help='For a database set up before migrations were recorded, the last migration applied to it')
+    options = parser.parse_args(args)
+
+    db_name = options.db_name or CONFIG['DB_NAME']
+    if options.create and not database_exists(db_name):
+        create_database(db_name)
+    applied = bootstrap(db_name, options.baseline)
+    print(f'{db_name}: applied {len(applied)} migrations' +
+          ''.join(f'\n  {name}' for name in applied))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+The rules that decide which devices should be on, separate from the database and hardware.
+
+`decide` works out the commands for one environment and one `Sample`, and a `SwitchGuard`
+holds back commands that would switch a device too soon or too often. `decide_batch` applies
+the same rules (without switch limits) to many environments or timestamps at once with NumPy
+(the optional `hothouse[reports]` dependency), and `decide_series` follows one environment
+through a series of samples.
+"""
+from collections import Counter, defaultdict, deque
+from datetime import datetime, time, timedelta
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence, Union
+
+DEVICE_TYPES = ('fan', 'heater', 'humidifier', 'light')
+
+
+class Sample(NamedTuple):
+    """The sensor values of an `Environment` at a moment in time."""
+    at: datetime
+    temp: Optional[float]
+    humidity: Optional[float]
+    # Whether a value was reused from an earlier sample because its sensor failed
+    temp_stale: bool = False
+    humidity_stale: bool = False
+
+
+class Settings(NamedTuple):
+    """The conditions an environment should be kept in, combining its `Schedule` and defaults."""
+    temp_target: float
+    temp_tolerance: float
+    humidity_target: float
+    humidity_tolerance: float
+    fan_on_seconds: Optional[int] = None
+    fan_off_seconds: Optional[int] = None
+    light_on_at: Optional[time] = None
+    light_off_at: Optional[time] = None
+
+
+class DeviceStates(NamedTuple):
+    """Whether each device in an environment is on, or None if the environment doesn't have one."""
+    fan: Optional[bool] = None
+    heater: Optional[bool] = None
+    humidifier: Optional[bool] = None
+    light: Optional[bool] = None
+
+
+class Command(NamedTuple):
+    """Turn a device on or off."""
+    device_type: str
+    active: bool
+
+
+class SwitchLimits(NamedTuple):
+    """How often a device may be switched. None means no limit."""
+    min_on_seconds: Optional[float] = None
+    min_off_seconds: Optional[float] = None
+    max_switches_per_hour: Optional[int] = None
+
+
+class SwitchGuard:
+    """
+    Hold back commands that would switch a device before it has been on for `min_on_seconds`
+    or off for `min_off_seconds`, or more than `max_switches_per_hour` times in the last hour.
+    Held back commands are counted by device type in `suppressed`; `decide` issues them again
+    on the next sample if they're still needed.
+    """
+
+    def __init__(self):
+        # When each device was switched within the last hour, by device id
+        self.recent_switches: Dict[str, Deque[datetime]] = defaultdict(deque)
+        self.suppressed = Counter()
+
+    def allow(
+        self,
+        command: Command,
+        device_id: str,
+        limits: SwitchLimits,
+        now: datetime,
+        last_activated_at: Optional[datetime] = None,
+        last_deactivated_at: Optional[datetime] = None
+    ) -> bool:
+        """Check whether a command can be carried out now, and remember it if so."""
+        if command.active:
+            last_switched_at, min_seconds = last_deactivated_at, limits.min_off_seconds
+        else:
+            last_switched_at, min_seconds = last_activated_at, limits.min_on_seconds
+
+        if min_seconds and last_switched_at is not None and \
+                (now - last_switched_at).total_seconds() < min_seconds:
+            self.suppressed[command.device_type] += 1
+            return False
+
+        if limits.max_switches_per_hour:
+            switches = self.recent_switches[device_id]
+            while switches and now - switches[0] >= timedelta(hours=1):
+                switches.popleft()
+            if len(switches) >= limits.max_switches_per_hour:
+                self.suppressed[command.device_type] += 1
+                return False
+            switches.append(now)
+
+        return True
+
+
+def get_settings(environment, schedule) -> Settings:
+    """Get the `Settings` for an `Environment` while `schedule` is active."""
+    return Settings(
+        temp_target=float(schedule.temp or environment.temp_default or 70),
+        temp_tolerance=float(environment.temp_tolerance or 3),
+        humidity_target=float(
+            schedule.humidity or environment.humidity_default or 0.5),
+        humidity_tolerance=float(environment.humidity_tolerance or 0.1),
+        fan_on_seconds=schedule.fan_on_seconds,
+        fan_off_seconds=schedule.fan_off_seconds,
+        light_on_at=schedule.light_on_at,
+        light_off_at=schedule.light_off_at
+    )
+
+
+def get_switch_limits(device) -> SwitchLimits:
+    """Get the `SwitchLimits` of a `Device`."""
+    return SwitchLimits(
+        min_on_seconds=device.min_on_seconds,
+        min_off_seconds=device.min_off_seconds,
+        max_switches_per_hour=device.max_switches_per_hour
+    )
+
+
+def decide(settings: Settings, states: DeviceStates, sample: Sample) -> List[Command]:
+    """Get the commands that bring an environment's devices in line with `settings`."""
+    now, temp, humidity = sample.at, sample.temp, sample.humidity
+    commands = []
+
+    # Temp control
+    if temp is not None and states.heater is not None:
+        # Check if the current temperature below the allowable tolerance
+        if not states.heater and (settings.temp_target - settings.temp_tolerance > temp):
+            commands.append(Command('heater', True))
+
+        # Check if the current temperature above the allowable tolerance
+        elif states.heater and (temp - settings.temp_tolerance > settings.temp_target):
+            commands.append(Command('heater', False))
+
+    # Humidity control
+    if humidity is not None and states.humidifier is not None:
+        # Check if the current humidity below the allowable tolerance
+        if not states.humidifier and (settings.humidity_target - settings.humidity_tolerance > humidity):
+            commands.append(Command('humidifier', True))
+
+        # Check if the current humidity above the allowable tolerance
+        elif states.humidifier and (humidity - settings.humidity_tolerance > settings.humidity_target):
+            commands.append(Command('humidifier', False))
+
+    # Fan control
+    if states.fan is not None and settings.fan_on_seconds and settings.fan_off_seconds:
+        this_second = (now.hour * 60 * 60) + (now.minute * 60) + now.second
+        fan_total_period = settings.fan_on_seconds + settings.fan_off_seconds
+
+        # Check if the current second falls within the period when the fan should be on
+        during_fan_on = this_second % fan_total_period < settings.fan_on_seconds
+        if states.fan != during_fan_on:
+            commands.append(Command('fan', during_fan_on))
+
+    # Light control
+    if states.light is not None and settings.light_on_at and settings.light_off_at:
+        now_time = now.time()
+        during_light_on = now_time > settings.light_on_at and now_time < settings.light_off_at
+        if states.light != during_light_on:
+            commands.append(Command('light', during_light_on))
+
+    return commands
+
+
+def decide_batch(
+    settings: Union[Settings, Sequence[Settings]],
+    states: Union[DeviceStates, Sequence[DeviceStates]],
+    samples: Sequence[Sample]
+) -> Dict[str, 'np.ndarray']:
+    """
+    Apply `decide` to each sample, with the matching settings and device states (or the same
+    settings or states for every sample). Returns whether each type of device should be on
+    after each sample, as boolean arrays; devices an environment doesn't have stay off.
+    """
+    import numpy as np
+
+    count = len(samples)
+    if count == 0:
+        return {device_type: np.zeros(0, dtype=bool) for device_type in DEVICE_TYPES}
+    if isinstance(settings, Settings):
+        settings = [settings] * count
+    if isinstance(states, DeviceStates):
+        states = [states] * count
+
+    at, temp, humidity = list(zip(*samples))[:3]
+    temp = np.array(temp, dtype=float)
+    humidity = np.array(humidity, dtype=float)
+    seconds = np.array([second_of_day(value) for value in at], dtype=float)
+    # One array per setting, with the thresholds as floats
+    columns = Settings(*(np.array(column, dtype=float if index < 4 else object)
+                         for index, column in enumerate(zip(*settings))))
+
+    results = {}
+    for device_type in DEVICE_TYPES:
+        state = np.array([getattr(row, device_type)
+                         for row in states], dtype=object)
+        has_device = state != None
+        active = has_device & (state == True)
+
+        if device_type == 'heater':
+            active = _hysteresis(
+                active, temp, columns.temp_target, columns.temp_tolerance)
+        elif device_type == 'humidifier':
+            active = _hysteresis(
+                active, humidity, columns.humidity_target, columns.humidity_tolerance)
+        elif device_type == 'fan':
+            on_seconds = np.array(
+                [value or 0 for value in columns.fan_on_seconds], dtype=float)
+            off_seconds = np.array(
+                [value or 0 for value in columns.fan_off_seconds], dtype=float)
+            enabled = (on_seconds > 0) & (off_seconds > 0)
+            period = np.where(enabled, on_seconds + off_seconds, 1)
+            active = np.where(
+                enabled, np.floor(seconds) % period < on_seconds, active)
+        else:
+            light_on = np.array([second_of_day(value) for value in columns.light_on_at],
+                                dtype=float)
+            light_off = np.array([second_of_day(value) for value in columns.light_off_at],
+                                 dtype=float)
+            enabled = ~np.isnan(light_on) & ~np.isnan(light_off)
+            active = np.where(
+                enabled, (seconds > light_on) & (seconds < light_off), active)
+
+        results[device_type] = has_device & active
+    return results
+
+
+def decide_series(settings: Settings, states: DeviceStates, samples: Sequence[Sample]) -> Dict[str, 'np.ndarray']:
+    """
+    Follow one environment through `samples` (oldest first), starting from `states`. Returns
+    whether each type of device is on after each sample, as boolean arrays.
+    """
+    import numpy as np
+
+    count = len(samples)
+    results = decide_batch(settings, states, samples)
+    if count == 0:
+        return results
+    _, temp, humidity = list(zip(*samples))[:3]
+
+    # Unlike the fan and light, the heater and humidifier depend on their previous state:
+    # each one keeps the state it was last switched to, starting from `states`
+    for device_type, values, target, tolerance in (
+        ('heater', temp, settings.temp_target, settings.temp_tolerance),
+        ('humidifier', humidity, settings.humidity_target, settings.humidity_tolerance)
+    ):
+        if getattr(states, device_type) is None:
+            continue
+        values = np.array(values, dtype=float)
+        switch_on = target - tolerance > values
+        switch_off = values - tolerance > target
+        switched = switch_on | switch_off
+
+        last_switch = np.maximum.accumulate(
+            np.where(switched, np.arange(count), -1))
+        results[device_type] = np.where(
+            last_switch >= 0, switch_on[last_switch], bool(getattr(states, device_type)))
+
+    return results
+
+
+def second_of_day(value) -> float:
+    """Get the number of seconds since midnight of a `datetime` or `time`, or NaN for None."""
+    if value is None:
+        return float('nan')
+    return value.hour * 60 * 60 + value.minute * 60 + value.second + value.microsecond / 1e6
+
+
+def _hysteresis(active, values, target, tolerance):
+    """Switch on below `target - tolerance` and off above `target + tolerance`. NaNs change nothing."""
+    switch_on = ~active & (target - tolerance > values)
+    switch_off = active & (values - tolerance > target)
+    return (active | switch_on) & ~switch_off
@@ -0,0 +1,146 @@
+"""
+Only write a `Reading` when something changed, and rebuild evenly spaced series from the
+readings that were written.
+
+A reading is written when temperature or humidity has moved by at least a deadband since
+the last reading written, when any device turns on or off, when a sensor starts or stops
+being stale, or when nothing has been written for `heartbeat_seconds`. In between, each
+value is taken to have stayed where it was last written.
+"""
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+from sqlalchemy import select
+from hothouse.postgres import get_session
+
+# Fields that are written whenever they change at all
+EXACT_FIELDS = ('fan_active', 'heater_active', 'humidifier_active',
+                'light_active', 'temp_stale', 'humidity_stale')
+
+
+class Deadband:
+    """Decides which of an environment's readings to write."""
+
+    def __init__(self, temp: Optional[float] = 0.5, humidity: Optional[float] = 0.01, heartbeat_seconds: float = 900):
+        # None means any change is written
+        self.temp = temp
+        self.humidity = humidity
+        self.heartbeat_seconds = heartbeat_seconds
+        self.last_written = None
+
+        # Metrics
+        self.written = 0
+        self.skipped = 0
+
+    def should_write(self, reading) -> bool:
+        """Whether to write `reading`. Readings that should be written are remembered as the last one written."""
+        if self._has_changed(reading):
+            # Copy the values, since the row expires once it's committed
+            self.last_written = {field: getattr(reading, field) for field in
+                                 ('at', 'temp', 'humidity', *EXACT_FIELDS)}
+            self.written += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def _has_changed(self, reading) -> bool:
+        last = self.last_written
+        if last is None:
+            return True
+        if (reading.at - last['at']).total_seconds() >= self.heartbeat_seconds:
+            return True
+        if any(bool(getattr(reading, field)) != bool(last[field]) for field in EXACT_FIELDS):
+            return True
+        return (has_moved(reading.temp, last['temp'], self.temp)
+                or has_moved(reading.humidity, last['humidity'], self.humidity))
+
+
+def has_moved(value, last_value, deadband: Optional[float]) -> bool:
+    if value is None or last_value is None:
+        return (value is None) != (last_value is None)
+    if deadband is None:
+        return float(value) != float(last_value)
+    return abs(float(value) - float(last_value)) >= deadband
+
+
+class Step(NamedTuple):
+    """An environment's conditions at a point in time, carried forward from the last written reading."""
+    at: datetime
+    temp: Optional[float]
+    humidity: Optional[float]
+    fan_active: Optional[bool]
+    heater_active: Optional[bool]
+    humidifier_active: Optional[bool]
+    light_active: Optional[bool]
+
+
+def resample(
+    readings: Iterable,
+    start_at: datetime,
+    end_at: datetime,
+    interval: timedelta,
+    max_age: Optional[timedelta] = None
+) -> List[Step]:
+    """
+    Turn readings (oldest first) into a `Step` every `interval` from `start_at` until `end_at`,
+    each with the values of the latest reading at or before it. Steps more than `max_age` after
+    that reading (e.g. because the process was stopped) have no values.
+    """
+    readings = iter(readings)
+    current = None
+    upcoming = next(readings, None)
+    steps = []
+    at = start_at
+    while at < end_at:
+        while upcoming is not None and upcoming.at <= at:
+            current, upcoming = upcoming, next(readings, None)
+
+        if current is None or (max_age is not None and at - current.at > max_age):
+            steps.append(Step(at, None, None, None, None, None, None))
+        else:
+            steps.append(Step(
+                at,
+                None if current.temp is None else float(current.temp),
+                None if current.humidity is None else float(
+                    current.humidity),
+                current.fan_active,
+                current.heater_active,
+                current.humidifier_active,
+                current.light_active
+            ))
+        at += interval
+    return steps
+
+
+def get_step_series(
+    environment_id: str,
+    start_at: datetime,
+    end_at: datetime,
+    interval: timedelta = timedelta(minutes=1),
+    heartbeat_seconds: float = 900
+) -> List[Step]:
+    """
+    Get an environment's conditions every `interval` between `start_at` and `end_at`, from
+    readings written in change-only mode (or normally). Values are carried forward for up to
+    `heartbeat_seconds` (plus one interval) after the reading they came from.
+    """
+    from hothouse.hothouse import Reading
+
+    max_age = timedelta(seconds=heartbeat_seconds) + interval
+    with get_session() as session:
+        # The last reading before `start_at` gives the values at `start_at`
+        previous_query = select(Reading).where(
+            Reading.environment_id == environment_id,
+            Reading.at <= start_at,
+            Reading.at >= start_at - max_age
+        ).order_by(Reading.at.desc()).limit(1)
+        readings_query = select(Reading).where(
+            Reading.environment_id == environment_id,
+            Reading.at > start_at,
+            Reading.at < end_at
+        ).order_by(Reading.at)
+
+        readings = list(session.execute(previous_query).scalars()) + \
+            list(session.execute(readings_query).scalars())
+
+    return resample(readings, start_at, end_at, interval, max_age)
@@ -0,0 +1,239 @@
+"""
+Export readings and device usages to gzipped CSV files, streamed straight out of Postgres
+with `COPY`, so exports of any size run in constant memory:
+
+    python -m hothouse.export_data exports/ --table readings --environment-id <id>
+
+Each run carries on from where the last one in the same directory stopped.
+"""
+import argparse
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, List, NamedTuple, Optional
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from hothouse.hothouse import DeviceUsage, Reading
+from hothouse.postgres import get_raw_connection
+
+# The models that can be exported, and the column that orders their rows in time
+EXPORTS = {
+    'readings': (Reading, 'at'),
+    'device_usages': (DeviceUsage, 'start_at'),
+}
+STATE_FILE = 'export-state.json'
+
+
+class ExportResult(NamedTuple):
+    table: str
+    rows: int
+    files: List[str]
+    # Everything up to and including this time has been exported
+    exported_until: datetime
+
+
+class ChunkWriter:
+    """
+    Receives CSV from `COPY ... TO STDOUT` one row at a time, and writes it to gzipped files of
+    about `chunk_rows` rows. A file is only finished once its rows are all written and the next
+    row has a later timestamp, so resuming from the last timestamp of the last finished file
+    never skips or repeats a row. `on_file` is called with the path and last timestamp of each
+    finished file.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str,
+        header: bytes,
+        chunk_rows: int,
+        first_file_number: int,
+        on_file: Callable[[str, datetime], None]
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.header = header
+        self.chunk_rows = chunk_rows
+        self.file_number = first_file_number
+        self.on_file = on_file
+
+        self.file: Optional[BinaryIO] = None
+        self.file_rows = 0
+        self.rows = 0
+        self.last_at: Optional[bytes] = None
+        # A row split between writes
+        self.partial = b''
+
+    def write(self, data: bytes) -> None:
+        lines = (self.partial + bytes(data)).split(b'\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self._write_row(line + b'\n')
+
+    def close(self) -> None:
+        """Finish the file being written, if any."""
+        if self.partial:
+            self._write_row(self.partial + b'\n')
+            self.partial = b''
+        self._finish_file()
+
+    def _write_row(self, row: bytes) -> None:
+        # The timestamp is the first column
+        at = row.split(b',', 1)[0]
+        if self.file_rows >= self.chunk_rows and at != self.last_at:
+            self._finish_file()
+        if self.file is None:
+            self.file = gzip.open(self._get_path() + '.tmp', 'wb')
+            self.file.write(self.header)
+
+        self.file.write(row)
+        self.file_rows += 1
+        self.rows += 1
+        self.last_at = at
+
+    def _finish_file(self) -> None:
+        if self.file is None:
+            return
+
+        self.file.close()
+        path = self._get_path()
+        # Only show complete files under their real name
+        os.replace(path + '.tmp', path)
+        self.file = None
+        self.file_rows = 0
+        self.file_number += 1
+        self.on_file(path, datetime.fromisoformat(self.last_at.decode()))
+
+    def _get_path(self) -> str:
+        return os.path.join(self.directory, f'{self.prefix}-{self.file_number:06d}.csv.gz')
+
+
+def read_state(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, STATE_FILE)) as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def write_state(directory: str, state: dict) -> None:
+    path = os.path.join(directory, STATE_FILE)
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def get_copy_sql(table: str, since: Optional[datetime], until: datetime, environment_id: Optional[str]) -> str:
+    """The `COPY` statement for rows of `table` after `since`, up to and including `until`."""
+    model, time_column_name = EXPORTS[table]
+    time_column = getattr(model, time_column_name)
+    columns = [time_column] + [column for column in model.__table__.columns
+                               if column.name != time_column_name]
+
+    query = select(*columns).where(time_column <=
+                                   until).order_by(time_column, model.id)
+    if since is not None:
+        query = query.where(time_column > since)
+    if environment_id is not None:
+        query = query.where(model.environment_id == environment_id)
+
+    # COPY can't take bind parameters, so the values are rendered (and escaped) inline
+    sql = query.compile(dialect=postgresql.pg8000.dialect(),
+                        compile_kwargs={'literal_binds': True})
+    return f'COPY ({sql}) TO STDOUT WITH (FORMAT csv)'
+
+
+def copy_to(sql: str, stream: ChunkWriter) -> None:
+    connection = get_raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(sql, stream=stream)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def export_table(
+    table: str,
+    directory: str,
+    environment_id: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    chunk_rows: int = 1000000
+) -> ExportResult:
+    """
+    Export the rows of `table` (`readings` or `device_usages`) to gzipped CSV files in
+    `directory`/`table`, oldest first, up to and including `until` (default: now). Rows start
+    after where the last export to the same directory stopped, or after `since` for a first
+    export. Each file has about `chunk_rows` rows.
+    """
+    model, time_column_name = EXPORTS[table]
+    table_directory = os.path.join(directory, table)
+    os.makedirs(table_directory, exist_ok=True)
+    until = until or datetime.now()
+
+    state = read_state(table_directory)
+    if state and state.get('environment_id') != environment_id:
+        raise ValueError(
+            f'{table_directory} has an export for environment {state.get("environment_id")}, '
+            f'not {environment_id}. Export to another directory.')
+    if state.get('exported_until'):
+        since = datetime.fromisoformat(state['exported_until'])
+    if since is not None and since >= until:
+        return ExportResult(table, 0, [], since)
+
+    files = []
+
+    def on_file(path: str, last_at: datetime) -> None:
+        files.append(path)
+        write_state(table_directory, {
+            'environment_id': environment_id,
+            'exported_until': last_at.isoformat(),
+            'next_file_number': writer.file_number
+        })
+
+    columns = [time_column_name] + [column.name for column in model.__table__.columns
+                                    if column.name != time_column_name]
+    writer = ChunkWriter(
+        table_directory, table, (','.join(columns) + '\n').encode(), chunk_rows,
+        state.get('next_file_number', 1), on_file)
+    copy_to(get_copy_sql(table, since, until, environment_id), writer)
+    writer.close()
+
+    # Every row up to `until` is exported now, even if the last file ended earlier
+    write_state(table_directory, {
+        'environment_id': environment_id,
+        'exported_until': until.isoformat(),
+        'next_file_number': writer.file_number
+    })
+    return ExportResult(table, writer.rows, files, until)
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory', help='Directory to write files to')
+    parser.add_argument('--table', choices=list(EXPORTS), action='append', dest='tables',
+                        help='Table to export (can be repeated, default: all)')
+    parser.add_argument('--environment-id',
+                        help='Only export rows for this environment')
+    parser.add_argument('--since', type=datetime.fromisoformat,
+                        help='For a first export, start after this time (default: the beginning)')
+    parser.add_argument('--until', type=datetime.fromisoformat,
+                        help='Export up to this time (default: --lag-minutes ago)')
+    parser.add_argument('--lag-minutes', type=float, default=10,
+                        help='Leave out the most recent rows, which may still be being written (default: 10)')
+    parser.add_argument('--chunk-rows', type=int, default=1000000,
+                        help='Rows per file (default: 1000000)')
+    options = parser.parse_args(args)
+
+    until = options.until or datetime.now() - timedelta(minutes=options.lag_minutes)
+    for table in options.tables or list(EXPORTS):
+        result = export_table(
+            table, options.directory, options.environment_id, options.since, until, options.chunk_rows)
+        print(f'{table}: exported {result.rows} rows to {len(result.files)} files, '
+              f'up to {result.exported_until.isoformat()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,10 @@
 import os
-from dotenv import dotenv_values
-
-config = dotenv_values()
+from hothouse.postgres import CONFIG
 
 
 def export_schema() -> None:
     export_schema_command = \
-        f"pg_dump -d {config.get('DB_NAME')} -U {config.get('PG_USERNAME')} " \
+        f"pg_dump -d {CONFIG['DB_NAME']} -U {CONFIG['PG_USERNAME']} " \
         f"--schema-only > create_hothouse_db_schema.psql"
     print(export_schema_command)
 
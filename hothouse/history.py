@@ -0,0 +1,128 @@
+"""
+A fixed-size, in-memory history of an environment's recent readings, so recent values and
+trends can be looked up without querying `hh.readings`.
+"""
+from array import array
+from datetime import datetime
+from math import isnan, nan
+from typing import List, Optional, Tuple
+
+# Fields that hold sensor values, and fields that hold device states (1 for on, 0 for off)
+VALUE_FIELDS = ('temp', 'humidity')
+STATE_FIELDS = ('fan_active', 'heater_active',
+                'humidifier_active', 'light_active')
+
+
+class History:
+    """
+    The last `size` readings of an environment, in a ring buffer of `array`s: appending is
+    O(1), and a window of time is a view of (at most two slices of) the arrays rather than
+    a copy. Timestamps are seconds since the epoch, and missing sensor values are NaN.
+    """
+
+    def __init__(self, size: int = 3600):
+        self.size = size
+        self.count = 0
+        # Where the oldest entry is
+        self.start = 0
+        self.fields = {'at': array('d', bytes(8 * size))}
+        for field in VALUE_FIELDS:
+            self.fields[field] = array('d', [nan]) * size
+        for field in STATE_FIELDS:
+            self.fields[field] = array('b', bytes(size))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, reading) -> None:
+        """Add a `Reading` (or anything with the same attributes), newer than any so far."""
+        if self.count < self.size:
+            index = (self.start + self.count) % self.size
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.size
+
+        self.fields['at'][index] = reading.at.timestamp()
+        for field in VALUE_FIELDS:
+            value = getattr(reading, field)
+            self.fields[field][index] = nan if value is None else float(value)
+        for field in STATE_FIELDS:
+            self.fields[field][index] = bool(getattr(reading, field))
+
+    def window(self, field: str, seconds: float = None) -> List[memoryview]:
+        """
+        Get views of a field's values from the last `seconds` before the latest entry (or all
+        of them), oldest first. There are two views when the window wraps around the end of the buffer.
+        """
+        first = self._find_first(seconds)
+        values = memoryview(self.fields[field])
+        start = (self.start + first) % self.size
+        end = start + self.count - first
+        if end <= self.size:
+            return [values[start:end]]
+        return [values[start:], values[:end - self.size]]
+
+    def latest(self, field: str) -> Optional[Tuple[datetime, float]]:
+        """Get the time and value of the most recent entry with a value for `field`."""
+        at = self.fields['at']
+        values = self.fields[field]
+        for i in range(self.count - 1, -1, -1):
+            index = (self.start + i) % self.size
+            if not isnan(values[index]):
+                return datetime.fromtimestamp(at[index]), values[index]
+        return None
+
+    def mean(self, field: str, seconds: float = None) -> Optional[float]:
+        values = self._values(field, seconds)
+        if not values:
+            return None
+        return sum(values) / len(values)
+
+    def min(self, field: str, seconds: float = None) -> Optional[float]:
+        return min(self._values(field, seconds), default=None)
+
+    def max(self, field: str, seconds: float = None) -> Optional[float]:
+        return max(self._values(field, seconds), default=None)
+
+    def slope(self, field: str, seconds: float = None) -> Optional[float]:
+        """How quickly a field has been changing, per second, from a least squares fit."""
+        points = [
+            (at, value)
+            for ats, values in zip(self.window('at', seconds), self.window(field, seconds))
+            for at, value in zip(ats, values)
+            if not isnan(value)
+        ]
+        if len(points) < 2:
+            return None
+
+        # Relative to the first timestamp, to keep the sums small
+        first_at = points[0][0]
+        mean_at = sum(at - first_at for at, _ in points) / len(points)
+        mean_value = sum(value for _, value in points) / len(points)
+        covariance = sum((at - first_at - mean_at) * (value - mean_value)
+                         for at, value in points)
+        variance = sum((at - first_at - mean_at) ** 2 for at, _ in points)
+        if not variance:
+            return None
+        return covariance / variance
+
+    def _values(self, field: str, seconds: Optional[float]) -> List[float]:
+        return [value for view in self.window(field, seconds) for value in view
+                if not isnan(value)]
+
+    def _find_first(self, seconds: Optional[float]) -> int:
+        """Binary search for the position (oldest first) of the first entry in the last `seconds`."""
+        if seconds is None or not self.count:
+            return 0
+
+        at = self.fields['at']
+        since = at[(self.start + self.count - 1) % self.size] - seconds
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if at[(self.start + middle) % self.size] < since:
+                low = middle + 1
+            else:
+                high = middle
+        return low
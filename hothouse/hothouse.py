@@ -1,10 +1,21 @@
 """Hothouse Table implementations"""
-from datetime import datetime
-from time import sleep
-from uuid import uuid4
-from sqlalchemy import Boolean, Column, Date, DateTime, Integer, Numeric, String, ForeignKey, Time, or_, select
-from sqlalchemy.orm import declarative_base, Session
+import logging
+from datetime import datetime, time
+from time import monotonic, sleep
+from typing import Dict, List, NamedTuple, Optional
+from sqlalchemy import Boolean, Column, Date, DateTime, FetchedValue, Integer, Numeric, String, ForeignKey, Time, Uuid, func, or_, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import declarative_base, object_session, Session
+from hothouse.control import DeviceStates, Sample, SwitchGuard, decide, get_settings, get_switch_limits
+from hothouse import metrics
+from hothouse.deadband import Deadband
+from hothouse.history import History
+from hothouse.ids import uuid7
+from hothouse.schedules import get_active_schedule, get_next_change
 from hothouse.postgres import get_session
+from hothouse.sensors import Sensor, read_sensors
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 # Make sure all subclasses of Base are in the `hothouse` schema
@@ -27,6 +38,14 @@ class Schedule(Base):
     light_off_at = Column(Time)
     temp = Column(Numeric)
     humidity = Column(Numeric)
+    # Which schedule wins when several are active at once, see `hothouse.schedules`
+    priority = Column(Integer, server_default=text('0'))
+    # Only active between these times of day, if set
+    phase_start_at = Column(Time)
+    phase_end_at = Column(Time)
+    # Set by a trigger whenever the row changes
+    updated_at = Column(DateTime, server_default=func.now(),
+                        server_onupdate=FetchedValue())
 
 
 class Reading(Base):
@@ -35,7 +54,8 @@ class Reading(Base):
     """
     __tablename__ = 'readings'
 
-    id = Column(String, primary_key=True)
+    # Time-ordered (see hothouse.ids), so new rows go at the end of the primary key index
+    id = Column(Uuid(as_uuid=False), primary_key=True)
     environment_id = Column(ForeignKey('hh.devices.id'))
     at = Column(DateTime)
     fan_id = Column(ForeignKey('hh.devices.id'))
@@ -48,6 +68,8 @@ class Reading(Base):
     light_id = Column(ForeignKey('hh.devices.id'))
     light_active = Column(Boolean)
     temp = Column(Numeric)
+    temp_stale = Column(Boolean)
+    humidity_stale = Column(Boolean)
 
 
 class Device(Base):
@@ -58,47 +80,92 @@ class Device(Base):
     voltage = Column(Numeric)
     watts = Column(Numeric)
     last_activated_at = Column(DateTime)
+    last_deactivated_at = Column(DateTime)
+    # Limits on switching the device (see `hothouse.control.SwitchGuard`), None for no limit
+    min_on_seconds = Column(Integer)
+    min_off_seconds = Column(Integer)
+    max_switches_per_hour = Column(Integer)
+
+    # Optionally set this to anything with an `add` method (like a `hothouse.postgres.BatchWriter`)
+    # to hand off `DeviceUsage` rows to a background writer. Otherwise, usage is saved with the
+    # session this device belongs to, or committed in a new session if it doesn't belong to one.
+    usage_writer = None
 
     def on(self, level: float = 1, at: datetime = None) -> None:
         self.active = True
         self.last_activated_at = at or datetime.now()
-        self._on(level)
+        with metrics.timer('device_on'):
+            self._on(level)
+        metrics.count_actuation(self, 'on')
 
     def _on(self, level) -> None:
         """Send a signal for the device to engage. Override this in custom Device classes!"""
         raise NotImplementedError
 
-    def off(self, environment_id: str, at: datetime = None) -> None:
+    def off(self, environment_id: str, at: datetime = None, usage_writer=None) -> None:
+        """
+        Turn the device off and record its usage. Usage goes to the device's own `usage_writer`
+        if it has one, then to `usage_writer` (e.g. the caller's session), then to the session
+        the device belongs to.
+        """
         self.active = False
-        self._off()
-        self._get_device_usage(environment_id, at=at or datetime.now())
+        self.last_deactivated_at = at or datetime.now()
+        with metrics.timer('device_off'):
+            self._off()
+        metrics.count_actuation(self, 'off')
+        device_usage = self._get_device_usage(
+            environment_id, at=self.last_deactivated_at)
+
+        if self.usage_writer is not None:
+            self.usage_writer.add(device_usage)
+            return
+        if usage_writer is not None:
+            usage_writer.add(device_usage)
+            return
+
+        session = object_session(self)
+        if session is not None:
+            # Join the caller's transaction, so usage is committed along with this device's state
+            session.add(device_usage)
+        else:
+            with metrics.timer('device_usage_commit'), get_session() as session:
+                session.add(device_usage)
+                session.commit()
 
     def _off(self) -> None:
         """Send a signal for the device to disengage. Override this in custom Device classes!"""
         raise NotImplementedError
 
-    def _get_device_usage(self, environment_id: str, at: datetime) -> None:
+    def _get_device_usage(self, environment_id: str, at: datetime) -> 'DeviceUsage':
         start_at = self.last_activated_at
         end_at = at
         seconds = round(end_at.timestamp() - start_at.timestamp())
-        kWh = (self.watts / 1000) * (seconds / 3600)
+        kWh = (float(self.watts or 0) / 1000) * (seconds / 3600)
+
+        return DeviceUsage(
+            id=str(uuid7()),
+            device_id=self.id,
+            environment_id=environment_id,
+            start_at=start_at,
+            end_at=end_at,
+            seconds=seconds,
+            kilowatt_hours=kWh
+        )
 
-        with get_session() as session:
-            session.add(DeviceUsage(
-                id=str(uuid4()),
-                device_id=self.id,
-                environment_id=environment_id,
-                start_at=start_at,
-                end_at=end_at,
-                seconds=seconds,
-                kilowatt_hours=kWh)
-            )
-            session.commit()
+
+def get_device_state(device: Device) -> dict:
+    """The columns of a `Device` that change when it's switched, for `Session.bulk_update_mappings`."""
+    return {
+        'id': device.id,
+        'active': device.active,
+        'last_activated_at': device.last_activated_at,
+        'last_deactivated_at': device.last_deactivated_at
+    }
 
 
 class DeviceUsage(Base):
     __tablename__ = 'device_usages'
-    id = Column(String, primary_key=True)
+    id = Column(Uuid(as_uuid=False), primary_key=True)
     device_id = Column(ForeignKey('hh.devices.id'))
     environment_id = Column(ForeignKey('hh.environments.id'))
     start_at = Column(DateTime)
@@ -107,6 +174,23 @@ class DeviceUsage(Base):
     kilowatt_hours = Column(Numeric)
 
 
+class RowCache(NamedTuple):
+    """The `Schedule` and `Device` rows an `Environment` needs between `valid_from` and `valid_until`."""
+    schedule: Optional[Schedule]
+    fan: Optional[Device]
+    heater: Optional[Device]
+    humidifier: Optional[Device]
+    light: Optional[Device]
+    valid_from: datetime
+    valid_until: Optional[datetime]
+    # The environment's version in a `ScheduleIndex` when the rows were loaded
+    schedule_version: Optional[int] = None
+
+    def is_valid(self, at: datetime, schedule_version: Optional[int] = None) -> bool:
+        return self.valid_from <= at and (self.valid_until is None or at < self.valid_until) \
+            and self.schedule_version == schedule_version
+
+
 class Environment(Base):
     """
     An environment represents an ecosystem that may include:
@@ -134,6 +218,68 @@ class Environment(Base):
     humidifier_class = Device
     light_class = Device
 
+    # Optionally set this to a `hothouse.postgres.BatchWriter` for `Reading` rows,
+    # so readings are written in bulk instead of committed one at a time
+    reading_writer = None
+
+    # Set this to True to keep the active `Schedule` and its `Device` rows in memory between
+    # readings. Call `invalidate_cache` after editing any of those rows outside of `take_reading`.
+    # While the database is unreachable, cached rows keep being used and devices keep being
+    # controlled; device states are saved with the next reading that commits.
+    cache_rows = False
+    _row_cache = None
+    _unsaved_device_states = None
+
+    # Sensors are read at the same time, and each read gives up after `sensor_timeout` seconds
+    # (None to wait forever). A failed read falls back to the last value for up to
+    # `sensor_max_age` seconds, flagged as stale on the `Reading`. Override `get_sensors`
+    # to set these (or oversampling and smoothing) for each sensor.
+    sensor_timeout = 5
+    sensor_max_age = 300
+    _sensors = None
+
+    # How many recent readings to keep in `history`
+    history_size = 3600
+    _history = None
+
+    # Set these to only write a reading when temperature or humidity moves by at least this
+    # much, a device or stale flag changes, or nothing has been written for `heartbeat_seconds`
+    # (see `hothouse.deadband`). None for both writes every reading.
+    temp_deadband = None
+    humidity_deadband = None
+    heartbeat_seconds = 900
+    _deadband = None
+
+    # Optionally set this to a `hothouse.schedules.ScheduleIndex` shared by every environment,
+    # to look up active schedules in memory instead of querying for them
+    schedule_index = None
+
+    # Holds back commands that would switch devices too often. Created on first use, so each
+    # environment counts its own suppressed commands in `switch_guard.suppressed`.
+    switch_guard = None
+
+    @property
+    def history(self) -> History:
+        """The most recent readings taken by this process (see `hothouse.history.History`)."""
+        if self._history is None:
+            self._history = History(self.history_size)
+        return self._history
+
+    @property
+    def deadband(self) -> Optional[Deadband]:
+        """Decides which readings to write, if change-only writes are turned on."""
+        if self.temp_deadband is None and self.humidity_deadband is None:
+            return None
+        if self._deadband is None:
+            self._deadband = Deadband(
+                self.temp_deadband, self.humidity_deadband, self.heartbeat_seconds)
+        return self._deadband
+
+    def should_write(self, reading: 'Reading') -> bool:
+        """Whether to write a reading, or leave it out because nothing changed."""
+        deadband = self.deadband
+        return deadband is None or deadband.should_write(reading)
+
     def get_temp(self) -> float:
         """Get the current temperature in this environment."""
 
@@ -141,10 +287,22 @@ class Environment(Base):
         """Get the current humidity in this environment."""
 
     def monitor(self, interval: int = 60):
-        """Take a new reading of the environment conditions every `interval` seconds."""
+        """
+        Take a new reading of the environment conditions every `interval` seconds.
+        To monitor many environments from one process, use `hothouse.Monitor` instead.
+        """
+        next_at = monotonic()
         while True:
-            self.take_reading()
-            sleep(interval)
+            try:
+                self.take_reading()
+            except Exception:
+                # Keep controlling devices, as `hothouse.Monitor` does
+                logger.exception('Reading failed for environment %s', self.id)
+            # Keep a fixed rate, rather than sleeping a full interval after each reading
+            next_at = max(next_at + interval, monotonic())
+            # A reading that ran past `interval` leaves no time to sleep
+            delay = next_at - monotonic()
+            sleep(max(0, delay))
 
     def take_reading(self, at: datetime = None) -> None:
         """
@@ -152,101 +310,293 @@ class Environment(Base):
         - Dispatch any events to controllers whose status should change
           based on the schedule and conditions.
         """
+        with metrics.timer('sensor_read'):
+            sample = self.sample(at)
+
+        session: Session
+        with get_session() as session:
+            with metrics.timer('load_rows'):
+                schedule, fan, heater, humidifier, light = self._get_rows(
+                    session, sample.at)
+            if schedule is None:
+                return
+
+            devices = [device for device in (fan, heater, humidifier, light)
+                       if device is not None]
+            if self.cache_rows:
+                before = [get_device_state(device) for device in devices]
+            with metrics.timer('control'):
+                # Cached devices don't belong to the session, so hand it their usage directly
+                reading = self.control(
+                    sample, schedule, fan, heater, humidifier, light, usage_writer=session)
+            self.history.append(reading)
+
+            if self.should_write(reading):
+                if self.reading_writer is not None:
+                    self.reading_writer.add(reading)
+                else:
+                    session.add(reading)
+
+            if self.cache_rows:
+                if self._unsaved_device_states is None:
+                    self._unsaved_device_states = {}
+                for device, state in zip(devices, before):
+                    after = get_device_state(device)
+                    if after != state:
+                        self._unsaved_device_states[device.id] = after
+
+            # Rows that are lost if the commit fails, unlike rows handed to a writer
+            pending = list(session.new)
+            try:
+                with metrics.timer('reading_commit'):
+                    if self._unsaved_device_states:
+                        session.bulk_update_mappings(
+                            Device, list(self._unsaved_device_states.values()))
+                    session.commit()
+            except Exception as error:
+                if self._deadband is not None and reading in pending:
+                    # The reading wasn't written, so write the next one
+                    self._deadband.last_written = None
+                if self.cache_rows and not pending and isinstance(error, DBAPIError):
+                    # Cached devices keep the state they were switched to, and their unsaved
+                    # states are written with the next reading that commits
+                    logger.warning('Failed to save device states for environment %s, '
+                                   'will retry with the next reading: %s', self.id, error.orig)
+                    return
+                raise
+            if self.cache_rows:
+                self._unsaved_device_states = {}
+
+    def get_sensors(self) -> Dict[str, Sensor]:
+        """Get the sensors to read in this environment, named after the `Sample` fields they fill in."""
+        return {
+            'temp': Sensor(lambda: self.get_temp(), self.sensor_timeout, max_age=self.sensor_max_age),
+            'humidity': Sensor(lambda: self.get_humidity(), self.sensor_timeout, max_age=self.sensor_max_age)
+        }
+
+    def sample(self, at: datetime = None) -> Sample:
+        """Read the sensors in this environment."""
+        at = at or datetime.now()
+        if self._sensors is None:
+            self._sensors = self.get_sensors()
+
+        values = read_sensors(self._sensors)
+        temp, humidity = values['temp'], values['humidity']
+        return Sample(at, temp.value, humidity.value, temp.stale, humidity.stale)
+
+    def control(
+        self,
+        sample: Sample,
+        schedule: Schedule,
+        fan: Optional[Device],
+        heater: Optional[Device],
+        humidifier: Optional[Device],
+        light: Optional[Device],
+        switch_guard: SwitchGuard = None,
+        usage_writer=None
+    ) -> Reading:
+        """
+        Turn devices on or off based on a `Sample` and the active `Schedule`,
+        and return the `Reading` that describes the result. Usage of devices
+        turned off goes to `usage_writer` if given (see `Device.off`).
+        """
+        if switch_guard is None:
+            if self.switch_guard is None:
+                self.switch_guard = SwitchGuard()
+            switch_guard = self.switch_guard
+
+        now, temp, humidity = sample.at, sample.temp, sample.humidity
+        devices = {'fan': fan, 'heater': heater,
+                   'humidifier': humidifier, 'light': light}
+        states = DeviceStates(**{
+            device_type: None if device is None else bool(device.active)
+            for device_type, device in devices.items()
+        })
+
+        for command in decide(get_settings(self, schedule), states, sample):
+            device: Device = devices[command.device_type]
+            if not switch_guard.allow(
+                command, device.id, get_switch_limits(device), now,
+                device.last_activated_at, device.last_deactivated_at
+            ):
+                continue
+
+            if command.active:
+                device.on(at=now)
+            else:
+                device.off(self.id, at=now, usage_writer=usage_writer)
+
+        return Reading(
+            id=str(uuid7()),
+            at=now,
+            environment_id=self.id,
+            fan_id=self.fan_id,
+            fan_active=fan and fan.active or False,
+            heater_id=self.heater_id,
+            heater_active=heater and heater.active or False,
+            light_id=self.light_id,
+            light_active=light and light.active or False,
+            humidifier_id=self.humidifier_id,
+            humidifier_active=humidifier and humidifier.active or False,
+            humidity=humidity,
+            temp=temp,
+            temp_stale=sample.temp_stale,
+            humidity_stale=sample.humidity_stale
+        )
+
+    def reconcile_device_usages(self, at: datetime = None) -> List[DeviceUsage]:
+        """
+        Record energy use that was never saved because the process stopped unexpectedly.
+        Call this on startup, before taking any readings.
+            - Devices that are still on get their usage up until `at` recorded, and are
+              treated as activated again at `at`.
+            - Devices that are off, but whose last activation has no `DeviceUsage`, get
+              one that ends at the first reading that saw them off.
+        """
         now = at or datetime.now()
-        humidity = self.get_humidity()
-        temp = self.get_temp()
+        device_usages = []
 
         session: Session
         with get_session() as session:
-            schedule_query = select(Schedule).where(
-                Schedule.environment_id == self.id,
-                Schedule.start_date < now,
-                or_(Schedule.end_date == None, Schedule.end_date > now)
-            )
-
-            schedule = session.execute(schedule_query).scalars().one_or_none()
-            if schedule is not None:
-                fan: Device = session.get(self.fan_class, self.fan_id)
-                heater: Device = session.get(self.heater_class, self.heater_id)
-                humidifier: Device = session.get(
-                    self.humidifier_class, self.humidifier_id)
-                light: Device = session.get(self.light_class, self.light_id)
-
-                # Temp control
-                if temp is not None and heater is not None:
-                    temp_target = float(
-                        schedule.temp or self.temp_default or 70)
-                    temp_tolerance = float(self.temp_tolerance or 3)
-
-                    # Check if the current temperature below the allowable tolerance
-                    if not heater.active and (temp_target - temp_tolerance > temp):
-                        heater.active = True
-                        heater.on(at=now)
-
-                    # Check if the current temperature above the allowable tolerance
-                    elif heater.active and (temp - temp_tolerance > temp_target):
-                        heater.active = False
-                        heater.off(self.id, at=now)
-
-                # Humidity control
-                if humidity is not None and humidifier is not None:
-                    humidity_target = float(
-                        schedule.humidity or self.humidity_default or 0.5)
-                    humidity_tolerance = float(self.humidity_tolerance or 0.1)
-
-                    # Check if the current humidity below the allowable tolerance
-                    if not humidifier.active and (humidity_target - humidity_tolerance > humidity):
-                        humidifier.active = True
-                        humidifier.on(at=now)
-
-                    # Check if the current humidity above the allowable tolerance
-                    elif humidifier.active and (humidity - humidity_tolerance > humidity_target):
-                        humidifier.active = False
-                        humidifier.off(self.id, at=now)
-
-                # Fan control
-                if fan is not None and schedule.fan_on_seconds and schedule.fan_off_seconds:
-                    this_second = (now.hour * 60 * 60) + \
-                        (now.minute * 60) + now.second
-                    fan_total_period = schedule.fan_on_seconds + schedule.fan_off_seconds
-
-                    # Check if the current second falls within the period when the fan should be on
-                    during_fan_on = this_second % fan_total_period < schedule.fan_on_seconds
-                    if not fan.active and during_fan_on:
-                        fan.active = True
-                        fan.on(at=now)
-
-                    elif fan.active and not during_fan_on:
-                        fan.active = False
-                        fan.off(self.id, at=now)
-
-                # Light control
-                if light is not None and schedule.light_on_at and schedule.light_off_at:
-                    now_time = now.time()
-                    during_light_on = now_time > schedule.light_on_at and now_time < schedule.light_off_at
-                    if not light.active and during_light_on:
-                        light.active = True
-                        light.on(at=now)
-
-                    elif light.active and not during_light_on:
-                        light.active = False
-                        light.off(self.id, at=now)
-
-                reading = Reading(
-                    id=str(uuid4()),
-                    at=now,
-                    environment_id=self.id,
-                    fan_id=self.fan_id,
-                    fan_active=fan and fan.active or False,
-                    heater_id=self.heater_id,
-                    heater_active=heater and heater.active or False,
-                    light_id=self.light_id,
-                    light_active=light and light.active or False,
-                    humidifier_id=self.humidifier_id,
-                    humidifier_active=humidifier and humidifier.active or False,
-                    humidity=humidity,
-                    temp=temp
-                )
-
-                session.add(reading)
-                session.commit()
+            session.expire_on_commit = False
+            for device_type in ('fan', 'heater', 'humidifier', 'light'):
+                device_id = getattr(self, f'{device_type}_id')
+                device: Device = device_id and session.get(Device, device_id)
+                if device is None or device.last_activated_at is None:
+                    continue
+
+                if device.active:
+                    end_at = now
+                    if end_at <= device.last_activated_at:
+                        continue
+                else:
+                    recorded_query = select(DeviceUsage.id).where(
+                        DeviceUsage.device_id == device.id,
+                        DeviceUsage.start_at == device.last_activated_at
+                    ).limit(1)
+                    if session.execute(recorded_query).first() is not None:
+                        continue
+
+                    active_column = getattr(Reading, f'{device_type}_active')
+                    end_at_query = select(func.min(Reading.at)).where(
+                        Reading.environment_id == self.id,
+                        Reading.at > device.last_activated_at,
+                        active_column == False
+                    )
+                    end_at = session.execute(end_at_query).scalar()
+                    if end_at is None:
+                        continue
+
+                device_usage = device._get_device_usage(self.id, end_at)
+                session.add(device_usage)
+                device_usages.append(device_usage)
+                if device.active:
+                    device.last_activated_at = now
+
+            session.commit()
+
+        self.invalidate_cache()
+        return device_usages
+
+    def invalidate_cache(self) -> None:
+        """Forget the cached `Schedule` and `Device` rows, so the next reading loads them again."""
+        self._row_cache = None
+
+    def _get_rows(self, session: Session, now: datetime) -> tuple:
+        """Get the active `Schedule` and this environment's devices, from the cache if possible."""
+        if not self.cache_rows:
+            return self._query_rows(session, now)
+
+        if not self._is_row_cache_valid(now):
+            self._row_cache = self._reload_row_cache(session, now)
+        return self._row_cache[:5]
+
+    def get_rows(self, at: datetime = None) -> RowCache:
+        """
+        Get the active `Schedule` and this environment's devices from the cache, loading them
+        in a short-lived session if needed. The rows are detached, so they can be used (and
+        changed) without holding a session open.
+        """
+        now = at or datetime.now()
+        if not self._is_row_cache_valid(now):
+            with get_session() as session:
+                self._row_cache = self._reload_row_cache(session, now)
+        return self._row_cache
+
+    def _is_row_cache_valid(self, now: datetime) -> bool:
+        """Whether the cached rows are still right, and the schedule index hasn't changed them since."""
+        schedule_version = None if self.schedule_index is None else \
+            self.schedule_index.get_version(self.id)
+        return self._row_cache is not None and self._row_cache.is_valid(now, schedule_version)
+
+    def _reload_row_cache(self, session: Session, now: datetime) -> RowCache:
+        """Load the rows again, or keep the ones already cached if the database can't be reached."""
+        try:
+            return self._load_row_cache(session, now)
+        except DBAPIError:
+            if self._row_cache is None:
+                raise
+            logger.warning('Failed to load rows for environment %s, using the cached ones',
+                           self.id, exc_info=True)
+            session.rollback()
+            return self._row_cache
+
+    def _load_row_cache(self, session: Session, now: datetime) -> RowCache:
+        # Taken first, so schedules refreshed while loading make the rows stale again
+        schedule_version = None if self.schedule_index is None else \
+            self.schedule_index.get_version(self.id)
+        rows = self._query_rows(session, now)
+        valid_until = self._get_valid_until(session, rows[0], now)
+        for row in rows:
+            # Schedules from a `ScheduleIndex` aren't in the session
+            if row is not None and row in session:
+                # Detach the rows, so they outlive this session even if it's rolled back
+                session.expunge(row)
+        for device in rows[1:5]:
+            # Devices switched while their state couldn't be saved are in that state still
+            state = device is not None and self._unsaved_device_states and \
+                self._unsaved_device_states.get(device.id)
+            if state:
+                for key, value in state.items():
+                    setattr(device, key, value)
+        return RowCache(*rows, now, valid_until, schedule_version)
+
+    def _query_rows(self, session: Session, now: datetime) -> tuple:
+        if self.schedule_index is not None:
+            schedule = self.schedule_index.get_active(self.id, now)
+        else:
+            schedule = get_active_schedule(
+                self._query_schedules(session, now), now)
+        if schedule is None:
+            return None, None, None, None, None
+
+        fan: Device = session.get(self.fan_class, self.fan_id)
+        heater: Device = session.get(self.heater_class, self.heater_id)
+        humidifier: Device = session.get(
+            self.humidifier_class, self.humidifier_id)
+        light: Device = session.get(self.light_class, self.light_id)
+        return schedule, fan, heater, humidifier, light
+
+    def _query_schedules(self, session: Session, now: datetime) -> List[Schedule]:
+        """Get the schedules that are active on the day of `now`, ignoring their phases."""
+        schedule_query = select(Schedule).where(
+            Schedule.environment_id == self.id,
+            Schedule.start_date <= now,
+            or_(Schedule.end_date == None, Schedule.end_date > now)
+        )
+        return session.execute(schedule_query).scalars().all()
+
+    def _get_valid_until(self, session: Session, schedule: Optional[Schedule], now: datetime) -> Optional[datetime]:
+        """Cached rows stay valid until the active schedule could change (see `hothouse.schedules`)."""
+        if self.schedule_index is not None:
+            return self.schedule_index.get_next_change(self.id, now)
+
+        next_start_query = select(func.min(Schedule.start_date)).where(
+            Schedule.environment_id == self.id,
+            Schedule.start_date > now
+        )
+        next_start_date = session.execute(next_start_query).scalar()
+        changes = [get_next_change(self._query_schedules(session, now), now)]
+        if next_start_date is not None:
+            changes.append(datetime.combine(next_start_date, time()))
+        return min((change for change in changes if change is not None), default=None)
@@ -0,0 +1,33 @@
+"""Generate time-ordered ids, so new rows are added at the end of primary key indexes."""
+from os import urandom
+from threading import Lock
+from time import time_ns
+from uuid import UUID
+
+_lock = Lock()
+_last_timestamp = 0
+
+
+def uuid7() -> UUID:
+    """
+    A version 7 UUID (RFC 9562): the Unix time in milliseconds, then a finer fraction of the
+    millisecond, then random bits. Ids made by one process always increase.
+    """
+    global _last_timestamp
+    with _lock:
+        # Milliseconds (48 bits) and 4096ths of a millisecond (12 bits)
+        timestamp = time_ns() * 4096 // 1000000
+        if timestamp <= _last_timestamp:
+            timestamp = _last_timestamp + 1
+        _last_timestamp = timestamp
+
+    milliseconds, fraction = divmod(timestamp, 4096)
+    random_bits = int.from_bytes(urandom(8), 'big') & ((1 << 62) - 1)
+    value = (
+        (milliseconds & ((1 << 48) - 1)) << 80
+        | 0x7 << 76
+        | fraction << 64
+        | 0b10 << 62
+        | random_bits
+    )
+    return UUID(int=value)
@@ -0,0 +1,298 @@
+"""
+Optional metrics for the control loop: how long each stage of a reading takes, how often
+devices are switched, how many database round trips are made and how far behind pipelines
+are, in Prometheus' text format.
+
+Nothing is collected until `enable` (or `serve`) is called. Until then, each instrumented
+stage costs one function call that returns a shared do-nothing context manager.
+"""
+import logging
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+from weakref import WeakSet
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{escape_label(value)}"' for name, value in labels)
+    return '{' + pairs + '}'
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A number that only goes up, per set of labels."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(
+                    f'{self.name}{format_labels(labels)} {format_number(value)}')
+        return lines
+
+
+class Gauge:
+    """A number that goes up and down (e.g. a queue's length), per set of labels."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: Dict[Labels, float] = {}
+        self.lock = Lock()
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} gauge']
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(
+                    f'{self.name}{format_labels(labels)} {format_number(value)}')
+        return lines
+
+
+class Histogram:
+    """Counts of observed values (e.g. durations) in buckets, per set of labels."""
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # Per set of labels: the count in each bucket (plus one for +Inf), and the sum
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts_and_sum = self.values.get(key)
+            if counts_and_sum is None:
+                counts_and_sum = self.values[key] = (
+                    [0] * (len(self.buckets) + 1), [0.0])
+            counts, total = counts_and_sum
+            counts[index] += 1
+            total[0] += value
+
+    def get_count(self, **labels) -> int:
+        counts_and_sum = self.values.get(tuple(sorted(labels.items())))
+        return 0 if counts_and_sum is None else sum(counts_and_sum[0])
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float('inf')), counts):
+                    cumulative += count
+                    bucket_labels = (*labels, ('le', format_number(bound)))
+                    lines.append(
+                        f'{self.name}_bucket{format_labels(bucket_labels)} {cumulative}')
+                lines.append(
+                    f'{self.name}_sum{format_labels(labels)} {format_number(total[0])}')
+                lines.append(
+                    f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """The metrics collected by `hothouse`."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.stage_seconds = Histogram(
+            'hothouse_stage_seconds', 'Time spent in each stage of the control loop.', buckets)
+        self.actuations = Counter(
+            'hothouse_actuations_total', 'Devices switched on or off.')
+        self.db_sessions = Counter(
+            'hothouse_db_sessions_total', 'Database sessions opened.')
+        self.db_round_trips = Counter(
+            'hothouse_db_round_trips_total', 'Statements, commits and rollbacks sent to the database.')
+        self.db_seconds = Histogram(
+            'hothouse_db_seconds', 'Time spent waiting on database statements.', buckets)
+        self.queue_depth = Gauge(
+            'hothouse_pipeline_queue_depth', 'Rows waiting to be written by a pipeline.')
+        self.dropped = Counter(
+            'hothouse_pipeline_dropped_total', 'Readings dropped because a pipeline queue was full.')
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.stage_seconds, self.actuations, self.db_sessions,
+                       self.db_round_trips, self.db_seconds, self.queue_depth, self.dropped):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class Timer:
+    """Time the body of a `with` block as a stage of the control loop."""
+
+    def __init__(self, histogram: Histogram, stage: str):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self) -> 'Timer':
+        self.started_at = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(
+            perf_counter() - self.started_at, stage=self.stage)
+
+
+# The metrics being collected, or None when metrics are turned off
+registry: Optional[Registry] = None
+NULL_TIMER = nullcontext()
+# Engines with event listeners that count round trips (whenever metrics are on)
+instrumented_engines = WeakSet()
+
+
+def enable(buckets: Sequence[float] = DEFAULT_BUCKETS) -> Registry:
+    """Start collecting metrics, unless they already are."""
+    global registry
+    if registry is None:
+        registry = Registry(buckets)
+    return registry
+
+
+def disable() -> None:
+    """Stop collecting metrics, and forget the ones collected so far."""
+    global registry
+    registry = None
+
+
+def timer(stage: str):
+    """A context manager that times a stage, e.g. `with metrics.timer('sensor_read'): ...`"""
+    if registry is None:
+        return NULL_TIMER
+    return Timer(registry.stage_seconds, stage)
+
+
+def count_actuation(device, action: str) -> None:
+    """Count a device being switched `on` or `off`."""
+    if registry is not None:
+        registry.actuations.inc(device=device.name or device.id, action=action)
+
+
+def set_queue_depth(environment_id: str, depth: int) -> None:
+    """Record how many rows a pipeline has waiting to be written."""
+    if registry is not None:
+        registry.queue_depth.set(depth, environment=environment_id)
+
+
+def count_dropped(environment_id: str, amount: int = 1) -> None:
+    """Count readings a pipeline dropped because its queue was full."""
+    if registry is not None:
+        registry.dropped.inc(amount, environment=environment_id)
+
+
+def count_session(engine) -> None:
+    """Count a new database session, and start counting round trips for its engine."""
+    if registry is None:
+        return
+
+    registry.db_sessions.inc()
+    if engine not in instrumented_engines:
+        instrumented_engines.add(engine)
+        instrument_engine(engine)
+
+
+def instrument_engine(engine) -> None:
+    """Count statements, commits and rollbacks sent through `engine`, and time the statements."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        connection.info['hothouse_started_at'] = perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_execute(connection, cursor, statement, parameters, context, executemany) -> None:
+        started_at = connection.info.pop('hothouse_started_at', None)
+        if registry is not None and started_at is not None:
+            registry.db_round_trips.inc(operation='execute')
+            registry.db_seconds.observe(
+                perf_counter() - started_at, operation='execute')
+
+    @event.listens_for(engine, 'commit')
+    def count_commit(connection) -> None:
+        if registry is not None:
+            registry.db_round_trips.inc(operation='commit')
+
+    @event.listens_for(engine, 'rollback')
+    def count_rollback(connection) -> None:
+        if registry is not None:
+            registry.db_round_trips.inc(operation='rollback')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        current = registry
+        body = (current.render() if current is not None else '').encode()
+        self.send_response(200)
+        self.send_header(
+            'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format, *args)
+
+
+def serve(port: int = 9464, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Collect metrics, and serve them at `http://<host>:<port>/metrics` from a background thread.
+    Call `shutdown()` on the returned server to stop serving.
+    """
+    enable()
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
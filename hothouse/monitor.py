@@ -0,0 +1,132 @@
+"""Drive many environments from a single asyncio event loop."""
+
+import asyncio
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Optional
+from hothouse.hothouse import Environment
+
+logger = logging.getLogger(__name__)
+
+
+class MonitoredEnvironment:
+    """Bookkeeping for one `Environment` driven by a `Monitor`."""
+
+    def __init__(self, environment: Environment, interval: float):
+        self.environment = environment
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+        # The reading running (or waiting to run) on the thread pool, if any
+        self.reading: Optional[Future] = None
+        self.readings = 0
+        self.errors = 0
+        # Ticks that were skipped because the previous reading was still running
+        self.skipped = 0
+        self.last_duration: Optional[float] = None
+
+    async def wait(self) -> None:
+        """Wait for a reading still running on the thread pool, e.g. after this environment is removed."""
+        if self.reading is not None:
+            await asyncio.wait([asyncio.wrap_future(self.reading)])
+
+
+class Monitor:
+    """
+    Take readings for many environments on fixed-rate schedules.
+
+    Each environment gets its own asyncio task that wakes on multiples of its
+    `interval`, so the time spent taking a reading doesn't push later readings
+    back. Readings block on sensors, devices and the database, so they run on a
+    thread pool of at most `max_workers` threads. An environment never has more
+    than one reading in flight: if a reading overruns its interval, the ticks
+    it missed are skipped rather than queued up behind it.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self.max_workers = max_workers
+        self.environments: Dict[str, MonitoredEnvironment] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.stopped: Optional[asyncio.Event] = None
+
+    def add(self, environment: Environment, interval: float = 60) -> MonitoredEnvironment:
+        """Start taking readings for `environment` every `interval` seconds."""
+        if environment.id in self.environments:
+            raise ValueError(f'Environment {environment.id} is already monitored')
+
+        monitored = MonitoredEnvironment(environment, interval)
+        self.environments[environment.id] = monitored
+        if self.stopped is not None:
+            self._start(monitored)
+        return monitored
+
+    def remove(self, environment_id: str) -> MonitoredEnvironment:
+        """
+        Stop taking readings for an environment. A reading that's already running carries on
+        in its thread; await `wait` on the returned `MonitoredEnvironment` to wait for it.
+        """
+        monitored = self.environments.pop(environment_id)
+        if monitored.task is not None:
+            monitored.task.cancel()
+        return monitored
+
+    def stop(self) -> None:
+        """Stop every environment and let `run` return."""
+        if self.stopped is not None:
+            self.stopped.set()
+
+    def start(self) -> None:
+        """Run the monitor in a new event loop until `stop` is called."""
+        asyncio.run(self.run())
+
+    async def run(self) -> None:
+        """Run the monitor in the current event loop until `stop` is called."""
+        self.stopped = asyncio.Event()
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix='hothouse')
+        try:
+            for monitored in self.environments.values():
+                self._start(monitored)
+            await self.stopped.wait()
+        finally:
+            tasks = [monitored.task for monitored in self.environments.values()
+                     if monitored.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for monitored in self.environments.values():
+                monitored.task = None
+
+            # Wait for readings still running on other threads, without blocking the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+            self.stopped = None
+
+    def _start(self, monitored: MonitoredEnvironment) -> None:
+        monitored.task = asyncio.get_running_loop().create_task(
+            self._drive(monitored))
+
+    async def _drive(self, monitored: MonitoredEnvironment) -> None:
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        while True:
+            await asyncio.sleep(max(0, next_at - loop.time()))
+
+            started_at = loop.time()
+            try:
+                monitored.reading = self.executor.submit(
+                    monitored.environment.take_reading)
+                await asyncio.wrap_future(monitored.reading)
+                monitored.readings += 1
+            except Exception:
+                monitored.errors += 1
+                logger.exception(
+                    'Reading failed for environment %s', monitored.environment.id)
+            finished_at = loop.time()
+            monitored.last_duration = finished_at - started_at
+
+            # Stay on the original schedule, skipping any ticks this reading overran
+            next_at += monitored.interval
+            if finished_at > next_at:
+                missed = int((finished_at - next_at) // monitored.interval) + 1
+                monitored.skipped += missed
+                next_at += missed * monitored.interval
@@ -0,0 +1,245 @@
+"""Keep device control independent of how quickly the database accepts writes."""
+
+import logging
+from datetime import datetime
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Dict, List, Optional
+from sqlalchemy.orm import Session
+from hothouse import metrics
+from hothouse.hothouse import Device, Environment, Reading, Sample, get_device_state
+from hothouse.postgres import get_session
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """
+    Take readings for an `Environment` in three stages:
+        - sampling: read the sensors
+        - control: turn devices on or off based on the latest sample, right away
+        - persistence: write readings, device usages and device states from a
+          background thread, draining a bounded queue
+
+    The schedule and devices are kept in memory (see `Environment.get_rows`),
+    so the first two stages never wait on the database. If the database falls
+    behind and the queue fills up, the oldest queued readings are dropped and
+    counted in `dropped`. Device usages are the only record of energy use, so
+    they're kept apart from readings. Past `max_usages` waiting usages, new
+    ones go to `spool` (e.g. a `hothouse.postgres.Spool`) if there is one;
+    otherwise the oldest are dropped and counted in `dropped_usages`. Device
+    states are never dropped: only the most recent state of each device is
+    written.
+
+    Rows still unwritten when the pipeline is closed (because the database is
+    down) are handed to `spool`, or logged and kept in `unwritten`.
+
+    A `Pipeline` can be handed to a `hothouse.Monitor` in place of the
+    environment it wraps.
+    """
+
+    def __init__(
+        self,
+        environment: Environment,
+        max_queue_size: int = 1000,
+        max_batch_size: int = 500,
+        retry_seconds: float = 5,
+        max_usages: int = 10000,
+        spool=None
+    ):
+        self.environment = environment
+        self.max_batch_size = max_batch_size
+        self.retry_seconds = retry_seconds
+        self.max_usages = max_usages
+        self.spool = spool
+
+        self.queue: Queue = Queue(maxsize=max_queue_size)
+        # Rows other than readings (i.e. device usages), kept apart so they're never dropped
+        self.usages: List = []
+        self.usages_lock = Lock()
+        self.device_states: Dict[str, dict] = {}
+        self.device_states_lock = Lock()
+        self.latest_sample: Optional[Sample] = None
+
+        # Metrics
+        self.dropped = 0
+        self.dropped_usages = 0
+        self.written = 0
+        # Rows that couldn't be written or spooled before closing
+        self.unwritten: List = []
+        self.last_write_duration: Optional[float] = None
+
+        self.closed = Event()
+        self.writer = Thread(target=self._persist, daemon=True)
+        self.writer.start()
+
+    @property
+    def id(self) -> str:
+        return self.environment.id
+
+    @property
+    def queue_depth(self) -> int:
+        """How many rows are waiting to be written."""
+        return self.queue.qsize() + len(self.usages)
+
+    def take_reading(self, at: datetime = None) -> Optional[Reading]:
+        """Sample the environment, act on the sample and queue the results to be written."""
+        with metrics.timer('sensor_read'):
+            sample = self.environment.sample(at)
+        self.latest_sample = sample
+        return self.control(sample)
+
+    def control(self, sample: Sample) -> Optional[Reading]:
+        """Act on a `Sample` using the in-memory schedule and devices."""
+        rows = self.environment.get_rows(sample.at)
+        if rows.schedule is None:
+            return None
+
+        devices: List[Device] = [
+            device for device in (rows.fan, rows.heater, rows.humidifier, rows.light)
+            if device is not None]
+        before = [get_device_state(device) for device in devices]
+
+        with metrics.timer('control'):
+            # Usage is queued here, unless a device has a `usage_writer` of its own
+            reading = self.environment.control(sample, *rows[:5], usage_writer=self)
+        self.environment.history.append(reading)
+
+        with self.device_states_lock:
+            for device, state in zip(devices, before):
+                after = get_device_state(device)
+                if after != state:
+                    self.device_states[device.id] = after
+
+        if self.environment.should_write(reading):
+            self.add(reading)
+        return reading
+
+    def add(self, row) -> None:
+        """Queue a row to be written. A full queue makes room by dropping its oldest reading."""
+        if not isinstance(row, Reading):
+            with self.usages_lock:
+                if len(self.usages) >= self.max_usages:
+                    if self.spool is not None:
+                        self.spool.add(row)
+                        return
+                    self.usages.pop(0)
+                    self.dropped_usages += 1
+                    logger.warning(
+                        'Dropped a device usage for environment %s, %s are waiting to be written',
+                        self.id, len(self.usages))
+                self.usages.append(row)
+            metrics.set_queue_depth(self.id, self.queue_depth)
+            return
+
+        while True:
+            try:
+                self.queue.put_nowait(row)
+                break
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                    metrics.count_dropped(self.id)
+                except Empty:
+                    pass
+        metrics.set_queue_depth(self.id, self.queue_depth)
+
+    def close(self, timeout: float = None) -> None:
+        """
+        Write everything that's been queued, then stop the persistence thread. If the
+        database is down, unwritten rows are handed to `spool` (see the class docstring).
+        """
+        self.closed.set()
+        self.writer.join(timeout)
+
+    def _persist(self) -> None:
+        batch = []
+        while True:
+            if not batch:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+
+            with self.device_states_lock:
+                device_states, self.device_states = self.device_states, {}
+
+            started_at = monotonic()
+            try:
+                session: Session
+                with metrics.timer('pipeline_write'), get_session() as session:
+                    session.add_all(batch)
+                    if device_states:
+                        session.bulk_update_mappings(
+                            Device, list(device_states.values()))
+                    session.commit()
+            except Exception:
+                logger.exception(
+                    'Failed to write %s rows for environment %s', len(batch), self.id)
+                self._restore_device_states(device_states)
+                # Hold on to the batch and try again, unless we're shutting down
+                if self.closed.wait(self.retry_seconds):
+                    self._hand_off(batch)
+                    return
+                continue
+
+            self.last_write_duration = monotonic() - started_at
+            self.written += len(batch)
+            batch = []
+            metrics.set_queue_depth(self.id, self.queue_depth)
+
+    def _next_batch(self) -> Optional[list]:
+        """Wait for rows to write, returning None once closed with nothing left to write."""
+        while True:
+            try:
+                batch = [self.queue.get(timeout=0.1)]
+                break
+            except Empty:
+                if self.device_states or self.usages:
+                    batch = []
+                    break
+                if self.closed.is_set():
+                    return None
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        # Usages ride along with every batch, and are held with it until it's written
+        with self.usages_lock:
+            usages, self.usages = self.usages, []
+        return usages + batch
+
+    def _hand_off(self, batch: list) -> None:
+        """Give rows that can't be written before closing to `spool`, or keep them in `unwritten`."""
+        rows = list(batch)
+        while True:
+            try:
+                rows.append(self.queue.get_nowait())
+            except Empty:
+                break
+        with self.usages_lock:
+            rows, self.usages = rows + self.usages, []
+        metrics.set_queue_depth(self.id, self.queue_depth)
+
+        if self.device_states:
+            logger.error('Closed without saving the state of %s devices for environment %s',
+                         len(self.device_states), self.id)
+        if not rows:
+            return
+        if self.spool is not None:
+            for row in rows:
+                self.spool.add(row)
+            logger.warning('Closed with %s rows unwritten for environment %s, handed them to the spool',
+                           len(rows), self.id)
+        else:
+            self.unwritten.extend(rows)
+            logger.error('Closed with %s rows unwritten for environment %s', len(rows), self.id)
+
+    def _restore_device_states(self, device_states: Dict[str, dict]) -> None:
+        """Put back device states from a failed write, unless a newer state has replaced them."""
+        with self.device_states_lock:
+            for device_id, state in device_states.items():
+                self.device_states.setdefault(device_id, state)
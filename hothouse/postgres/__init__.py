@@ -1,2 +1,4 @@
 """effects.__init__.py"""
-from .postgres_connector import CONFIG, get_session, get_engine, get_connection, get_ssl_context
+from .postgres_connector import CONFIG, configure, get_session, get_engine, get_connection, get_raw_connection, get_ssl_context, dispose_engines, register_engine
+from .batch_writer import BatchWriter
+from .spool import Spool
@@ -0,0 +1,150 @@
+"""Buffer ORM rows in memory and write them to Postgres in bulk."""
+
+import atexit
+import logging
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, List
+from pg8000.dbapi import Connection
+from .postgres_connector import get_raw_connection
+
+logger = logging.getLogger(__name__)
+
+# Postgres caps a single statement at 65535 bind parameters
+MAX_PARAMETERS = 65535
+
+
+def insert_rows(
+    connection_factory: Callable[[], Connection],
+    table: str,
+    columns: List[str],
+    rows: List[tuple],
+    on_conflict: str = ''
+) -> None:
+    """
+    Write rows with as few multi-row INSERTs as possible, in one transaction.
+    `on_conflict` is appended to each INSERT, e.g. 'ON CONFLICT DO NOTHING'.
+    """
+    # Pooled connections are cheap to check out, so only hold one while writing
+    connection = connection_factory()
+
+    column_names = ', '.join(columns)
+    placeholders = f"({', '.join(['%s'] * len(columns))})"
+    rows_per_statement = MAX_PARAMETERS // len(columns)
+
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(rows), rows_per_statement):
+            chunk = rows[start:start + rows_per_statement]
+            cursor.execute(
+                f"INSERT INTO {table} ({column_names}) "
+                f"VALUES {', '.join([placeholders] * len(chunk))} {on_conflict}".rstrip(),
+                [value for row in chunk for value in row]
+            )
+        cursor.close()
+        connection.commit()
+    except Exception:
+        try:
+            connection.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        connection.close()
+
+
+class BatchWriter:
+    """
+    Collect rows for a single table and flush them with multi-row INSERTs.
+
+    A flush happens when `max_rows` rows are waiting, when `max_seconds` have
+    passed since the last flush, and once more when the process exits. At most
+    `max_rows` rows / `max_seconds` worth of data can be lost if the process
+    crashes outright.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_rows: int = 500,
+        max_seconds: float = 10,
+        max_pending: int = 100000,
+        connection_factory: Callable[[], Connection] = get_raw_connection
+    ):
+        self.table = model.__table__.fullname
+        self.columns = [column.name for column in model.__table__.columns]
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.max_pending = max_pending
+        self.connection_factory = connection_factory
+
+        self.rows: List[tuple] = []
+        self.last_flush_at = monotonic()
+        self.rows_lock = Lock()
+        self.flush_lock = Lock()
+        self.closed = Event()
+
+        # Flush on a timer too, so a quiet writer doesn't sit on rows forever
+        self.flusher = Thread(target=self._flush_periodically, daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def add(self, row) -> None:
+        """Queue an ORM instance to be written on the next flush."""
+        values = tuple(getattr(row, column) for column in self.columns)
+        with self.rows_lock:
+            self.rows.append(values)
+            pending = len(self.rows)
+
+        if pending >= self.max_rows:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write every queued row to the database, returning how many were written."""
+        with self.flush_lock:
+            with self.rows_lock:
+                rows, self.rows = self.rows, []
+            self.last_flush_at = monotonic()
+
+            if not rows:
+                return 0
+
+            try:
+                self._insert(rows)
+            except Exception:
+                logger.exception(
+                    'Failed to write %s rows to %s', len(rows), self.table)
+                self._requeue(rows)
+                return 0
+
+            return len(rows)
+
+    def close(self) -> None:
+        """Stop the flush timer, write anything that's left and release the connection."""
+        if self.closed.is_set():
+            return
+
+        self.closed.set()
+        self.flush()
+
+    def _insert(self, rows: List[tuple]) -> None:
+        insert_rows(self.connection_factory, self.table, self.columns, rows)
+
+    def _requeue(self, rows: List[tuple]) -> None:
+        """Put rows from a failed flush back in line, dropping the oldest past `max_pending`."""
+        with self.rows_lock:
+            self.rows = rows + self.rows
+            overflow = len(self.rows) - self.max_pending
+            if overflow > 0:
+                logger.warning(
+                    'Dropping %s unwritten rows for %s', overflow, self.table)
+                del self.rows[:overflow]
+
+    def _flush_periodically(self) -> None:
+        timeout = self.max_seconds
+        while not self.closed.wait(timeout):
+            elapsed = monotonic() - self.last_flush_at
+            if elapsed >= self.max_seconds:
+                self.flush()
+                elapsed = 0
+            timeout = self.max_seconds - elapsed
@@ -1,22 +1,75 @@
 """Provide access to the SQL backend."""
 
+import os
 from ssl import SSLContext
+from typing import Dict, Iterator, MutableMapping, Optional
 from dotenv import dotenv_values
 from pg8000.dbapi import Connection
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, Session
+from .. import metrics
 
-CONFIG = dotenv_values()
-HOST = CONFIG['PG_HOST']
-PORT = CONFIG.get('PG_PORT', 5432)
-DATABASE = CONFIG['DB_NAME']
-USER = CONFIG['PG_USERNAME']
-PASSWORD = CONFIG['PG_PASSWORD']
 
-# Globals for managing DB connections
-engine = None
-session_factory = None
+class Config(MutableMapping):
+    """
+    Settings for connecting to Postgres, read from `.env` the first time one is needed.
+    Environment variables named `DB_NAME` or starting with `PG_` take precedence over `.env`,
+    and values passed to `configure` take precedence over both.
+    """
+
+    def __init__(self):
+        self.settings: Optional[Dict[str, str]] = None
+
+    def load(self) -> Dict[str, str]:
+        if self.settings is None:
+            settings = {key: value for key, value in dotenv_values().items()
+                        if value is not None}
+            settings.update({key: value for key, value in os.environ.items()
+                             if key == 'DB_NAME' or key.startswith('PG_')})
+            self.settings = settings
+        return self.settings
+
+    def __getitem__(self, key: str) -> str:
+        try:
+            return self.load()[key]
+        except KeyError:
+            raise KeyError(
+                f'{key} is not configured. Set it in .env, as an environment variable, '
+                'or with hothouse.postgres.configure()') from None
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self.load()[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        del self.load()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.load())
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+
+CONFIG = Config()
+
+# Globals for managing DB connections, keyed by database name
+engines: Dict[str, Engine] = {}
+session_factories: Dict[str, sessionmaker] = {}
+
+
+def configure(**settings) -> None:
+    """
+    Override connection settings, e.g. `configure(DB_NAME='my_database', PG_POOL_SIZE=10)`.
+    Any open connections are closed, so the new settings apply from the next connection on.
+    """
+    for key, value in settings.items():
+        CONFIG[key] = str(value)
+    dispose_engines()
+
+
+def get_bool_setting(key: str, default: bool) -> bool:
+    return str(CONFIG.get(key, default)).lower() in ('1', 'true', 'yes')
 
 
 def get_ssl_context(
@@ -34,29 +87,81 @@ def get_ssl_context(
 def get_connection() -> Connection:
     """Get a DB API `Connection` using the driver of choice (`pg8000` for now)."""
     return Connection(
-        user=USER,
-        password=PASSWORD,
-        host=HOST,
-        database=DATABASE,
+        user=CONFIG['PG_USERNAME'],
+        password=CONFIG['PG_PASSWORD'],
+        host=CONFIG['PG_HOST'],
+        port=int(CONFIG.get('PG_PORT', 5432)),
+        database=CONFIG['DB_NAME'],
         ssl_context=get_ssl_context()
     )
 
 
-def get_engine(db_name: str) -> Engine:
-    """Get the running instance of a SQLAlchemy `Engine`."""
-    global engine
+def get_raw_connection(db_name: str = None):
+    """
+    Get a DB API connection from the pool for `db_name`, for bulk work that bypasses the ORM.
+    Calling `close()` on it returns it to the pool instead of closing it.
+    """
+    return get_engine(db_name).raw_connection()
+
+
+def get_engine(db_name: str = None) -> Engine:
+    """Get the running instance of a SQLAlchemy `Engine` for `db_name` (`DB_NAME` by default)."""
+    db_name = db_name or CONFIG['DB_NAME']
+    engine = engines.get(db_name)
     if engine is None:
+        # Connection pool settings, see https://docs.sqlalchemy.org/en/14/core/pooling.html
         engine = create_engine(
-            f"postgresql+pg8000://{USER}:{PASSWORD}@{HOST}:{PORT}/{db_name}",
-            echo=False)
+            f"postgresql+pg8000://{CONFIG['PG_USERNAME']}:{CONFIG['PG_PASSWORD']}"
+            f"@{CONFIG['PG_HOST']}:{CONFIG.get('PG_PORT', 5432)}/{db_name}",
+            echo=False,
+            pool_size=int(CONFIG.get('PG_POOL_SIZE', 5)),
+            max_overflow=int(CONFIG.get('PG_MAX_OVERFLOW', 10)),
+            pool_pre_ping=get_bool_setting('PG_POOL_PRE_PING', True),
+            pool_recycle=int(CONFIG.get('PG_POOL_RECYCLE', 3600)))
+
+        # Milliseconds before Postgres cancels a statement, 0 means no timeout
+        statement_timeout = int(CONFIG.get('PG_STATEMENT_TIMEOUT', 0))
+        if statement_timeout:
+            @event.listens_for(engine, 'connect')
+            def set_statement_timeout(dbapi_connection, connection_record) -> None:
+                cursor = dbapi_connection.cursor()
+                cursor.execute(f"SET statement_timeout = {statement_timeout}")
+                cursor.close()
+                dbapi_connection.commit()
+
+        engines[db_name] = engine
 
     return engine
 
 
-def get_session(db_name: str = DATABASE) -> Session:
+def register_engine(db_name: str, engine: Engine) -> None:
+    """
+    Use `engine` for `db_name` instead of connecting to Postgres, e.g. a SQLite stand-in for
+    benchmarks. Registered engines are forgotten by `dispose_engines` and `configure`.
+    """
+    engines[db_name] = engine
+    session_factories.pop(db_name, None)
+
+
+def get_session(db_name: str = None) -> Session:
     """Get a `Session` to maintain database transactions."""
-    global session_factory
+    db_name = db_name or CONFIG['DB_NAME']
+    session_factory = session_factories.get(db_name)
     if session_factory is None:
         session_factory = sessionmaker(get_engine(db_name))
+        session_factories[db_name] = session_factory
+
+    session = session_factory()
+    metrics.count_session(session.bind)
+    return session
+
 
-    return session_factory()
+def dispose_engines() -> None:
+    """
+    Close every pooled connection and forget all engines. Call this in a child process
+    after forking, so it doesn't share connections with its parent.
+    """
+    for engine in engines.values():
+        engine.dispose()
+    engines.clear()
+    session_factories.clear()
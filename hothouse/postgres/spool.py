@@ -0,0 +1,251 @@
+"""Write ORM rows to a local log first, and load them into Postgres whenever it's reachable."""
+
+import atexit
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from threading import Event, Lock, Thread
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from pg8000.dbapi import Connection
+from sqlalchemy import DateTime
+from .batch_writer import insert_rows
+from .postgres_connector import get_raw_connection
+
+logger = logging.getLogger(__name__)
+
+# Each record in a segment is its payload's length and CRC-32, followed by the payload
+RECORD_HEADER = struct.Struct('<II')
+SEGMENT_SUFFIX = '.log'
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Cannot spool {value!r}')
+
+
+def read_segment(path: str) -> Iterator[Tuple[str, list]]:
+    """
+    Read the `(table, values)` records in a segment. A record that was only partly written,
+    e.g. because the process was killed, ends the segment.
+    """
+    with open(path, 'rb') as segment:
+        while True:
+            header = segment.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) == RECORD_HEADER.size:
+                length, checksum = RECORD_HEADER.unpack(header)
+                payload = segment.read(length)
+                if len(payload) == length and zlib.crc32(payload) == checksum:
+                    yield tuple(json.loads(payload))
+                    continue
+
+            logger.warning(
+                'Ignoring the incomplete end of spool segment %s', path)
+            return
+
+
+class Spool:
+    """
+    An append-only log of rows on local disk, drained into Postgres by a background thread.
+
+    Rows are appended to the current segment file in `directory`, which is closed and
+    replaced once it reaches `segment_bytes`. Every `drain_seconds`, closed segments are
+    loaded into Postgres and deleted. Rows are inserted with `ON CONFLICT DO NOTHING`, so
+    a segment that was partly loaded before a crash can be replayed safely, and segments
+    left behind by an earlier process are drained on startup.
+
+    If Postgres is unreachable for long enough that the segments add up to more than
+    `max_bytes`, the oldest segment is deleted and its rows are counted in `dropped`.
+
+    A `Spool` has the same `add`/`flush`/`close` methods as a `BatchWriter`, so it can be
+    used as an `Environment.reading_writer` or `Device.usage_writer`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        models: Sequence,
+        segment_bytes: int = 4 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        drain_seconds: float = 5,
+        fsync: bool = False,
+        connection_factory: Callable[[], Connection] = get_raw_connection
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.drain_seconds = drain_seconds
+        # Ask the OS to write every row to disk right away. Safer, but slower and
+        # harder on SD cards.
+        self.fsync = fsync
+        self.connection_factory = connection_factory
+
+        # The columns of each table, and which of them hold datetimes
+        self.tables: Dict[str, Tuple[List[str], List[int]]] = {}
+        for model in models:
+            columns = list(model.__table__.columns)
+            self.tables[model.__table__.fullname] = (
+                [column.name for column in columns],
+                [i for i, column in enumerate(columns)
+                 if isinstance(column.type, DateTime)]
+            )
+
+        # Metrics
+        self.drained = 0
+        self.dropped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Sizes of the closed segments waiting to be drained, oldest first
+        self.segments: Dict[str, int] = {
+            path: os.path.getsize(path) for path in self._list_segments()}
+        self.next_sequence = 1 + max(
+            (self._get_sequence(path) for path in self.segments), default=0)
+        self.segment: Optional[BinaryIO] = None
+        self.segment_size = 0
+
+        self.lock = Lock()
+        self.drain_lock = Lock()
+        self.closed = Event()
+        self.drainer = Thread(target=self._drain_periodically, daemon=True)
+        self.drainer.start()
+        atexit.register(self.close)
+
+    @property
+    def pending_bytes(self) -> int:
+        """How much spooled data is waiting to be loaded into Postgres."""
+        return sum(self.segments.values()) + self.segment_size
+
+    def add(self, row) -> None:
+        """Append an ORM instance to the spool."""
+        table = row.__table__.fullname
+        columns, _ = self.tables[table]
+        payload = json.dumps(
+            [table, [getattr(row, column) for column in columns]],
+            default=encode_value, separators=(',', ':')
+        ).encode()
+        record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self.lock:
+            if self.segment is None:
+                self._open_segment()
+            self.segment.write(record)
+            self.segment.flush()
+            if self.fsync:
+                os.fsync(self.segment.fileno())
+
+            self.segment_size += len(record)
+            if self.segment_size >= self.segment_bytes:
+                self._close_segment()
+
+    def flush(self) -> int:
+        """Load everything spooled so far into Postgres, returning how many rows were loaded."""
+        with self.lock:
+            self._close_segment()
+        return self.drain()
+
+    def drain(self) -> int:
+        """Load closed segments into Postgres, oldest first, until one fails."""
+        drained = 0
+        with self.drain_lock:
+            with self.lock:
+                paths = list(self.segments)
+
+            for path in paths:
+                rows = defaultdict(list)
+                try:
+                    for table, values in read_segment(path):
+                        rows[table].append(self._decode(table, values))
+                except FileNotFoundError:
+                    # Dropped to make room while waiting
+                    continue
+
+                try:
+                    for table, table_rows in rows.items():
+                        insert_rows(
+                            self.connection_factory, table, self.tables[table][0], table_rows,
+                            on_conflict='ON CONFLICT DO NOTHING')
+                except Exception:
+                    logger.exception(
+                        'Failed to load spool segment %s, will try again', path)
+                    break
+
+                with self.lock:
+                    self._remove_segment(path)
+                count = sum(len(table_rows) for table_rows in rows.values())
+                drained += count
+                self.drained += count
+
+        return drained
+
+    def close(self) -> None:
+        """Stop draining in the background, and try to load whatever is left."""
+        if self.closed.is_set():
+            return
+
+        self.closed.set()
+        self.flush()
+
+    def _open_segment(self) -> None:
+        path = os.path.join(
+            self.directory, f'{self.next_sequence:012d}{SEGMENT_SUFFIX}')
+        self.next_sequence += 1
+        self.segment = open(path, 'ab')
+        self.segment_size = 0
+
+    def _close_segment(self) -> None:
+        """Hand the current segment over to be drained."""
+        if self.segment is None:
+            return
+
+        self.segment.close()
+        self.segments[self.segment.name] = self.segment_size
+        self.segment = None
+        self.segment_size = 0
+
+        while self.segments and self.pending_bytes > self.max_bytes:
+            path = next(iter(self.segments))
+            dropped = sum(1 for _ in read_segment(path))
+            logger.warning(
+                'Spool is over %s bytes, dropping %s rows in %s', self.max_bytes, dropped, path)
+            self.dropped += dropped
+            self._remove_segment(path)
+
+    def _remove_segment(self, path: str) -> None:
+        if self.segments.pop(path, None) is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _decode(self, table: str, values: list) -> tuple:
+        for i in self.tables[table][1]:
+            if values[i] is not None:
+                values[i] = datetime.fromisoformat(values[i])
+        return tuple(values)
+
+    def _list_segments(self) -> List[str]:
+        return sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _get_sequence(self, path: str) -> int:
+        return int(os.path.basename(path)[:-len(SEGMENT_SUFFIX)])
+
+    def _drain_periodically(self) -> None:
+        while not self.closed.wait(self.drain_seconds):
+            with self.lock:
+                # While Postgres is unreachable, keep appending to the current segment
+                # rather than closing a new, small one every time
+                if not self.segments:
+                    self._close_segment()
+            self.drain()
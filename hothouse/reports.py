@@ -0,0 +1,207 @@
+"""
+Energy use and cost of devices over time, computed from `DeviceUsage` rows with NumPy.
+
+Install the optional dependency with `pip install hothouse[reports]`.
+"""
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from hothouse.hothouse import DeviceUsage
+from hothouse.postgres import get_session
+
+HOUR = 60 * 60
+
+# The length of each bucket a report can be grouped by, in seconds
+BUCKET_SECONDS = {'hour': HOUR, 'day': 24 * HOUR}
+
+
+class Tariff:
+    """
+    The price of a kWh at each hour of the day. Each of `periods` overrides `price` from
+    `start_hour` up to (not including) `end_hour`, wrapping past midnight if needed:
+
+        Tariff(0.12, periods=[(16, 21, 0.35), (23, 7, 0.08)])
+    """
+
+    def __init__(self, price: float = 0, periods: Sequence[Tuple[int, int, float]] = ()):
+        self.hourly_prices = np.full(24, float(price))
+        for start_hour, end_hour, period_price in periods:
+            if end_hour <= start_hour:
+                end_hour += 24
+            self.hourly_prices[np.arange(start_hour, end_hour) % 24] = period_price
+
+    def get_prices(self, hour_start: np.ndarray) -> np.ndarray:
+        """Get the price of a kWh during each hour, given the time each hour starts."""
+        return self.hourly_prices[(hour_start // HOUR) % 24]
+
+
+class EnergyUsage(NamedTuple):
+    """Energy used by a device (or a whole environment) during one bucket of time."""
+    device_id: Optional[str]
+    environment_id: str
+    bucket: datetime
+    seconds: float
+    kilowatt_hours: float
+    cost: float
+
+
+def to_seconds(values) -> np.ndarray:
+    """Convert datetimes (or `datetime64`s) to seconds since the epoch."""
+    return np.asarray(values, dtype='datetime64[s]').astype(np.int64)
+
+
+def split_by_hour(start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Split intervals (in seconds since the epoch) wherever they cross into a new hour.
+    Returns, for each piece, the index of the interval it came from, the start of its hour,
+    and how many seconds it covers.
+    """
+    first_hour = start // HOUR
+    hour_counts = np.maximum(-(-end // HOUR) - first_hour, 1)
+
+    index = np.repeat(np.arange(len(start)), hour_counts)
+    offsets = np.arange(len(index)) - \
+        np.repeat(np.cumsum(hour_counts) - hour_counts, hour_counts)
+    hour_start = (first_hour[index] + offsets) * HOUR
+    seconds = np.minimum(end[index], hour_start + HOUR) - \
+        np.maximum(start[index], hour_start)
+
+    return index, hour_start, seconds
+
+
+def group_sum(keys: Sequence[np.ndarray], values: Sequence[np.ndarray]) -> Tuple[list, list]:
+    """Sum `values` for each distinct combination of `keys`, sorted by the keys."""
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    for key in keys:
+        unique, inverse = np.unique(key, return_inverse=True)
+        codes = codes * len(unique) + inverse.reshape(-1)
+
+    groups, first, inverse = np.unique(
+        codes, return_index=True, return_inverse=True)
+    return (
+        [key[first] for key in keys],
+        [np.bincount(inverse.reshape(-1), weights=value, minlength=len(groups))
+         for value in values]
+    )
+
+
+def summarize_usages(
+    device_ids: Sequence[str],
+    environment_ids: Sequence[str],
+    start_at,
+    end_at,
+    kilowatt_hours: Sequence[float],
+    bucket: str = 'day',
+    tariff: Tariff = None,
+    since: datetime = None,
+    until: datetime = None
+) -> Tuple[np.ndarray, ...]:
+    """
+    Total the seconds, kWh and cost of usage intervals for each device, environment and bucket.
+    Each interval's kWh is spread evenly over its duration, and priced by the hour it was used in.
+    Only the part of each interval between `since` and `until` is counted.
+
+    Returns arrays of device ids, environment ids, bucket starts (`datetime64`), seconds, kWh and cost.
+    """
+    bucket_seconds = BUCKET_SECONDS[bucket]
+    start = to_seconds(start_at)
+    end = to_seconds(end_at)
+    kilowatt_hours = np.nan_to_num(np.asarray(kilowatt_hours, dtype=float))
+
+    duration = end - start
+    valid = duration > 0
+    rate = np.zeros(len(start))
+    rate[valid] = kilowatt_hours[valid] / duration[valid]
+
+    if since is not None:
+        start = np.maximum(start, to_seconds(since))
+    if until is not None:
+        end = np.minimum(end, to_seconds(until))
+    valid &= end > start
+
+    index, hour_start, seconds = split_by_hour(start[valid], end[valid])
+    index = np.flatnonzero(valid)[index]
+    kilowatt_hours = rate[index] * seconds
+    cost = kilowatt_hours * (tariff or Tariff()).get_prices(hour_start)
+
+    (device_ids, environment_ids, buckets), sums = group_sum(
+        [
+            np.asarray(device_ids, dtype=str)[index],
+            np.asarray(environment_ids, dtype=str)[index],
+            hour_start // bucket_seconds * bucket_seconds
+        ],
+        [seconds, kilowatt_hours, cost]
+    )
+    return (device_ids, environment_ids, buckets.astype('datetime64[s]'), *sums)
+
+
+def get_energy_usage(
+    start_at: datetime,
+    end_at: datetime,
+    environment_id: str = None,
+    device_id: str = None,
+    bucket: str = 'day',
+    tariff: Tariff = None,
+    by_device: bool = True,
+    chunk_size: int = 100000
+) -> List[EnergyUsage]:
+    """
+    Get the energy used between `start_at` and `end_at`, per device (or per environment, if not
+    `by_device`) and per hour or day. `DeviceUsage` rows are streamed `chunk_size` at a time,
+    so long time ranges don't have to fit in memory.
+    """
+    usage_query = select(
+        DeviceUsage.device_id,
+        DeviceUsage.environment_id,
+        DeviceUsage.start_at,
+        DeviceUsage.end_at,
+        DeviceUsage.kilowatt_hours
+    ).where(
+        DeviceUsage.device_id != None,
+        DeviceUsage.start_at < end_at,
+        DeviceUsage.end_at > start_at
+    )
+    if environment_id is not None:
+        usage_query = usage_query.where(
+            DeviceUsage.environment_id == environment_id)
+    if device_id is not None:
+        usage_query = usage_query.where(DeviceUsage.device_id == device_id)
+
+    summaries = []
+    session: Session
+    with get_session() as session:
+        result = session.execute(
+            usage_query.execution_options(yield_per=chunk_size))
+        for rows in result.partitions():
+            summaries.append(summarize_usages(
+                *zip(*rows), bucket=bucket, tariff=tariff, since=start_at, until=end_at))
+
+    if not summaries:
+        return []
+
+    device_ids, environment_ids, buckets, seconds, kilowatt_hours, cost = (
+        np.concatenate(column) for column in zip(*summaries))
+    keys = [environment_ids, buckets]
+    if by_device:
+        keys.insert(0, device_ids)
+
+    keys, (seconds, kilowatt_hours, cost) = group_sum(
+        keys, [seconds, kilowatt_hours, cost])
+    if by_device:
+        device_ids = keys.pop(0).tolist()
+    else:
+        device_ids = [None] * len(seconds)
+
+    environment_ids, buckets = keys
+    return [
+        EnergyUsage(*row) for row in zip(
+            device_ids,
+            environment_ids.tolist(),
+            buckets.astype(datetime).tolist(),
+            seconds.tolist(),
+            kilowatt_hours.tolist(),
+            cost.tolist()
+        )
+    ]
@@ -0,0 +1,155 @@
+"""
+Manage the monthly partitions of `hh.readings` and `hh.device_usages`.
+
+    - `create_partitions` makes sure upcoming months have a partition to write to
+    - `apply_retention` drops (or archives) whole months that are older than a policy
+
+Run `python -m hothouse.retention --help` to do both from the command line.
+"""
+import argparse
+import re
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional, Sequence
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from hothouse.postgres import get_session
+
+# Partitioned tables in the `hh` schema
+PARTITIONED_TABLES = ('readings', 'device_usages')
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+class Partition(NamedTuple):
+    """One month of a partitioned table, covering `start_at` up to (not including) `end_at`."""
+    table: str
+    name: str
+    start_at: datetime
+    end_at: datetime
+
+
+def add_months(month: date, months: int) -> date:
+    """Get the first day of the month `months` after (or before) `month`."""
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def parse_partition_bound(bound: str) -> Optional[tuple]:
+    """Parse the output of `pg_get_expr(relpartbound)`. Returns None for the default partition."""
+    match = PARTITION_BOUND.search(bound)
+    if match is None:
+        return None
+    return tuple(datetime.fromisoformat(value) for value in match.groups())
+
+
+def get_partitions(session: Session, table: str) -> List[Partition]:
+    """Get the monthly partitions of `hh.<table>`, oldest first."""
+    partitions_query = text("""
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace
+        WHERE pg_namespace.nspname = 'hh' AND parent.relname = :table
+    """)
+
+    partitions = []
+    for name, bound in session.execute(partitions_query, {'table': table}):
+        bounds = parse_partition_bound(bound)
+        if bounds is not None:
+            partitions.append(Partition(table, name, *bounds))
+
+    return sorted(partitions, key=lambda partition: partition.start_at)
+
+
+def create_partitions(
+    months_ahead: int = 3,
+    tables: Sequence[str] = PARTITIONED_TABLES,
+    today: date = None
+) -> List[str]:
+    """Make sure every table has a partition for this month and the next `months_ahead` months."""
+    this_month = (today or date.today()).replace(day=1)
+
+    names = []
+    session: Session
+    with get_session() as session:
+        for table in tables:
+            for months in range(months_ahead + 1):
+                names.append(session.execute(
+                    text('SELECT hh.create_monthly_partition(:table, :month)'),
+                    {'table': table, 'month': add_months(this_month, months)}
+                ).scalar())
+        session.commit()
+
+    return names
+
+
+def apply_retention(
+    keep_months: int,
+    tables: Sequence[str] = PARTITIONED_TABLES,
+    archive_schema: Optional[str] = None,
+    today: date = None
+) -> List[Partition]:
+    """
+    Remove every partition that ends before the last `keep_months` full months (plus the
+    current month). Partitions are dropped, or detached and moved to `archive_schema` if given.
+    Rollups in `hothouse.rollups` are not affected.
+    """
+    cutoff = datetime.combine(
+        add_months((today or date.today()).replace(day=1), -keep_months), datetime.min.time())
+
+    removed = []
+    session: Session
+    with get_session() as session:
+        if archive_schema is not None:
+            session.execute(
+                text(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"'))
+
+        for table in tables:
+            for partition in get_partitions(session, table):
+                if partition.end_at > cutoff:
+                    continue
+
+                if archive_schema is None:
+                    session.execute(text(f'DROP TABLE hh."{partition.name}"'))
+                else:
+                    session.execute(text(
+                        f'ALTER TABLE hh."{table}" DETACH PARTITION hh."{partition.name}"'))
+                    session.execute(text(
+                        f'ALTER TABLE hh."{partition.name}" SET SCHEMA "{archive_schema}"'))
+                removed.append(partition)
+
+        session.commit()
+
+    return removed
+
+
+def main(args: Sequence[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Create upcoming partitions, and drop or archive old ones.')
+    parser.add_argument(
+        '--months-ahead', type=int, default=3,
+        help='How many months of partitions to create ahead of time (default: 3)')
+    parser.add_argument(
+        '--keep-months', type=int,
+        help='Remove partitions older than this many months (default: keep everything)')
+    parser.add_argument(
+        '--archive-schema',
+        help='Move old partitions to this schema instead of dropping them')
+    parser.add_argument(
+        '--table', action='append', choices=PARTITIONED_TABLES, dest='tables',
+        help='Only manage this table (can be repeated, default: all)')
+    options = parser.parse_args(args)
+    tables = options.tables or PARTITIONED_TABLES
+
+    for name in create_partitions(options.months_ahead, tables):
+        print(f'Partition ready: hh.{name}')
+
+    if options.keep_months is not None:
+        for partition in apply_retention(options.keep_months, tables, options.archive_schema):
+            action = f'Archived to {options.archive_schema}' if options.archive_schema else 'Dropped'
+            print(f'{action}: hh.{partition.name}')
+
+
+if __name__ == "__main__":
+    main()
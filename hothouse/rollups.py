@@ -0,0 +1,112 @@
+"""
+Per-minute, per-hour and per-day summaries of `Reading`s.
+
+The rollup tables are kept up to date by a trigger on `hh.readings`
+(see `hothouse/migrations/2026-10-18-01-add-reading-rollups.psql`), so long time ranges
+can be charted without scanning every raw reading.
+
+Rollups average the readings that were written. With a deadband (see `hothouse.deadband`),
+summarize `get_step_series` instead, which weights each value by how long it held.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional, Type
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Numeric, select
+from sqlalchemy.orm import declared_attr, Session
+from hothouse.hothouse import Base
+from hothouse.postgres import get_session
+
+
+class ReadingRollup:
+    """Columns shared by every rollup table. Averages and duty cycles are derived from them."""
+    # How much time each row covers, as a `timedelta`. Override this in each rollup table.
+    resolution = None
+
+    @declared_attr
+    def environment_id(cls):
+        return Column(ForeignKey('hh.environments.id'), primary_key=True)
+
+    bucket = Column(DateTime, primary_key=True)
+    reading_count = Column(Integer)
+    temp_count = Column(Integer)
+    temp_min = Column(Numeric)
+    temp_max = Column(Numeric)
+    temp_sum = Column(Numeric)
+    humidity_count = Column(Integer)
+    humidity_min = Column(Numeric)
+    humidity_max = Column(Numeric)
+    humidity_sum = Column(Numeric)
+    fan_active_count = Column(Integer)
+    heater_active_count = Column(Integer)
+    humidifier_active_count = Column(Integer)
+    light_active_count = Column(Integer)
+
+    @property
+    def temp_avg(self) -> Optional[float]:
+        if not self.temp_count:
+            return None
+        return float(self.temp_sum) / self.temp_count
+
+    @property
+    def humidity_avg(self) -> Optional[float]:
+        if not self.humidity_count:
+            return None
+        return float(self.humidity_sum) / self.humidity_count
+
+    def duty_cycle(self, device_type: str) -> float:
+        """The fraction of readings in this bucket where a device (e.g. 'heater') was on."""
+        if not self.reading_count:
+            return 0
+        return getattr(self, f'{device_type}_active_count') / self.reading_count
+
+
+class ReadingMinute(ReadingRollup, Base):
+    __tablename__ = 'readings_1m'
+    resolution = timedelta(minutes=1)
+
+
+class ReadingHour(ReadingRollup, Base):
+    __tablename__ = 'readings_1h'
+    resolution = timedelta(hours=1)
+
+
+class ReadingDay(ReadingRollup, Base):
+    __tablename__ = 'readings_1d'
+    resolution = timedelta(days=1)
+
+
+# From finest to coarsest
+ROLLUP_CLASSES: List[Type[ReadingRollup]] = [
+    ReadingMinute, ReadingHour, ReadingDay]
+
+
+def get_rollup_class(start_at: datetime, end_at: datetime, max_points: int = 1000) -> Type[ReadingRollup]:
+    """
+    Pick the most detailed rollup table that covers `start_at` to `end_at` in at most
+    `max_points` rows, falling back to the coarsest one for very long ranges.
+    """
+    for rollup_class in ROLLUP_CLASSES:
+        if (end_at - start_at) / rollup_class.resolution <= max_points:
+            return rollup_class
+    return ROLLUP_CLASSES[-1]
+
+
+def get_rollups(
+    environment_id: str,
+    start_at: datetime,
+    end_at: datetime,
+    max_points: int = 1000
+) -> List[ReadingRollup]:
+    """Get summarized readings for an environment between `start_at` and `end_at`, oldest first."""
+    rollup_class = get_rollup_class(start_at, end_at, max_points)
+    # Include the bucket that `start_at` falls in
+    first_bucket_at = start_at - rollup_class.resolution
+
+    session: Session
+    with get_session() as session:
+        rollups_query = select(rollup_class).where(
+            rollup_class.environment_id == environment_id,
+            rollup_class.bucket > first_bucket_at,
+            rollup_class.bucket < end_at
+        ).order_by(rollup_class.bucket)
+
+        return session.execute(rollups_query).scalars().all()
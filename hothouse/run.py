@@ -0,0 +1,285 @@
+"""
+Drive every environment in `hh.environments` from a pool of worker processes:
+
+    python -m hothouse.run --environment-class my_package.environments:MyEnvironment --workers 4
+
+Environments are assigned to workers by consistent hashing of their ids, so adding or
+removing environments (or workers) only moves a small share of them. Each worker takes
+readings with its own `Monitor` and connection pool, and checks for added and removed
+environments every `refresh_seconds`. Workers that exit are restarted.
+
+A worker only drives an environment while it holds a Postgres advisory lock for it, so an
+environment is never driven by two processes at once, even while a worker is restarting
+or if two runners are started by mistake.
+"""
+import argparse
+import asyncio
+import hashlib
+import importlib
+import logging
+import multiprocessing
+import signal
+from bisect import bisect
+from time import monotonic, sleep
+from typing import Dict, Iterable, List, Optional, Type
+from sqlalchemy import select, text
+from sqlalchemy.engine import Connection
+from hothouse.hothouse import Environment
+from hothouse.monitor import Monitor
+from hothouse.postgres import dispose_engines, get_engine, get_session
+
+logger = logging.getLogger(__name__)
+
+
+def get_hash(key: str) -> int:
+    """A stable 64-bit hash of `key` (unlike `hash`, the same in every process)."""
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], 'big', signed=True)
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to shards. Each shard is placed at `replicas` points on a
+    ring, and a key belongs to the shard at the next point after the key's hash.
+    """
+
+    def __init__(self, shards: Iterable[int], replicas: int = 100):
+        points = sorted(
+            (get_hash(f'{shard}:{replica}'), shard)
+            for shard in shards for replica in range(replicas)
+        )
+        self.hashes = [point for point, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def get_shard(self, key: str) -> int:
+        return self.shards[bisect(self.hashes, get_hash(key)) % len(self.hashes)]
+
+
+def load_class(path: str) -> Type[Environment]:
+    """Import an `Environment` subclass from a path like `my_package.environments:MyEnvironment`."""
+    module_name, _, class_name = path.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class Worker:
+    """Drives the environments that hash to one shard."""
+
+    def __init__(
+        self,
+        shard: int,
+        shards: int,
+        environment_class: Type[Environment],
+        interval: float = 60,
+        threads: int = 8,
+        refresh_seconds: float = 60,
+        use_locks: bool = True
+    ):
+        self.shard = shard
+        self.ring = HashRing(range(shards))
+        self.environment_class = environment_class
+        self.interval = interval
+        self.refresh_seconds = refresh_seconds
+        self.use_locks = use_locks
+        self.monitor = Monitor(max_workers=threads)
+        self.stopping = False
+        # Holds this worker's advisory locks for as long as it's open
+        self.lock_connection: Optional[Connection] = None
+
+    def load_environments(self) -> Dict[str, Environment]:
+        """Load the environments in this worker's shard."""
+        with get_session() as session:
+            environments = session.execute(
+                select(self.environment_class)).scalars().all()
+        return {environment.id: environment for environment in environments
+                if self.ring.get_shard(environment.id) == self.shard}
+
+    async def refresh(self) -> None:
+        """Start driving environments added to this shard, and stop driving removed ones."""
+        loop = asyncio.get_running_loop()
+        environments = await loop.run_in_executor(None, self.load_environments)
+
+        removed = [environment_id for environment_id in self.monitor.environments
+                   if environment_id not in environments]
+        stopped = []
+        for environment_id in removed:
+            logger.info('Shard %s: stopping environment %s',
+                        self.shard, environment_id)
+            stopped.append(self.monitor.remove(environment_id))
+        # Keep the locks of removed environments until their last readings are done, so
+        # another worker can't start driving them while they're still being driven here
+        await asyncio.gather(*(monitored.wait() for monitored in stopped))
+
+        added = [environment for environment_id, environment in environments.items()
+                 if environment_id not in self.monitor.environments]
+        locked = await loop.run_in_executor(None, self._update_locks, removed, added)
+        for environment in locked:
+            logger.info('Shard %s: starting environment %s',
+                        self.shard, environment.id)
+            self.monitor.add(environment, self.interval)
+
+    async def run(self) -> None:
+        """Drive this shard's environments until `stop` is called."""
+        monitor = asyncio.get_running_loop().create_task(self.monitor.run())
+        # Let the monitor start, so `stop` can reach it
+        await asyncio.sleep(0)
+        try:
+            while not (monitor.done() or self.stopping):
+                await self.refresh()
+                await asyncio.wait([monitor], timeout=self.refresh_seconds)
+        finally:
+            self.monitor.stop()
+            await monitor
+            if self.lock_connection is not None:
+                self.lock_connection.close()
+
+    def stop(self) -> None:
+        self.stopping = True
+        self.monitor.stop()
+
+    def _update_locks(self, removed: List[str], added: List[Environment]) -> List[Environment]:
+        """Release the locks of removed environments, and return the added ones that could be locked."""
+        for environment_id in removed:
+            self._unlock(environment_id)
+
+        locked = []
+        for environment in added:
+            if self._lock(environment.id):
+                locked.append(environment)
+            else:
+                logger.warning(
+                    'Shard %s: environment %s is locked by another process, will try again',
+                    self.shard, environment.id)
+        return locked
+
+    def _lock(self, environment_id: str) -> bool:
+        if not self.use_locks:
+            return True
+        if self.lock_connection is None:
+            self.lock_connection = get_engine().connect()
+        locked = self.lock_connection.execute(
+            text('SELECT pg_try_advisory_lock(:key)'), {'key': get_hash(environment_id)}).scalar()
+        self.lock_connection.commit()
+        return locked
+
+    def _unlock(self, environment_id: str) -> None:
+        if self.use_locks:
+            self.lock_connection.execute(
+                text('SELECT pg_advisory_unlock(:key)'), {'key': get_hash(environment_id)})
+            self.lock_connection.commit()
+
+
+def run_worker(shard: int, shards: int, environment_class: str, **options) -> None:
+    """The entry point of a worker process."""
+    logging.basicConfig(level=logging.INFO)
+    # Don't share connections with the parent process
+    dispose_engines()
+    worker = Worker(shard, shards, load_class(environment_class), **options)
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, worker.stop)
+        await worker.run()
+
+    asyncio.run(main())
+
+
+class Runner:
+    """
+    Starts a worker process per shard, and restarts any that exit, waiting at least
+    `restart_seconds` between starts of the same worker so a crashing worker doesn't spin.
+    """
+
+    def __init__(self, environment_class: str, workers: int, restart_seconds: float = 5, **worker_options):
+        self.environment_class = environment_class
+        self.workers = workers
+        self.restart_seconds = restart_seconds
+        self.worker_options = worker_options
+        # Spawn rather than fork, so workers don't inherit threads or connections
+        self.context = multiprocessing.get_context('spawn')
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.started_at: Dict[int, float] = {}
+        # Metrics
+        self.restarts = 0
+        self.stopping = False
+
+    def start_worker(self, shard: int) -> None:
+        process = self.context.Process(
+            target=run_worker,
+            args=(shard, self.workers, self.environment_class),
+            kwargs=self.worker_options,
+            name=f'hothouse-shard-{shard}',
+            daemon=False
+        )
+        process.start()
+        self.processes[shard] = process
+        self.started_at[shard] = monotonic()
+
+    def supervise(self) -> None:
+        """Restart workers that have exited."""
+        for shard, process in list(self.processes.items()):
+            if process.is_alive() or self.stopping:
+                continue
+            if monotonic() - self.started_at[shard] < self.restart_seconds:
+                continue
+            logger.warning('Worker for shard %s exited with code %s, restarting',
+                           shard, process.exitcode)
+            self.restarts += 1
+            self.start_worker(shard)
+
+    def run(self) -> None:
+        """Run the workers until SIGINT or SIGTERM."""
+        def stop(signal_number, frame) -> None:
+            self.stopping = True
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+        for shard in range(self.workers):
+            self.start_worker(shard)
+        while not self.stopping:
+            self.supervise()
+            sleep(1)
+        self.stop()
+
+    def stop(self, timeout: float = 30) -> None:
+        """Ask every worker to finish its readings and exit, killing any that don't in time."""
+        self.stopping = True
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = monotonic() + timeout
+        for process in self.processes.values():
+            process.join(max(0, deadline - monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+
+def main(args: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--environment-class', default='hothouse:Environment',
+                        help='Environment subclass to load rows as, e.g. my_package.environments:MyEnvironment')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('--interval', type=float, default=60,
+                        help='Seconds between readings of each environment (default: 60)')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Readings each worker takes at once (default: 8)')
+    parser.add_argument('--refresh-seconds', type=float, default=60,
+                        help='Seconds between checks for added or removed environments (default: 60)')
+    parser.add_argument('--no-locks', dest='use_locks', action='store_false',
+                        help="Don't take advisory locks, e.g. for databases other than Postgres")
+    options = parser.parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+
+    Runner(
+        options.environment_class,
+        options.workers,
+        interval=options.interval,
+        threads=options.threads,
+        refresh_seconds=options.refresh_seconds,
+        use_locks=options.use_locks
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
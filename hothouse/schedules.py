@@ -0,0 +1,253 @@
+"""
+Work out which `Schedule` is active for an environment, and keep every schedule in memory in
+an index that answers that for thousands of environments without querying the database.
+
+A schedule is active from midnight on its `start_date` until midnight on its `end_date`
+(forever if there isn't one). A schedule with a phase is only active between
+`phase_start_at` and `phase_end_at` each day; a phase that ends before it starts runs
+past midnight. When several schedules are active at once, the one that wins is:
+    - the one with the highest `priority`, then
+    - a schedule with a phase over one without (it's more specific), then
+    - the one that started most recently, then
+    - the one with the highest `id`, so the choice never depends on query order
+"""
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import select
+from hothouse.postgres import get_session
+
+# Schedules without a start date have always been active
+EARLIEST = datetime.min
+
+
+def get_bounds(schedule) -> Tuple[datetime, Optional[datetime]]:
+    """When a schedule starts and ends, ignoring its phase."""
+    start_at = EARLIEST if schedule.start_date is None else datetime.combine(
+        schedule.start_date, time())
+    end_at = None if schedule.end_date is None else datetime.combine(
+        schedule.end_date, time())
+    return start_at, end_at
+
+
+def has_phase(schedule) -> bool:
+    return schedule.phase_start_at is not None and schedule.phase_end_at is not None
+
+
+def is_in_phase(schedule, at: datetime) -> bool:
+    """Whether `at` is within a schedule's daily phase (always True for schedules without one)."""
+    if not has_phase(schedule):
+        return True
+    start, end, now = schedule.phase_start_at, schedule.phase_end_at, at.time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+def get_precedence(schedule) -> tuple:
+    """Sort key for overlapping schedules, highest first (see the module docstring)."""
+    return (schedule.priority or 0, has_phase(schedule), get_bounds(schedule)[0], schedule.id)
+
+
+def get_active_schedule(schedules: Iterable, at: datetime):
+    """Pick the schedule active at `at` from `schedules`, or None."""
+    active = [
+        schedule for schedule in schedules
+        if is_active(schedule, at) and is_in_phase(schedule, at)
+    ]
+    return max(active, key=get_precedence, default=None)
+
+
+def is_active(schedule, at: datetime) -> bool:
+    start_at, end_at = get_bounds(schedule)
+    return start_at <= at and (end_at is None or at < end_at)
+
+
+def get_next_phase_change(schedules: Iterable, at: datetime) -> Optional[datetime]:
+    """The next time after `at` that one of `schedules` starts or ends its daily phase."""
+    changes = []
+    for schedule in schedules:
+        if not has_phase(schedule):
+            continue
+        for phase_time in (schedule.phase_start_at, schedule.phase_end_at):
+            change_at = datetime.combine(at.date(), phase_time)
+            if change_at <= at:
+                change_at += timedelta(days=1)
+            changes.append(change_at)
+    return min(changes, default=None)
+
+
+def get_next_change(schedules: Iterable, at: datetime) -> Optional[datetime]:
+    """The next time after `at` that the active schedule among `schedules` could change."""
+    schedules = list(schedules)
+    changes = [
+        bound for schedule in schedules for bound in get_bounds(schedule)
+        if bound is not None and bound > at
+    ]
+    next_phase_change = get_next_phase_change(
+        [schedule for schedule in schedules if is_active(schedule, at)], at)
+    if next_phase_change is not None:
+        changes.append(next_phase_change)
+    return min(changes, default=None)
+
+
+class Timeline:
+    """
+    One environment's schedules, split into segments of time in which the same schedules
+    apply. Each segment lists its schedules highest precedence first, so a lookup is a
+    binary search for the segment followed by a check of each schedule's phase.
+    """
+
+    def __init__(self, schedules: Iterable):
+        self.schedules = sorted(schedules, key=get_precedence, reverse=True)
+        self.starts: List[datetime] = sorted(
+            {bound for schedule in self.schedules for bound in get_bounds(schedule) if bound is not None})
+        self.segments: List[list] = [
+            [schedule for schedule in self.schedules if is_active(schedule, start_at)]
+            for start_at in self.starts
+        ]
+
+    def get_segment(self, at: datetime) -> Tuple[list, Optional[datetime]]:
+        """The schedules that could be active at `at`, and when that changes."""
+        index = bisect_right(self.starts, at) - 1
+        if index < 0:
+            return [], self.starts[0] if self.starts else None
+        end_at = self.starts[index + 1] if index + \
+            1 < len(self.starts) else None
+        return self.segments[index], end_at
+
+    def get_active(self, at: datetime):
+        for schedule in self.get_segment(at)[0]:
+            if is_in_phase(schedule, at):
+                return schedule
+        return None
+
+    def get_next_change(self, at: datetime) -> Optional[datetime]:
+        schedules, end_at = self.get_segment(at)
+        changes = [change_at for change_at in (end_at, get_next_phase_change(schedules, at))
+                   if change_at is not None]
+        return min(changes, default=None)
+
+
+class ScheduleIndex:
+    """
+    Every `Schedule`, held in memory and indexed by environment. Call `load` once, then
+    `refresh` now and then to pick up schedules that were added, changed or deleted; only the
+    environments whose schedules changed are re-indexed.
+
+    Share one index between environments by setting `Environment.schedule_index`. Each
+    environment's schedules have a version that goes up whenever they change, so rows an
+    environment has cached are loaded again after a refresh changes its schedules.
+    """
+
+    def __init__(self, refresh_overlap_seconds: float = 60):
+        # Schedules by environment id, then by schedule id
+        self.schedules: Dict[str, Dict[str, object]] = {}
+        # The environment id of each schedule
+        self.environment_ids: Dict[str, str] = {}
+        self.timelines: Dict[str, Timeline] = {}
+        # The version of each environment's schedules, taken from `version` when they change.
+        # Versions are never reused, even by `load`.
+        self.versions: Dict[str, int] = {}
+        self.version = 0
+        # The latest `updated_at` seen. Refreshes look back `refresh_overlap_seconds` further,
+        # to catch rows from transactions that started earlier but committed later.
+        self.updated_at: Optional[datetime] = None
+        self.refresh_overlap_seconds = refresh_overlap_seconds
+
+    def get_active(self, environment_id: str, at: datetime):
+        """The schedule active for an environment at `at`, or None."""
+        timeline = self.timelines.get(environment_id)
+        return None if timeline is None else timeline.get_active(at)
+
+    def get_next_change(self, environment_id: str, at: datetime) -> Optional[datetime]:
+        """The next time after `at` that an environment's active schedule could change."""
+        timeline = self.timelines.get(environment_id)
+        return None if timeline is None else timeline.get_next_change(at)
+
+    def get_version(self, environment_id: str) -> Optional[int]:
+        """The version of an environment's schedules, None if it's never had any."""
+        return self.versions.get(environment_id)
+
+    def load(self) -> Set[str]:
+        """Load every schedule, returning the environments whose schedules changed."""
+        from hothouse.hothouse import Schedule
+
+        with get_session() as session:
+            schedules = session.execute(select(Schedule)).scalars().all()
+        # Environments that had schedules before may have none now
+        previous = set(self.timelines)
+        self.schedules = {}
+        self.environment_ids = {}
+        self.timelines = {}
+        self.updated_at = None
+        changed = self.update(schedules)
+        self._bump_versions(previous - changed)
+        return changed | previous
+
+    def refresh(self) -> Set[str]:
+        """
+        Load schedules added or changed since the last `load` or `refresh`, and forget deleted
+        ones, returning the environments whose schedules changed.
+        """
+        from hothouse.hothouse import Schedule
+
+        if self.updated_at is None:
+            return self.load()
+
+        since = self.updated_at - \
+            timedelta(seconds=self.refresh_overlap_seconds)
+        with get_session() as session:
+            changed = session.execute(
+                select(Schedule).where(Schedule.updated_at >= since)).scalars().all()
+            ids = set(session.execute(select(Schedule.id)).scalars())
+
+        # Skip rows seen before, fetched again because of the overlap
+        changed = [schedule for schedule in changed if not self._is_loaded(schedule)]
+        deleted = [schedule_id for schedule_id in self.environment_ids
+                   if schedule_id not in ids]
+        return self.update(changed, deleted)
+
+    def update(self, schedules: Iterable = (), deleted: Iterable[str] = ()) -> Set[str]:
+        """Add or replace `schedules` and forget `deleted` schedule ids, returning the environments that changed."""
+        changed = set()
+        for schedule_id in deleted:
+            environment_id = self.environment_ids.pop(schedule_id, None)
+            if environment_id is not None:
+                del self.schedules[environment_id][schedule_id]
+                changed.add(environment_id)
+
+        for schedule in schedules:
+            # A schedule can be moved to another environment
+            previous_environment_id = self.environment_ids.get(schedule.id)
+            if previous_environment_id is not None:
+                del self.schedules[previous_environment_id][schedule.id]
+                changed.add(previous_environment_id)
+
+            self.schedules.setdefault(schedule.environment_id, {})[
+                schedule.id] = schedule
+            self.environment_ids[schedule.id] = schedule.environment_id
+            changed.add(schedule.environment_id)
+            if schedule.updated_at is not None and (self.updated_at is None or schedule.updated_at > self.updated_at):
+                self.updated_at = schedule.updated_at
+
+        self._bump_versions(changed)
+        for environment_id in changed:
+            if self.schedules.get(environment_id):
+                self.timelines[environment_id] = Timeline(
+                    self.schedules[environment_id].values())
+            else:
+                self.schedules.pop(environment_id, None)
+                self.timelines.pop(environment_id, None)
+        return changed
+
+    def _bump_versions(self, environment_ids: Iterable[str]) -> None:
+        self.version += 1
+        for environment_id in environment_ids:
+            self.versions[environment_id] = self.version
+
+    def _is_loaded(self, schedule) -> bool:
+        environment_id = self.environment_ids.get(schedule.id)
+        if environment_id is None:
+            return False
+        return self.schedules[environment_id][schedule.id].updated_at == schedule.updated_at
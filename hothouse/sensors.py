@@ -0,0 +1,127 @@
+"""
+Read sensors concurrently, each within its own deadline, so one slow or hung probe can't
+hold up a reading. Values can be oversampled and smoothed, and when a sensor fails its
+last good value is reused for a while and flagged as stale.
+"""
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from statistics import median
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+# How many threads read sensors, shared by every sensor in the process. Set this before the
+# first reading to change it.
+MAX_WORKERS = 32
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The thread pool that sensors are read on, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='hothouse-sensor')
+        return _executor
+
+
+class SensorValue(NamedTuple):
+    """A value from a sensor, and whether it's an earlier value reused because the sensor failed."""
+    value: Optional[float]
+    stale: bool = False
+
+
+class Sensor:
+    """
+    One sensor, read by calling `read` (e.g. `Environment.get_temp`).
+        - `timeout`: how many seconds to wait for a value before falling back to the last one.
+          Reads run on a shared thread pool (see `MAX_WORKERS`), and a read that's still
+          running or waiting for a thread is never started again, so a hung sensor ties up
+          at most one thread.
+        - `samples`: read this many times, `interval` seconds apart, and use the median
+        - `ema_alpha`: smooth values over time with an exponential moving average; smaller
+          values smooth more
+        - `max_age`: how many seconds the last good value can be reused for (None for no limit)
+    """
+
+    def __init__(
+        self,
+        read: Callable[[], Optional[float]],
+        timeout: Optional[float] = 5,
+        samples: int = 1,
+        interval: float = 0,
+        ema_alpha: Optional[float] = None,
+        max_age: Optional[float] = 300
+    ):
+        self.read = read
+        self.timeout = timeout
+        self.samples = samples
+        self.interval = interval
+        self.ema_alpha = ema_alpha
+        self.max_age = max_age
+
+        self.pending: Optional[Future] = None
+        self.value: Optional[float] = None
+        self.read_at: Optional[float] = None
+
+        # Metrics
+        self.timeouts = 0
+        self.errors = 0
+
+    def start(self) -> None:
+        """Start reading in the background, unless the last read is still running."""
+        if self.pending is None or self.pending.done():
+            self.pending = get_executor().submit(self._oversample)
+
+    def wait(self, started_at: float) -> SensorValue:
+        """Wait until `timeout` seconds after `started_at` for the value that `start` is reading."""
+        remaining = None
+        if self.timeout is not None:
+            remaining = max(started_at + self.timeout - monotonic(), 0)
+
+        try:
+            value = self.pending.result(remaining)
+        except TimeoutError:
+            self.timeouts += 1
+            logger.warning('Timed out reading %s', self.read)
+            value = None
+        except Exception:
+            self.errors += 1
+            logger.exception('Failed to read %s', self.read)
+            value = None
+
+        if value is not None:
+            if self.ema_alpha is not None and self.value is not None:
+                value = self.ema_alpha * value + (1 - self.ema_alpha) * self.value
+            self.value = value
+            self.read_at = monotonic()
+            return SensorValue(value)
+
+        if self.value is not None and (self.max_age is None or monotonic() - self.read_at <= self.max_age):
+            return SensorValue(self.value, stale=True)
+        return SensorValue(None)
+
+    def _oversample(self) -> Optional[float]:
+        values = []
+        for i in range(self.samples):
+            if i and self.interval:
+                sleep(self.interval)
+            value = self.read()
+            if value is not None:
+                values.append(float(value))
+
+        if not values:
+            return None
+        return median(values)
+
+
+def read_sensors(sensors: Dict[str, Sensor]) -> Dict[str, SensorValue]:
+    """Read several sensors at once, taking no longer than the longest timeout."""
+    started_at = monotonic()
+    for sensor in sensors.values():
+        sensor.start()
+    return {name: sensor.wait(started_at) for name, sensor in sensors.items()}
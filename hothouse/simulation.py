@@ -0,0 +1,246 @@
+"""
+Replay sensor traces through an `Environment`'s control logic without touching the
+database or any hardware, much faster than real time.
+
+    simulation = Simulation(environment, schedule, heater=heater, humidifier=humidifier)
+    report = simulation.run(load_trace(environment.id, start_at, end_at))
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from math import exp
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from hothouse.control import DEVICE_TYPES, SwitchGuard, get_settings
+from hothouse.hothouse import Device, DeviceUsage, Environment, Reading, Sample, Schedule
+from hothouse.postgres import get_session
+
+
+class SimulatedDevice(Device):
+    """A device that only changes state in memory."""
+
+    def _on(self, level) -> None:
+        pass
+
+    def _off(self) -> None:
+        pass
+
+
+class MemoryStore:
+    """Collects the rows a simulation would have written to the database."""
+
+    def __init__(self, keep_readings: bool = False):
+        self.keep_readings = keep_readings
+        self.readings: List[Reading] = []
+        self.device_usages: List[DeviceUsage] = []
+
+    def add(self, row) -> None:
+        if isinstance(row, DeviceUsage):
+            self.device_usages.append(row)
+        elif self.keep_readings:
+            self.readings.append(row)
+
+
+class SimulationReport(NamedTuple):
+    """What happened over the course of a simulation."""
+    start_at: Optional[datetime]
+    end_at: Optional[datetime]
+    readings: int
+    # How many times each type of device was turned on or off
+    switches: Dict[str, int]
+    # How many times each type of device wasn't switched because of its switch limits
+    suppressed: Dict[str, int]
+    kilowatt_hours: Dict[str, float]
+    # The fraction of time the temperature and humidity were within tolerance of their targets
+    temp_in_tolerance: Optional[float]
+    humidity_in_tolerance: Optional[float]
+
+
+class Simulation:
+    """
+    Run `Environment.control` over a sequence of `Sample`s, with simulated copies of the
+    given devices. Nothing is written to the database, and the original devices are not
+    changed, so an environment and schedule can be loaded from the database and tweaked
+    (e.g. `schedule.temp` or `environment.temp_tolerance`) to try out new settings.
+    """
+
+    def __init__(
+        self,
+        environment: Environment,
+        schedule: Schedule,
+        fan: Device = None,
+        heater: Device = None,
+        humidifier: Device = None,
+        light: Device = None,
+        keep_readings: bool = False
+    ):
+        self.environment = environment
+        self.schedule = schedule
+        self.store = MemoryStore(keep_readings)
+        self.devices: Dict[str, Optional[SimulatedDevice]] = {
+            device_type: device and self._copy_device(device)
+            for device_type, device in zip(DEVICE_TYPES, (fan, heater, humidifier, light))
+        }
+
+        self.readings = 0
+        self.switches = Counter()
+        self.switch_guard = SwitchGuard()
+        # Seconds with a known temperature or humidity, and how many of them were within tolerance
+        self.temp_seconds = 0.0
+        self.temp_seconds_in_tolerance = 0.0
+        self.humidity_seconds = 0.0
+        self.humidity_seconds_in_tolerance = 0.0
+        self.start_at: Optional[datetime] = None
+        self.last_sample: Optional[Sample] = None
+
+    @classmethod
+    def load(cls, environment: Environment, at: datetime = None, **kwargs) -> 'Simulation':
+        """Simulate an environment with the schedule and devices it has in the database at `at`."""
+        schedule, *devices = environment.get_rows(at)[:5]
+        if schedule is None:
+            raise ValueError(
+                f'Environment {environment.id} has no active schedule')
+        return cls(environment, schedule, *devices, **kwargs)
+
+    def step(self, sample: Sample) -> Reading:
+        """Act on one `Sample`, as `Environment.take_reading` would."""
+        if self.last_sample is None:
+            self.start_at = sample.at
+        else:
+            self._track_tolerance(self.last_sample, sample.at)
+
+        states = {device_type: device.active
+                  for device_type, device in self.devices.items() if device is not None}
+        reading = self.environment.control(
+            sample, self.schedule, *self.devices.values(), self.switch_guard)
+        for device_type, active in states.items():
+            if self.devices[device_type].active != active:
+                self.switches[device_type] += 1
+
+        self.store.add(reading)
+        self.readings += 1
+        self.last_sample = sample
+        return reading
+
+    def run(self, samples: Iterable[Sample]) -> SimulationReport:
+        for sample in samples:
+            self.step(sample)
+        return self.report()
+
+    def report(self) -> SimulationReport:
+        end_at = self.last_sample and self.last_sample.at
+        kilowatt_hours = {device_type: 0.0 for device_type, device in self.devices.items()
+                          if device is not None}
+        device_types = {device.id: device_type for device_type, device in self.devices.items()
+                        if device is not None}
+        for device_usage in self.store.device_usages:
+            kilowatt_hours[device_types[device_usage.device_id]] += device_usage.kilowatt_hours
+
+        # Count energy used by devices that are still on
+        for device_type, device in self.devices.items():
+            if device is not None and device.active and end_at > device.last_activated_at:
+                kilowatt_hours[device_type] += device._get_device_usage(
+                    self.environment.id, end_at).kilowatt_hours
+
+        return SimulationReport(
+            start_at=self.start_at,
+            end_at=end_at,
+            readings=self.readings,
+            switches={device_type: self.switches[device_type]
+                      for device_type in kilowatt_hours},
+            suppressed={device_type: self.switch_guard.suppressed[device_type]
+                        for device_type in kilowatt_hours},
+            kilowatt_hours=kilowatt_hours,
+            temp_in_tolerance=fraction(
+                self.temp_seconds_in_tolerance, self.temp_seconds),
+            humidity_in_tolerance=fraction(
+                self.humidity_seconds_in_tolerance, self.humidity_seconds)
+        )
+
+    def _track_tolerance(self, sample: Sample, until: datetime) -> None:
+        """Treat `sample` as the conditions from when it was taken until the next sample."""
+        seconds = (until - sample.at).total_seconds()
+        settings = get_settings(self.environment, self.schedule)
+
+        if sample.temp is not None:
+            self.temp_seconds += seconds
+            if abs(sample.temp - settings.temp_target) <= settings.temp_tolerance:
+                self.temp_seconds_in_tolerance += seconds
+
+        if sample.humidity is not None:
+            self.humidity_seconds += seconds
+            if abs(sample.humidity - settings.humidity_target) <= settings.humidity_tolerance:
+                self.humidity_seconds_in_tolerance += seconds
+
+    def _copy_device(self, device: Device) -> SimulatedDevice:
+        device = SimulatedDevice(
+            id=device.id,
+            name=device.name,
+            watts=device.watts,
+            min_on_seconds=device.min_on_seconds,
+            min_off_seconds=device.min_off_seconds,
+            max_switches_per_hour=device.max_switches_per_hour,
+            active=False
+        )
+        device.usage_writer = self.store
+        return device
+
+
+def fraction(part: float, total: float) -> Optional[float]:
+    if not total:
+        return None
+    return part / total
+
+
+def load_trace(environment_id: str, start_at: datetime, end_at: datetime) -> Iterator[Sample]:
+    """Stream the recorded `Reading`s of an environment as `Sample`s, oldest first."""
+    trace_query = select(Reading.at, Reading.temp, Reading.humidity).where(
+        Reading.environment_id == environment_id,
+        Reading.at >= start_at,
+        Reading.at < end_at
+    ).order_by(Reading.at).execution_options(yield_per=10000)
+
+    session: Session
+    with get_session() as session:
+        for at, temp, humidity in session.execute(trace_query):
+            yield Sample(
+                at,
+                None if temp is None else float(temp),
+                None if humidity is None else float(humidity)
+            )
+
+
+def model_trace(
+    simulation: Simulation,
+    start_at: datetime,
+    end_at: datetime,
+    interval: float = 60,
+    outside_temp: float = 60,
+    outside_humidity: float = 0.3,
+    heater_temp: float = 90,
+    humidifier_humidity: float = 0.95,
+    time_constant: float = 1800
+) -> Iterator[Sample]:
+    """
+    Generate `Sample`s from a simple model of the environment that reacts to the simulation's
+    devices: conditions drift towards `outside_temp` and `outside_humidity`, or towards
+    `heater_temp` and `humidifier_humidity` while those devices are on, settling most of
+    the way within `time_constant` seconds.
+    """
+    heater = simulation.devices['heater']
+    humidifier = simulation.devices['humidifier']
+    step = timedelta(seconds=interval)
+    # How much of the way to its target a value moves in one interval
+    approach = 1 - exp(-interval / time_constant)
+
+    temp, humidity = outside_temp, outside_humidity
+    at = start_at
+    while at < end_at:
+        yield Sample(at, temp, humidity)
+
+        temp_target = heater_temp if heater is not None and heater.active else outside_temp
+        humidity_target = humidifier_humidity \
+            if humidifier is not None and humidifier.active else outside_humidity
+        temp += (temp_target - temp) * approach
+        humidity += (humidity_target - humidity) * approach
+        at += step
@@ -8,11 +8,16 @@ setup(
     author='r1yk',
     license='MIT',
     install_requires=[
-        'SQLAlchemy>=1.4.31',
+        'SQLAlchemy>=2.0',
         'pg8000>=1.24.0',
         'python-dotenv>=0.19.2'
     ],
+    extras_require={
+        'reports': ['numpy>=1.21']
+    },
     packages=['hothouse', 'hothouse.postgres'],
     package_dir={'hothouse': 'hothouse',
-                 'hothouse.postgres': 'hothouse/postgres'}
+                 'hothouse.postgres': 'hothouse/postgres'},
+    # The schema and migrations, applied by `hothouse.bootstrap`
+    package_data={'hothouse': ['create_hothouse_db_schema.psql', 'migrations/*.psql']}
 )
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import MagicMock
+from datetime import datetime
+from uuid import uuid4
+from hothouse import Reading
+from hothouse.postgres import BatchWriter
+
+
+def make_reading() -> Reading:
+    return Reading(
+        id=str(uuid4()),
+        at=datetime.now(),
+        environment_id=str(uuid4()),
+        temp=70,
+        humidity=0.5
+    )
+
+
+class TestBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.connection = MagicMock()
+        self.cursor = self.connection.cursor.return_value
+
+    def make_writer(self, **kwargs) -> BatchWriter:
+        writer = BatchWriter(
+            Reading, connection_factory=lambda: self.connection, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_flushes_at_max_rows(self):
+        writer = self.make_writer(max_rows=3, max_seconds=60)
+        writer.add(make_reading())
+        writer.add(make_reading())
+        self.cursor.execute.assert_not_called()
+
+        writer.add(make_reading())
+        self.cursor.execute.assert_called_once()
+        statement, values = self.cursor.execute.call_args.args
+        self.assertTrue(statement.startswith('INSERT INTO hh.readings'))
+        self.assertEqual(len(values), 3 * len(writer.columns))
+        self.connection.commit.assert_called_once()
+
+    def test_flushes_on_close(self):
+        writer = self.make_writer(max_rows=100, max_seconds=60)
+        writer.add(make_reading())
+        writer.close()
+        self.cursor.execute.assert_called_once()
+        # The connection goes back to the pool after every flush
+        self.connection.close.assert_called_once()
+
+    def test_failed_flush_keeps_rows(self):
+        writer = self.make_writer(max_rows=100, max_seconds=60, max_pending=2)
+        self.cursor.execute.side_effect = ConnectionError
+        for _ in range(3):
+            writer.add(make_reading())
+
+        self.assertEqual(writer.flush(), 0)
+        # Only the newest `max_pending` rows are kept around for a retry
+        self.assertEqual(len(writer.rows), 2)
+
+        self.cursor.execute.side_effect = None
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.rows, [])
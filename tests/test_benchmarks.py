@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest.mock import patch
+from benchmarks import take_reading
+from hothouse.postgres import CONFIG
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_sqlite_benchmark(self):
+        # The benchmark points `DB_NAME` at its own database
+        config = patch.dict(CONFIG)
+        config.start()
+        self.addCleanup(config.stop)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            with redirect_stdout(StringIO()):
+                take_reading.main(['--mode', 'commit', '--mode', 'cached', '--environments', '1', '2',
+                                   '--ticks', '3', '--output', output])
+            with open(output) as results_file:
+                results = json.load(results_file)['results']
+
+        self.assertEqual([(result['mode'], result['environments'], result['readings']) for result in results],
+                         [('commit', 1, 3), ('commit', 2, 6), ('cached', 1, 3), ('cached', 2, 6)])
+        for result in results:
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertLessEqual(result['p99_ms'], result['max_ms'])
+            self.assertGreater(result['readings_per_second'], 0)
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+from sqlalchemy import text
+from hothouse.bootstrap import (MIGRATIONS_DIRECTORY, bootstrap, create_test_database, drop_database,
+                                get_applied, split_script)
+from hothouse.postgres import get_session
+test_db_name = 'bootstrap_test_db'
+
+
+class TestSplitScript(unittest.TestCase):
+    def test_split_script(self):
+        script = """
+            \\set ON_ERROR_STOP on
+            BEGIN;
+            -- A comment; with a semicolon
+            CREATE FUNCTION f() RETURNS text AS $$ BEGIN RETURN 'a;b'; END; $$ LANGUAGE plpgsql;
+            INSERT INTO t VALUES ('it''s; fine', "odd;name");
+            COMMIT;
+            SELECT format('DROP TABLE %I', relname) FROM pg_class
+            \\gexec
+        """
+        self.assertEqual(list(split_script(script)), [
+            '\\set ON_ERROR_STOP on',
+            'BEGIN',
+            "CREATE FUNCTION f() RETURNS text AS $$ BEGIN RETURN 'a;b'; END; $$ LANGUAGE plpgsql",
+            'INSERT INTO t VALUES (\'it\'\'s; fine\', "odd;name")',
+            'COMMIT',
+            "SELECT format('DROP TABLE %I', relname) FROM pg_class",
+            '\\gexec',
+        ])
+
+
+class TestBootstrap(unittest.TestCase):
+    def setUp(self):
+        create_test_database(test_db_name)
+        self.addCleanup(drop_database, test_db_name)
+
+    def test_bootstrap(self):
+        # Copies of the template have every migration already
+        self.assertEqual(bootstrap(test_db_name), [])
+
+        with tempfile.TemporaryDirectory() as directory:
+            for name in os.listdir(MIGRATIONS_DIRECTORY):
+                shutil.copy(os.path.join(MIGRATIONS_DIRECTORY, name), directory)
+            with open(os.path.join(directory, '2999-01-01-add-test-tables.psql'), 'w') as migration:
+                migration.write("""
+                    CREATE TABLE hh.test_a (id int);
+                    CREATE TABLE hh.test_b (id int);
+                    SELECT format('INSERT INTO hh.%I VALUES (1)', relname) FROM pg_class
+                        WHERE relname IN ('test_a', 'test_b')
+                    \\gexec
+                """)
+
+            self.assertEqual(bootstrap(test_db_name, migrations_directory=directory),
+                             ['2999-01-01-add-test-tables.psql'])
+            self.assertEqual(bootstrap(test_db_name, migrations_directory=directory), [])
+
+        self.assertIn('2999-01-01-add-test-tables.psql', get_applied(test_db_name))
+        with get_session(test_db_name) as session:
+            self.assertEqual(session.execute(text(
+                'SELECT (SELECT count(*) FROM hh.test_a) + (SELECT count(*) FROM hh.test_b)')).scalar(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
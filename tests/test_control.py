@@ -0,0 +1,83 @@
+import unittest
+import random
+from datetime import datetime, time, timedelta
+from hothouse.control import Command, DeviceStates, Sample, Settings, SwitchGuard, SwitchLimits, \
+    decide, decide_batch, decide_series
+
+SETTINGS = Settings(
+    temp_target=70,
+    temp_tolerance=3,
+    humidity_target=0.5,
+    humidity_tolerance=0.1,
+    fan_on_seconds=600,
+    fan_off_seconds=1200,
+    light_on_at=time(hour=8),
+    light_off_at=time(hour=20)
+)
+
+
+def random_samples(count: int):
+    start_at = datetime(2026, 10, 1)
+    return [
+        Sample(start_at + timedelta(seconds=random.randrange(86400)),
+               random.uniform(60, 80), random.choice([None, random.uniform(0.2, 0.8)]))
+        for _ in range(count)
+    ]
+
+
+class TestControl(unittest.TestCase):
+    def test_decide(self):
+        states = DeviceStates(fan=False, heater=False, humidifier=True)
+        sample = Sample(datetime(2026, 10, 1, 9, 5), 60, 0.7)
+
+        # There's no light, so it's left alone
+        self.assertEqual(decide(SETTINGS, states, sample), [
+            Command('heater', True),
+            Command('humidifier', False),
+            Command('fan', True)
+        ])
+        self.assertEqual(decide(SETTINGS, DeviceStates(), sample), [])
+
+    def test_decide_batch_matches_decide(self):
+        samples = random_samples(500)
+        states = [DeviceStates(*(random.choice([None, False, True]) for _ in range(4)))
+                  for _ in samples]
+        results = decide_batch(SETTINGS, states, samples)
+
+        for i, (state, sample) in enumerate(zip(states, samples)):
+            expected = state._asdict()
+            expected.update(decide(SETTINGS, state, sample))
+            for device_type, active in expected.items():
+                self.assertEqual(results[device_type][i], bool(active))
+
+    def test_decide_series_matches_decide(self):
+        samples = sorted(random_samples(500))
+        states = DeviceStates(fan=False, heater=False, humidifier=False)
+        results = decide_series(SETTINGS, states, samples)
+
+        for i, sample in enumerate(samples):
+            states = states._replace(**dict(decide(SETTINGS, states, sample)))
+            for device_type in ('fan', 'heater', 'humidifier'):
+                self.assertEqual(
+                    results[device_type][i], getattr(states, device_type))
+
+    def test_switch_guard(self):
+        guard = SwitchGuard()
+        limits = SwitchLimits(min_on_seconds=300, max_switches_per_hour=2)
+        start_at = datetime(2026, 10, 1)
+
+        self.assertTrue(guard.allow(
+            Command('heater', True), 'heater', limits, start_at))
+        # Too soon after turning on
+        self.assertFalse(guard.allow(
+            Command('heater', False), 'heater', limits, start_at + timedelta(minutes=1),
+            last_activated_at=start_at))
+        self.assertTrue(guard.allow(
+            Command('heater', False), 'heater', limits, start_at + timedelta(minutes=5),
+            last_activated_at=start_at))
+        # Too many switches within an hour
+        self.assertFalse(guard.allow(
+            Command('heater', True), 'heater', limits, start_at + timedelta(minutes=10)))
+        self.assertTrue(guard.allow(
+            Command('heater', True), 'heater', limits, start_at + timedelta(hours=1)))
+        self.assertEqual(guard.suppressed, {'heater': 2})
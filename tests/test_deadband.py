@@ -0,0 +1,53 @@
+import unittest
+from datetime import datetime, timedelta
+from math import sin
+from hothouse import Reading
+from hothouse.deadband import Deadband, resample
+
+
+def make_reading(minute, temp=70.0, humidity=0.5, heater_active=False):
+    return Reading(at=datetime(2026, 1, 1) + timedelta(minutes=minute), temp=temp, humidity=humidity,
+                   fan_active=False, heater_active=heater_active, humidifier_active=False,
+                   light_active=False, temp_stale=False, humidity_stale=False)
+
+
+class TestDeadband(unittest.TestCase):
+    def test_should_write(self):
+        deadband = Deadband(temp=0.5, humidity=0.02, heartbeat_seconds=600)
+        readings = [
+            make_reading(0),
+            # Small moves are left out, even when they add up to less than the deadband
+            make_reading(1, temp=70.3),
+            make_reading(2, temp=69.6),
+            # Moving the deadband away from the last reading written
+            make_reading(3, temp=70.5),
+            make_reading(4, temp=70.5, humidity=0.53),
+            make_reading(5, temp=70.5, humidity=0.53, heater_active=True),
+            make_reading(6, temp=70.5, humidity=None, heater_active=True),
+            make_reading(7, temp=70.5, humidity=None, heater_active=True),
+            # Heartbeat
+            make_reading(16, temp=70.5, humidity=None, heater_active=True),
+        ]
+        self.assertEqual([deadband.should_write(reading) for reading in readings],
+                         [True, False, False, True, True, True, True, False, True])
+        self.assertEqual((deadband.written, deadband.skipped), (6, 3))
+
+    def test_round_trip(self):
+        readings = [make_reading(minute, temp=70 + 5 * sin(minute / 30), heater_active=minute % 90 < 30)
+                    for minute in range(600)]
+        deadband = Deadband(temp=0.5, heartbeat_seconds=900)
+        written = [reading for reading in readings if deadband.should_write(reading)]
+        self.assertLess(len(written), len(readings) / 3)
+
+        steps = resample(written, readings[0].at, readings[-1].at + timedelta(minutes=1), timedelta(minutes=1),
+                         max_age=timedelta(minutes=16))
+        self.assertEqual(len(steps), len(readings))
+        for step, reading in zip(steps, readings):
+            self.assertEqual(step.at, reading.at)
+            self.assertLess(abs(step.temp - reading.temp), 0.5)
+            self.assertEqual(step.heater_active, reading.heater_active)
+
+    def test_resample_gaps(self):
+        steps = resample([make_reading(1), make_reading(30, temp=60)], datetime(2026, 1, 1),
+                         datetime(2026, 1, 1, 0, 40), timedelta(minutes=5), max_age=timedelta(minutes=15))
+        self.assertEqual([step.temp for step in steps], [None, 70, 70, 70, None, None, 60, 60])
@@ -0,0 +1,52 @@
+import gzip
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+from hothouse.export_data import export_table, get_copy_sql
+
+
+def make_rows(*minutes):
+    return [f'2026-01-01 00:{minute:02d}:00,r{i},e1\n'.encode() for i, minute in enumerate(minutes)]
+
+
+class TestExportData(unittest.TestCase):
+    def export(self, directory, rows, until):
+        def copy_to(sql, stream):
+            self.sql = sql
+            # Split rows across writes, the way COPY data can arrive
+            data = b''.join(rows)
+            for i in range(0, len(data), 7):
+                stream.write(data[i:i + 7])
+
+        with patch('hothouse.export_data.copy_to', copy_to):
+            return export_table('readings', directory, environment_id='e1', until=until, chunk_rows=2)
+
+    def read(self, path):
+        with gzip.open(path) as export_file:
+            return export_file.read().decode().splitlines()
+
+    def test_export_and_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            result = self.export(directory, make_rows(1, 2, 3, 3, 3, 4), datetime(2026, 1, 1, 0, 5))
+            self.assertEqual(result.rows, 6)
+            self.assertEqual([os.path.basename(path) for path in result.files],
+                             ['readings-000001.csv.gz', 'readings-000002.csv.gz', 'readings-000003.csv.gz'])
+            # Rows with the same timestamp stay in the same file
+            self.assertEqual([line.split(',')[1] for line in self.read(result.files[1])[1:]], ['r2', 'r3', 'r4'])
+            self.assertEqual(self.read(result.files[0])[0].split(',')[:3], ['at', 'id', 'environment_id'])
+
+            result = self.export(directory, make_rows(6), datetime(2026, 1, 1, 0, 10))
+            self.assertIn("hh.readings.at > '2026-01-01 00:05:00'", self.sql)
+            self.assertIn("hh.readings.environment_id = 'e1'", self.sql)
+            self.assertEqual([os.path.basename(path) for path in result.files], ['readings-000004.csv.gz'])
+
+            with self.assertRaises(ValueError):
+                export_table('readings', directory, environment_id='e2')
+
+    def test_copy_sql(self):
+        sql = get_copy_sql('device_usages', None, datetime(2026, 1, 1), "it's")
+        self.assertTrue(sql.startswith('COPY (SELECT hh.device_usages.start_at, hh.device_usages.id'))
+        self.assertIn("environment_id = 'it''s'", sql)
+        self.assertTrue(sql.endswith('TO STDOUT WITH (FORMAT csv)'))
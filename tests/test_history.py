@@ -0,0 +1,44 @@
+import unittest
+from datetime import datetime, timedelta
+from hothouse import Reading
+from hothouse.history import History
+
+START_AT = datetime(2026, 10, 1)
+
+
+def make_reading(minute: int, temp: float, heater_active: bool = False) -> Reading:
+    return Reading(
+        at=START_AT + timedelta(minutes=minute),
+        temp=temp,
+        humidity=None,
+        heater_active=heater_active
+    )
+
+
+class TestHistory(unittest.TestCase):
+    def test_keeps_most_recent_readings(self):
+        history = History(size=5)
+        for minute in range(8):
+            history.append(make_reading(minute, 60 + minute, minute % 2 == 0))
+
+        self.assertEqual(len(history), 5)
+        self.assertEqual(history.latest('temp'),
+                         (START_AT + timedelta(minutes=7), 67))
+        self.assertIsNone(history.latest('humidity'))
+        # The oldest readings have been overwritten, and the window wraps around
+        self.assertEqual([list(view) for view in history.window('temp')],
+                         [[63, 64], [65, 66, 67]])
+        self.assertEqual(history.min('temp'), 63)
+        self.assertEqual(history.max('temp'), 67)
+        self.assertEqual(history.mean('heater_active'), 2 / 5)
+
+    def test_windows(self):
+        history = History(size=100)
+        for minute in range(60):
+            history.append(make_reading(minute, 70 if minute < 50 else 70 + minute - 50))
+
+        # From 5 minutes before the latest reading, up to and including it
+        self.assertEqual(history.mean('temp', seconds=5 * 60), 76.5)
+        self.assertAlmostEqual(history.slope('temp', seconds=5 * 60), 1 / 60)
+        self.assertEqual(history.slope('temp', seconds=0), None)
+        self.assertIsNone(history.mean('humidity'))
@@ -1,11 +1,11 @@
 import unittest
-from unittest.mock import Mock
-from datetime import datetime, date, time
-import os
+from unittest.mock import Mock, patch
+from datetime import datetime, date, time, timedelta
 from uuid import uuid4
-from sqlalchemy import select
-from hothouse.import_db_schema import import_schema
+from sqlalchemy import event, select
+from hothouse.bootstrap import create_test_database, drop_database
 from hothouse import Schedule, Device
+from hothouse.hothouse import DeviceUsage
 from mocks.mock_hothouse import MockEnvironment, MockLight, MockFan, MockHeater, MockHumidifier
 from hothouse.postgres import CONFIG, get_engine, get_session
 test_db_name = 'hothouse_test_db'
@@ -16,11 +16,13 @@ class TestHothouse(unittest.TestCase):
     def setUpClass(cls):
         try:
             print('Setting up...')
-            # Create a transient test database to use during unit tests
-            os.environ['PGPASSWORD'] = CONFIG['PG_PASSWORD']
-            os.system(
-                f'psql -U {CONFIG["PG_USERNAME"]} -c "CREATE DATABASE {test_db_name}"')
-            import_schema(test_db_name)
+            # Undone in `tearDownClass`, so later test modules get the configured database again
+            cls.config = patch.dict(CONFIG, DB_NAME=test_db_name)
+            cls.config.start()
+
+            # Create a transient test database to use during unit tests, copied from a
+            # template database that has the schema already
+            create_test_database(test_db_name)
 
             # Seed the new database with some test data
             with get_session(test_db_name) as session:
@@ -83,15 +85,47 @@ class TestHothouse(unittest.TestCase):
     def tearDownClass(cls):
         print('Tearing down...')
         try:
-            # Get rid of the SQLAlchemy engine that's managing connections
-            get_engine(test_db_name).dispose()
-
-            # Drop the transient test database that was originally created
-            os.system(
-                f'psql -U {CONFIG["PG_USERNAME"]} -c "DROP DATABASE {test_db_name}"')
+            # Close the pooled connections and drop the transient test database
+            drop_database(test_db_name)
 
         except Exception as e:
             print('Teardown failed!', e)
+        finally:
+            cls.config.stop()
+
+    def test_reconcile_device_usages(self):
+        with get_session(test_db_name) as session:
+            environment_query = select(MockEnvironment).limit(1)
+            environment: MockEnvironment = session.execute(
+                environment_query).scalars().first()
+
+        with get_session(test_db_name) as session:
+            # Pretend the process stopped an hour after the heater came on
+            heater: Device = session.get(Device, environment.heater_id)
+            heater.active = True
+            heater.last_activated_at = datetime.now() - timedelta(hours=1)
+            session.commit()
+
+        now = datetime.now()
+        device_usages = environment.reconcile_device_usages(at=now)
+        self.assertEqual(len(device_usages), 1)
+        self.assertEqual(device_usages[0].device_id, environment.heater_id)
+        self.assertAlmostEqual(device_usages[0].seconds, 3600, delta=1)
+
+        with get_session(test_db_name) as session:
+            heater: Device = session.get(Device, environment.heater_id)
+            self.assertEqual(heater.last_activated_at, now)
+            usage_query = select(DeviceUsage).where(
+                DeviceUsage.device_id == heater.id)
+            self.assertEqual(
+                len(session.execute(usage_query).scalars().all()), 1)
+
+            # Nothing is left to reconcile
+            self.assertEqual(environment.reconcile_device_usages(at=now), [])
+
+            # Leave the heater off for the other tests
+            heater.active = False
+            session.commit()
 
     def test_take_reading(self):
         with get_session(test_db_name) as session:
@@ -169,3 +203,42 @@ class TestHothouse(unittest.TestCase):
         with get_session(test_db_name) as session:
             humidifier: Device = session.get(Device, environment.humidifier_id)
             self.assertFalse(humidifier.active)
+
+    def test_take_reading_with_cached_rows(self):
+        with get_session(test_db_name) as session:
+            environment_query = select(MockEnvironment).limit(1)
+            environment: MockEnvironment = session.execute(
+                environment_query).scalars().first()
+        environment.cache_rows = True
+
+        MockEnvironment.get_temp = Mock(return_value=70)
+        MockEnvironment.get_humidity = Mock(return_value=0.5)
+
+        statements = []
+
+        def record_statement(conn, cursor, statement, *args):
+            statements.append(statement.lstrip().upper())
+
+        engine = get_engine(test_db_name)
+        event.listen(engine, 'before_cursor_execute', record_statement)
+        try:
+            # The first reading loads the schedule and devices
+            environment.take_reading(
+                at=datetime.now().replace(hour=8, minute=30))
+            self.assertTrue(any(s.startswith('SELECT') for s in statements))
+
+            # After that, a steady-state reading only writes
+            statements.clear()
+            environment.take_reading(
+                at=datetime.now().replace(hour=8, minute=31))
+            self.assertFalse(any(s.startswith('SELECT') for s in statements))
+            self.assertTrue(any(s.startswith('INSERT') for s in statements))
+
+            # Invalidating the cache loads the rows again
+            statements.clear()
+            environment.invalidate_cache()
+            environment.take_reading(
+                at=datetime.now().replace(hour=8, minute=32))
+            self.assertTrue(any(s.startswith('SELECT') for s in statements))
+        finally:
+            event.remove(engine, 'before_cursor_execute', record_statement)
@@ -0,0 +1,20 @@
+import unittest
+from time import time
+from hothouse.ids import uuid7
+
+
+class TestIds(unittest.TestCase):
+    def test_uuid7(self):
+        ids = [uuid7() for _ in range(10000)]
+
+        self.assertEqual(ids[0].version, 7)
+        self.assertEqual(len(set(ids)), len(ids))
+        # Ids made in a row always increase, even within a millisecond
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual([str(id) for id in ids], sorted(str(id) for id in ids))
+        # The first 48 bits are the time in milliseconds
+        self.assertAlmostEqual(ids[-1].int >> 80, time() * 1000, delta=1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
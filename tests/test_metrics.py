@@ -0,0 +1,51 @@
+import unittest
+from urllib.request import urlopen
+from sqlalchemy import create_engine, text
+from hothouse import metrics
+from hothouse.postgres import get_session, register_engine
+from hothouse.simulation import SimulatedDevice
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(metrics.disable)
+
+    def test_off_by_default(self):
+        self.assertIs(metrics.timer('sensor_read'), metrics.NULL_TIMER)
+        SimulatedDevice(id='fan', name='Fan').on()
+        self.assertIsNone(metrics.registry)
+
+    def test_stages_actuations_and_round_trips(self):
+        registry = metrics.enable(buckets=[0.1, 1])
+        with metrics.timer('sensor_read'):
+            pass
+        fan = SimulatedDevice(id='fan', name='Fan')
+        fan.on()
+        fan.on()
+
+        register_engine('metrics_test', create_engine('sqlite://'))
+        with get_session('metrics_test') as session:
+            session.execute(text('SELECT 1'))
+            session.commit()
+
+        self.assertEqual(registry.stage_seconds.get_count(stage='sensor_read'), 1)
+        self.assertEqual(registry.actuations.get(device='Fan', action='on'), 2)
+        self.assertEqual(registry.db_sessions.get(), 1)
+        self.assertEqual(registry.db_round_trips.get(operation='execute'), 1)
+        self.assertEqual(registry.db_round_trips.get(operation='commit'), 1)
+
+        lines = registry.render().splitlines()
+        self.assertIn('hothouse_stage_seconds_bucket{stage="sensor_read",le="0.1"} 1', lines)
+        self.assertIn('hothouse_stage_seconds_bucket{stage="sensor_read",le="+Inf"} 1', lines)
+        self.assertIn('hothouse_stage_seconds_count{stage="sensor_read"} 1', lines)
+        self.assertIn('hothouse_actuations_total{action="on",device="Fan"} 2', lines)
+
+    def test_serve(self):
+        server = metrics.serve(port=0)
+        self.addCleanup(server.shutdown)
+        metrics.count_actuation(SimulatedDevice(id='fan', name='Fan'), 'off')
+
+        with urlopen(f'http://127.0.0.1:{server.server_port}/metrics') as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            body = response.read().decode()
+        self.assertIn('hothouse_actuations_total{action="off",device="Fan"} 1', body)
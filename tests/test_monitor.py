@@ -0,0 +1,86 @@
+import unittest
+import asyncio
+from time import sleep
+from unittest.mock import patch
+from uuid import uuid4
+from hothouse import Environment, Monitor
+
+
+class FakeEnvironment:
+    def __init__(self, duration: float = 0):
+        self.id = str(uuid4())
+        self.duration = duration
+        self.readings = 0
+
+    def take_reading(self):
+        sleep(self.duration)
+        self.readings += 1
+
+
+class TestMonitor(unittest.TestCase):
+    def run_monitor(self, monitor: Monitor, seconds: float):
+        async def run():
+            asyncio.get_running_loop().call_later(seconds, monitor.stop)
+            await monitor.run()
+
+        asyncio.run(run())
+
+    def test_fixed_rate(self):
+        monitor = Monitor(max_workers=2)
+        environments = [FakeEnvironment(0.02) for _ in range(3)]
+        for environment in environments:
+            monitor.add(environment, interval=0.1)
+
+        self.run_monitor(monitor, 0.55)
+
+        # Readings at 0, 0.1, ..., 0.5 regardless of how long each one takes, allowing for
+        # a slow machine to miss a tick at either end
+        for environment in environments:
+            self.assertGreaterEqual(environment.readings, 5)
+            self.assertLessEqual(environment.readings, 6)
+            self.assertLessEqual(
+                monitor.environments[environment.id].skipped, 1)
+
+    def test_slow_readings_skip_ticks(self):
+        monitor = Monitor()
+        environment = FakeEnvironment(0.25)
+        monitored = monitor.add(environment, interval=0.1)
+
+        self.run_monitor(monitor, 0.6)
+
+        self.assertGreater(monitored.skipped, 0)
+        self.assertLessEqual(environment.readings, 3)
+
+    def test_duplicate_environment(self):
+        monitor = Monitor()
+        environment = FakeEnvironment()
+        monitor.add(environment)
+        with self.assertRaises(ValueError):
+            monitor.add(environment)
+
+
+class TestEnvironmentMonitor(unittest.TestCase):
+    def test_overrun(self):
+        # Not an `Exception`, which `monitor` would log and carry on from
+        class Stop(BaseException):
+            pass
+
+        durations = iter([0.05, 0, 0])
+
+        def take_reading():
+            duration = next(durations, None)
+            if duration is None:
+                raise Stop()
+            sleep(duration)
+
+        environment = Environment()
+        environment.take_reading = take_reading
+        with patch('hothouse.hothouse.sleep') as mock_sleep:
+            # The first reading takes longer than the interval
+            with self.assertRaises(Stop):
+                environment.monitor(interval=0.01)
+
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 3)
+        self.assertEqual(delays[0], 0)
+        self.assertTrue(all(delay >= 0 for delay in delays))
@@ -0,0 +1,161 @@
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from hothouse import Device, Schedule
+from hothouse.hothouse import Base, DeviceUsage
+from hothouse.postgres import CONFIG, get_session, register_engine
+from mocks.mock_hothouse import MockEnvironment, MockHeater
+
+
+class CachedEnvironment(MockEnvironment):
+    cache_rows = True
+
+
+class ListWriter:
+    """Stands in for a `Spool`, which keeps rows while the database is down."""
+
+    def __init__(self):
+        self.rows = []
+
+    def add(self, row) -> None:
+        self.rows.append(row)
+
+
+class TestOutage(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = create_engine(f"sqlite:///{os.path.join(directory.name, 'main.db')}")
+        event.listen(engine, 'connect', lambda dbapi_connection, _: dbapi_connection.execute(
+            f"ATTACH DATABASE '{os.path.join(directory.name, 'hh.db')}' AS hh"))
+        Base.metadata.create_all(engine)
+        config = patch.dict(CONFIG, DB_NAME='outage_test')
+        config.start()
+        self.addCleanup(config.stop)
+        register_engine('outage_test', engine)
+
+        # Every statement fails while the database is down
+        self.down = False
+
+        def fail_while_down(conn, cursor, statement, *args):
+            if self.down:
+                raise OperationalError(statement, None, ConnectionError('unreachable'))
+        event.listen(engine, 'before_cursor_execute', fail_while_down)
+
+        with get_session() as session:
+            session.add(MockHeater(id='heater', name='Heater', watts=300, active=False))
+            session.add(CachedEnvironment(id='e1', name='Test', heater_id='heater', temp_tolerance=2))
+            session.add(Schedule(id='s1', environment_id='e1', temp=70, humidity=0.5,
+                                 start_date=date(2026, 1, 1)))
+            session.commit()
+        with get_session() as session:
+            self.environment = session.get(CachedEnvironment, 'e1')
+
+    def test_keeps_controlling_devices(self):
+        environment = self.environment
+        environment.get_humidity = lambda: 0.5
+        writer = ListWriter()
+        environment.reading_writer = writer
+        usage_writer = patch.object(MockHeater, 'usage_writer', writer)
+        usage_writer.start()
+        self.addCleanup(usage_writer.stop)
+        start_at = datetime(2026, 2, 1, 12)
+
+        def take_reading(minute: int, temp: float) -> None:
+            environment.get_temp = lambda: temp
+            environment.take_reading(at=start_at + timedelta(minutes=minute))
+
+        take_reading(0, 70)
+
+        self.down = True
+        # The heater is switched on and off although none of it can be saved, with a warning
+        # rather than an error, since nothing is lost...
+        with self.assertLogs('hothouse.hothouse', 'WARNING') as logs:
+            take_reading(1, 65)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIsNone(logs.records[0].exc_info)
+        self.assertTrue(environment._row_cache.heater.active)
+        # ...even once the cached rows are due to be loaded again
+        environment._row_cache = environment._row_cache._replace(valid_until=start_at)
+        with self.assertLogs('hothouse.hothouse', 'WARNING'):
+            take_reading(2, 65)
+        self.assertTrue(environment._row_cache.heater.active)
+        with self.assertLogs('hothouse.hothouse', 'WARNING'):
+            take_reading(3, 75)
+        self.assertFalse(environment._row_cache.heater.active)
+
+        # Readings and usage went to the writer all along
+        self.assertEqual(len([row for row in writer.rows if isinstance(row, DeviceUsage)]), 1)
+        self.assertEqual([row.heater_active for row in writer.rows if not isinstance(row, DeviceUsage)],
+                         [False, True, True, False])
+
+        # Once the database is back, the heater's state is saved
+        self.down = False
+        take_reading(4, 75)
+        with get_session() as session:
+            heater = session.get(Device, 'heater')
+            self.assertFalse(heater.active)
+            self.assertEqual(heater.last_activated_at, start_at + timedelta(minutes=1))
+            self.assertEqual(heater.last_deactivated_at, start_at + timedelta(minutes=3))
+        self.assertEqual(environment._unsaved_device_states, {})
+
+    def test_deadband_during_outage(self):
+        environment = self.environment
+        environment.temp_deadband = 1
+        environment.humidity_deadband = 0.05
+        environment.get_humidity = lambda: 0.5
+        writer = ListWriter()
+        environment.reading_writer = writer
+        usage_writer = patch.object(MockHeater, 'usage_writer', writer)
+        usage_writer.start()
+        self.addCleanup(usage_writer.stop)
+        start_at = datetime(2026, 2, 1, 12)
+
+        environment.get_temp = lambda: 70
+        environment.take_reading(at=start_at)
+        self.down = True
+        environment.get_temp = lambda: 65
+        with self.assertLogs('hothouse.hothouse', 'WARNING'):
+            for minute in range(1, 5):
+                environment.take_reading(at=start_at + timedelta(minutes=minute))
+
+        # Saving the heater's state fails every time, but the readings went to the writer, so
+        # only the one where the heater turned on is a change worth writing
+        self.assertEqual([row.at for row in writer.rows],
+                         [start_at, start_at + timedelta(minutes=1)])
+
+    def test_monitor_keeps_running(self):
+        environment = self.environment
+        environment.get_humidity = lambda: 0.5
+        temps = iter([65, 75, 75])
+        environment.get_temp = lambda: next(temps)
+        # Load the rows first, so there's something to control the heater with
+        environment.take_reading()
+        self.assertTrue(environment._row_cache.heater.active)
+
+        # Readings are committed, so they're lost (and reported) while the database is down,
+        # but each failed reading is only logged
+        self.down = True
+        ticks = []
+
+        def sleep(seconds: float) -> None:
+            ticks.append(seconds)
+            if len(ticks) == 2:
+                raise KeyboardInterrupt
+
+        with patch('hothouse.hothouse.sleep', sleep), \
+                self.assertLogs('hothouse.hothouse', 'ERROR') as logs, \
+                self.assertRaises(KeyboardInterrupt):
+            environment.monitor(interval=0)
+        self.assertEqual(len(ticks), 2)
+        self.assertEqual(len(logs.records), 2)
+        # The heater was still turned off
+        self.assertFalse(environment._row_cache.heater.active)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+from datetime import datetime, date, time
+from threading import Event
+from uuid import uuid4
+from hothouse import Schedule, metrics
+from hothouse.hothouse import DeviceUsage, RowCache
+from hothouse.pipeline import Pipeline
+from mocks.mock_hothouse import MockEnvironment, MockHeater
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.heater = MockHeater(
+            id=str(uuid4()), name='Test Heater', watts=300, active=False)
+        self.environment = MockEnvironment(
+            id=str(uuid4()), name='Test Environment', heater_id=self.heater.id)
+        schedule = Schedule(
+            id=str(uuid4()),
+            environment_id=self.environment.id,
+            temp=70,
+            start_date=date.today(),
+            light_on_at=time(hour=8),
+            light_off_at=time(hour=20)
+        )
+        self.environment._row_cache = RowCache(
+            schedule, None, self.heater, None, None, datetime.min, None)
+        self.environment.get_humidity = Mock(return_value=None)
+
+        # A database that doesn't accept writes until `database_ready` is set
+        self.database_ready = Event()
+        self.session = MagicMock()
+        self.session.__enter__.return_value = self.session
+        self.session.commit.side_effect = lambda: self.database_ready.wait()
+        get_session = patch('hothouse.pipeline.get_session',
+                            return_value=self.session)
+        get_session.start()
+        self.addCleanup(get_session.stop)
+
+    def test_control_does_not_wait_for_database(self):
+        pipeline = Pipeline(self.environment, max_queue_size=2)
+        self.addCleanup(pipeline.close)
+        # Let the stuck write finish before closing, even if the test fails
+        self.addCleanup(self.database_ready.set)
+
+        self.environment.get_temp = Mock(return_value=60)
+        pipeline.take_reading()
+        self.assertTrue(self.heater.active)
+
+        self.environment.get_temp = Mock(return_value=80)
+        pipeline.take_reading()
+        self.assertFalse(self.heater.active)
+        # The heater's usage was queued without changing where the heater writes usage
+        self.assertEqual(len(pipeline.usages), 1)
+        self.assertIsNone(self.heater.usage_writer)
+
+        # The first reading is stuck being written, the rest are queued, along with the
+        # heater's usage
+        self.environment.get_temp = Mock(return_value=70)
+        for _ in range(3):
+            pipeline.take_reading()
+        self.assertEqual(pipeline.queue_depth, 3)
+        self.assertGreater(pipeline.dropped, 0)
+
+        self.database_ready.set()
+        pipeline.close()
+        self.assertEqual(pipeline.queue_depth, 0)
+        update_device_states = self.session.bulk_update_mappings
+        update_device_states.assert_called()
+        self.assertFalse(update_device_states.call_args.args[1][0]['active'])
+
+    def test_usages_are_never_dropped(self):
+        registry = metrics.enable()
+        self.addCleanup(metrics.disable)
+        pipeline = Pipeline(self.environment, max_queue_size=2)
+        self.addCleanup(pipeline.close)
+        # Let the stuck write finish before closing, even if the test fails
+        self.addCleanup(self.database_ready.set)
+
+        # Switch the heater on and off over and over while the database is stuck
+        for temp in [60, 80] * 3:
+            self.environment.get_temp = Mock(return_value=temp)
+            pipeline.take_reading()
+
+        self.assertEqual(len(pipeline.usages), 3)
+        self.assertGreater(pipeline.dropped, 0)
+        self.assertEqual(registry.dropped.get(environment=self.environment.id), pipeline.dropped)
+        self.assertEqual(registry.queue_depth.get(environment=self.environment.id), pipeline.queue_depth)
+
+        self.database_ready.set()
+        pipeline.close()
+        written = [row for call in self.session.add_all.call_args_list for row in call.args[0]]
+        self.assertEqual(len([row for row in written if isinstance(row, DeviceUsage)]), 3)
+        self.assertEqual(registry.queue_depth.get(environment=self.environment.id), 0)
+
+    def test_close_while_database_is_down(self):
+        self.session.commit.side_effect = ConnectionError('unreachable')
+        spool = Mock()
+        pipeline = Pipeline(self.environment, retry_seconds=0.01, spool=spool)
+        self.addCleanup(pipeline.close)
+
+        for temp in [60, 80, 70]:
+            self.environment.get_temp = Mock(return_value=temp)
+            pipeline.take_reading()
+        with self.assertLogs('hothouse.pipeline', 'WARNING'):
+            pipeline.close()
+
+        # Nothing is thrown away: every reading and the heater's usage go to the spool
+        spooled = [call.args[0] for call in spool.add.call_args_list]
+        self.assertEqual(len([row for row in spooled if isinstance(row, DeviceUsage)]), 1)
+        self.assertEqual(len(spooled), 4)
+        self.assertEqual(pipeline.queue_depth, 0)
+
+        # Without a spool, they're kept in `unwritten`
+        pipeline = Pipeline(self.environment, retry_seconds=0.01)
+        self.environment.get_temp = Mock(return_value=60)
+        pipeline.take_reading()
+        with self.assertLogs('hothouse.pipeline', 'ERROR'):
+            pipeline.close()
+        self.assertEqual(len(pipeline.unwritten), 1)
+
+    def test_usages_are_capped(self):
+        # Without a writer thread, so nothing is taken off the queue
+        with patch.object(Pipeline, '_persist'):
+            pipeline = Pipeline(self.environment, max_usages=2)
+        usages = [DeviceUsage(id=str(i)) for i in range(4)]
+
+        with self.assertLogs('hothouse.pipeline', 'WARNING'):
+            for usage in usages[:3]:
+                pipeline.add(usage)
+        self.assertEqual(pipeline.usages, usages[1:3])
+        self.assertEqual(pipeline.dropped_usages, 1)
+
+        # With a spool, usages past the cap are spilled to it instead
+        pipeline.spool = Mock()
+        pipeline.add(usages[3])
+        pipeline.spool.add.assert_called_once_with(usages[3])
+        self.assertEqual(pipeline.usages, usages[1:3])
@@ -0,0 +1,25 @@
+import unittest
+from unittest.mock import patch
+from hothouse.postgres import postgres_connector
+from hothouse.postgres.postgres_connector import Config
+
+
+class TestConfig(unittest.TestCase):
+    def test_loads_lazily(self):
+        with patch.object(postgres_connector, 'dotenv_values', return_value={'PG_HOST': 'from-dotenv'}) as dotenv_values:
+            config = Config()
+            dotenv_values.assert_not_called()
+            self.assertEqual(config['PG_HOST'], 'from-dotenv')
+            self.assertEqual(config['PG_HOST'], 'from-dotenv')
+            dotenv_values.assert_called_once()
+
+    def test_environment_overrides_dotenv(self):
+        with patch.object(postgres_connector, 'dotenv_values', return_value={'PG_HOST': 'from-dotenv'}), \
+                patch.dict(postgres_connector.os.environ, {'PG_HOST': 'from-environment'}):
+            self.assertEqual(Config()['PG_HOST'], 'from-environment')
+
+    def test_missing_setting(self):
+        with patch.object(postgres_connector, 'dotenv_values', return_value={}), \
+                patch.dict(postgres_connector.os.environ, clear=True):
+            with self.assertRaisesRegex(KeyError, 'PG_HOST is not configured'):
+                Config()['PG_HOST']
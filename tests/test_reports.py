@@ -0,0 +1,37 @@
+import unittest
+from datetime import datetime
+from hothouse.reports import Tariff, summarize_usages
+
+
+class TestReports(unittest.TestCase):
+    def test_splits_usage_across_days(self):
+        # 2 kWh over 4 hours, half of it before midnight
+        device_ids, environment_ids, buckets, seconds, kilowatt_hours, cost = summarize_usages(
+            ['heater'], ['environment'],
+            [datetime(2026, 10, 1, 22)], [datetime(2026, 10, 2, 2)], [2],
+            bucket='day', tariff=Tariff(0.1, periods=[(23, 1, 0.5)])
+        )
+
+        self.assertEqual(buckets.tolist(), [
+            datetime(2026, 10, 1), datetime(2026, 10, 2)])
+        self.assertEqual(seconds.tolist(), [7200, 7200])
+        self.assertEqual(kilowatt_hours.tolist(), [1, 1])
+        # One hour on each side of midnight is at the higher price
+        self.assertAlmostEqual(cost[0], 0.5 * 0.1 + 0.5 * 0.5)
+        self.assertAlmostEqual(cost[1], 0.5 * 0.5 + 0.5 * 0.1)
+
+    def test_totals_per_device(self):
+        device_ids, environment_ids, buckets, seconds, kilowatt_hours, cost = summarize_usages(
+            ['fan', 'heater', 'fan'], ['environment'] * 3,
+            [datetime(2026, 10, 1, 8), datetime(2026, 10, 1, 8, 30), datetime(2026, 10, 1, 9)],
+            [datetime(2026, 10, 1, 8, 30), datetime(2026, 10, 1, 9), datetime(2026, 10, 1, 12)],
+            [0.05, 0.5, 0.3],
+            bucket='hour', since=datetime(2026, 10, 1), until=datetime(2026, 10, 1, 10)
+        )
+
+        self.assertEqual(device_ids.tolist(), ['fan', 'fan', 'heater'])
+        self.assertEqual(buckets.tolist(), [
+            datetime(2026, 10, 1, 8), datetime(2026, 10, 1, 9), datetime(2026, 10, 1, 8)])
+        # Only the first hour of the last fan usage is before `until`
+        self.assertEqual(kilowatt_hours.round(6).tolist(), [0.05, 0.1, 0.5])
+        self.assertEqual(cost.tolist(), [0, 0, 0])
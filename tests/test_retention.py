@@ -0,0 +1,113 @@
+import unittest
+from datetime import date, datetime
+from unittest.mock import patch
+from sqlalchemy import text
+from hothouse import Device, Environment, Reading
+from hothouse.bootstrap import create_test_database, drop_database
+from hothouse.hothouse import DeviceUsage
+from hothouse.ids import uuid7
+from hothouse.postgres import CONFIG, get_session
+from hothouse.retention import add_months, apply_retention, create_partitions, parse_partition_bound
+test_db_name = 'retention_test_db'
+
+
+class TestRetention(unittest.TestCase):
+    def test_add_months(self):
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -25), date(2023, 12, 1))
+
+    def test_parse_partition_bound(self):
+        self.assertEqual(
+            parse_partition_bound(
+                "FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')"),
+            (datetime(2026, 10, 1), datetime(2026, 11, 1))
+        )
+        self.assertIsNone(parse_partition_bound('DEFAULT'))
+
+
+class TestRetentionDatabase(unittest.TestCase):
+    # Readings either side of each month boundary, and one after the last partition
+    reading_times = [
+        datetime(2026, 1, 31, 23, 59, 59),
+        datetime(2026, 2, 1),
+        datetime(2026, 2, 28, 23, 59, 59),
+        datetime(2026, 3, 1),
+        datetime(2026, 4, 30, 12),
+        datetime(2026, 6, 1),
+    ]
+
+    def setUp(self):
+        config = patch.dict(CONFIG, DB_NAME=test_db_name)
+        config.start()
+        self.addCleanup(config.stop)
+        create_test_database(test_db_name)
+        self.addCleanup(drop_database, test_db_name)
+
+        with get_session() as session:
+            session.add(Device(id='heater', name='Heater', watts=300))
+            session.add(Environment(id='e1', name='Test', heater_id='heater'))
+            session.commit()
+            # Written before their partitions exist, so they start out in the default partitions
+            for at in self.reading_times:
+                session.add(Reading(id=str(uuid7()), environment_id='e1', at=at, temp=70))
+            session.add(DeviceUsage(id=str(uuid7()), device_id='heater', environment_id='e1',
+                                    start_at=datetime(2026, 1, 31, 23, 30), end_at=datetime(2026, 2, 1, 0, 30),
+                                    seconds=3600, kilowatt_hours=0.3))
+            session.commit()
+
+        self.assertEqual(
+            create_partitions(3, today=date(2026, 1, 15)),
+            ['readings_2026_01', 'readings_2026_02', 'readings_2026_03', 'readings_2026_04',
+             'device_usages_2026_01', 'device_usages_2026_02', 'device_usages_2026_03',
+             'device_usages_2026_04'])
+
+    def count(self, table: str) -> int:
+        with get_session() as session:
+            return session.execute(text(f'SELECT count(*) FROM {table}')).scalar()
+
+    def get_times(self, table: str) -> list:
+        with get_session() as session:
+            return session.execute(text(f'SELECT at FROM {table} ORDER BY at')).scalars().all()
+
+    def test_create_partitions(self):
+        # Rows were moved out of the default partitions into their months
+        self.assertEqual(self.get_times('hh.readings_2026_01'), [datetime(2026, 1, 31, 23, 59, 59)])
+        self.assertEqual(self.get_times('hh.readings_2026_02'),
+                         [datetime(2026, 2, 1), datetime(2026, 2, 28, 23, 59, 59)])
+        self.assertEqual(self.get_times('hh.readings_2026_03'), [datetime(2026, 3, 1)])
+        self.assertEqual(self.get_times('hh.readings_2026_04'), [datetime(2026, 4, 30, 12)])
+        self.assertEqual(self.get_times('hh.readings_default'), [datetime(2026, 6, 1)])
+        self.assertEqual(self.count('hh.device_usages_2026_01'), 1)
+        self.assertEqual(self.count('hh.device_usages_default'), 0)
+
+        # Partitions that exist already are left alone
+        self.assertEqual(create_partitions(0, ['readings'], today=date(2026, 2, 10)), ['readings_2026_02'])
+        self.assertEqual(self.count('hh.readings'), len(self.reading_times))
+
+    def test_drop(self):
+        # Keeping 2 full months in April keeps February onwards
+        removed = apply_retention(2, today=date(2026, 4, 10))
+        self.assertEqual([partition.name for partition in removed],
+                         ['readings_2026_01', 'device_usages_2026_01'])
+        self.assertEqual(self.get_times('hh.readings')[0], datetime(2026, 2, 1))
+        self.assertEqual(self.count('hh.readings'), len(self.reading_times) - 1)
+        self.assertEqual(self.count('hh.device_usages'), 0)
+        with get_session() as session:
+            self.assertIsNone(session.execute(text("SELECT to_regclass('hh.readings_2026_01')")).scalar())
+
+        # Nothing else is old enough yet
+        self.assertEqual(apply_retention(2, today=date(2026, 4, 30)), [])
+
+    def test_archive(self):
+        removed = apply_retention(1, ['readings'], archive_schema='archive', today=date(2026, 4, 10))
+        self.assertEqual([partition.name for partition in removed], ['readings_2026_01', 'readings_2026_02'])
+        self.assertEqual(self.get_times('hh.readings'),
+                         [datetime(2026, 3, 1), datetime(2026, 4, 30, 12), datetime(2026, 6, 1)])
+
+        # The archived months keep their rows, outside of `hh.readings`
+        self.assertEqual(self.get_times('archive.readings_2026_01'), [datetime(2026, 1, 31, 23, 59, 59)])
+        self.assertEqual(self.get_times('archive.readings_2026_02'),
+                         [datetime(2026, 2, 1), datetime(2026, 2, 28, 23, 59, 59)])
+        # Only the tables asked for are archived
+        self.assertEqual(self.count('hh.device_usages_2026_01'), 1)
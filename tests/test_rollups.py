@@ -0,0 +1,126 @@
+import unittest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from sqlalchemy import select
+from hothouse import Environment, Reading
+from hothouse.bootstrap import create_test_database, drop_database
+from hothouse.ids import uuid7
+from hothouse.postgres import CONFIG, get_session
+from hothouse.rollups import ReadingDay, ReadingHour, ReadingMinute, get_rollup_class, get_rollups
+test_db_name = 'rollups_test_db'
+
+
+class TestRollups(unittest.TestCase):
+    def test_get_rollup_class(self):
+        end_at = datetime(2022, 3, 1)
+
+        # Six hours of minutes is 360 points
+        self.assertIs(get_rollup_class(
+            end_at - timedelta(hours=6), end_at, max_points=1000), ReadingMinute)
+        # A month of minutes is too many, but a month of hours fits
+        self.assertIs(get_rollup_class(
+            end_at - timedelta(days=30), end_at, max_points=1000), ReadingHour)
+        # Years of data only fit as days, and very long ranges fall back to days anyway
+        self.assertIs(get_rollup_class(
+            end_at - timedelta(days=365 * 2), end_at, max_points=1000), ReadingDay)
+        self.assertIs(get_rollup_class(
+            end_at - timedelta(days=365 * 10), end_at, max_points=100), ReadingDay)
+
+    def test_derived_values(self):
+        rollup = ReadingHour(
+            reading_count=60,
+            temp_count=60,
+            temp_sum=4200,
+            humidity_count=0,
+            heater_active_count=15
+        )
+        self.assertEqual(rollup.temp_avg, 70)
+        self.assertIsNone(rollup.humidity_avg)
+        self.assertEqual(rollup.duty_cycle('heater'), 0.25)
+
+
+def make_reading(environment_id, at, temp, humidity, heater_active):
+    return Reading(id=str(uuid7()), environment_id=environment_id, at=at, temp=temp,
+                   humidity=humidity, heater_active=heater_active)
+
+
+class TestRollupsDatabase(unittest.TestCase):
+    def setUp(self):
+        config = patch.dict(CONFIG, DB_NAME=test_db_name)
+        config.start()
+        self.addCleanup(config.stop)
+        create_test_database(test_db_name)
+        self.addCleanup(drop_database, test_db_name)
+
+        day = datetime(2026, 3, 1)
+        with get_session() as session:
+            session.add_all([Environment(id='e1', name='One'), Environment(id='e2', name='Two')])
+            session.commit()
+
+            # Each commit fires the trigger once, and the second adds to rows the first made
+            session.add_all([
+                make_reading('e1', day.replace(hour=10, second=10), 70, 0.5, True),
+                make_reading('e1', day.replace(hour=10, second=50), 72, None, False),
+                make_reading('e1', day.replace(hour=10, minute=59, second=30), 68, 0.4, True),
+            ])
+            session.commit()
+            session.add_all([
+                make_reading('e1', day.replace(hour=10, second=30), 74, 0.6, False),
+                make_reading('e1', day.replace(hour=23, minute=59, second=59), 60, None, True),
+                make_reading('e1', day + timedelta(days=1), 80, None, False),
+                make_reading('e2', day.replace(hour=10, second=20), 50, 0.9, True),
+            ])
+            session.commit()
+
+    def get_rows(self, rollup_class) -> dict:
+        with get_session() as session:
+            rollups = session.execute(select(rollup_class).where(
+                rollup_class.environment_id == 'e1')).scalars().all()
+            return {rollup.bucket: rollup for rollup in rollups}
+
+    def test_trigger(self):
+        minutes = self.get_rows(ReadingMinute)
+        self.assertEqual(list(minutes), [datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 10, 59),
+                                         datetime(2026, 3, 1, 23, 59), datetime(2026, 3, 2)])
+        minute = minutes[datetime(2026, 3, 1, 10)]
+        self.assertEqual(minute.reading_count, 3)
+        self.assertEqual((minute.temp_min, minute.temp_max, minute.temp_sum), (70, 74, 216))
+        self.assertEqual(minute.humidity_count, 2)
+        self.assertAlmostEqual(minute.humidity_avg, 0.55)
+        self.assertEqual(minute.heater_active_count, 1)
+
+        hours = self.get_rows(ReadingHour)
+        self.assertEqual(list(hours), [datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 23),
+                                       datetime(2026, 3, 2)])
+        hour = hours[datetime(2026, 3, 1, 10)]
+        self.assertEqual((hour.reading_count, hour.temp_count, hour.temp_sum), (4, 4, 284))
+        self.assertEqual((hour.humidity_min, hour.humidity_max), (Decimal('0.4'), Decimal('0.6')))
+        self.assertEqual(hour.duty_cycle('heater'), 0.5)
+
+        days = self.get_rows(ReadingDay)
+        self.assertEqual(list(days), [datetime(2026, 3, 1), datetime(2026, 3, 2)])
+        day = days[datetime(2026, 3, 1)]
+        self.assertEqual((day.reading_count, day.temp_min, day.temp_max), (5, 60, 74))
+        self.assertEqual(day.temp_avg, 68.8)
+        # The other environment's reading in the same day has a rollup of its own
+        self.assertEqual(day.humidity_count, 3)
+
+    def test_get_rollups(self):
+        # An hour fits in minutes
+        rollups = get_rollups('e1', datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 11))
+        self.assertTrue(all(isinstance(rollup, ReadingMinute) for rollup in rollups))
+        self.assertEqual([rollup.reading_count for rollup in rollups], [3, 1])
+
+        # A day at most 100 points is hours, including the hour `start_at` is in
+        rollups = get_rollups('e1', datetime(2026, 3, 1, 10, 30), datetime(2026, 3, 2, 10, 30), max_points=100)
+        self.assertTrue(all(isinstance(rollup, ReadingHour) for rollup in rollups))
+        self.assertEqual([rollup.bucket for rollup in rollups],
+                         [datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 23), datetime(2026, 3, 2)])
+        self.assertEqual(rollups[0].temp_avg, 71)
+
+        # Two days at most 10 points is days
+        rollups = get_rollups('e1', datetime(2026, 3, 1), datetime(2026, 3, 3), max_points=10)
+        self.assertEqual([(rollup.bucket, rollup.reading_count) for rollup in rollups],
+                         [(datetime(2026, 3, 1), 5), (datetime(2026, 3, 2), 1)])
+        self.assertEqual(get_rollups('e2', datetime(2026, 3, 1), datetime(2026, 3, 3), max_points=10)[0].temp_avg, 50)
@@ -0,0 +1,109 @@
+import unittest
+import asyncio
+from threading import Event
+from unittest.mock import patch
+from uuid import uuid4
+from hothouse.hothouse import Environment
+from hothouse.run import HashRing, Worker
+
+
+class FakeEnvironment:
+    def __init__(self):
+        self.id = str(uuid4())
+        self.readings = 0
+
+    def take_reading(self):
+        self.readings += 1
+
+
+class TestRun(unittest.TestCase):
+    def test_hash_ring(self):
+        ids = [str(uuid4()) for _ in range(2000)]
+        four = HashRing(range(4))
+        shards = [four.get_shard(environment_id) for environment_id in ids]
+        # Roughly even, and the same in every process
+        for shard in range(4):
+            self.assertGreater(shards.count(shard), 300)
+        self.assertEqual(shards, [HashRing(range(4)).get_shard(environment_id) for environment_id in ids])
+
+        # Adding a shard only moves environments to the new shard
+        five = HashRing(range(5))
+        moved = [environment_id for environment_id, shard in zip(ids, shards)
+                 if five.get_shard(environment_id) != shard]
+        self.assertTrue(all(five.get_shard(environment_id) == 4 for environment_id in moved))
+        self.assertLess(len(moved), 600)
+
+    def test_worker_rebalances(self):
+        environments = [FakeEnvironment() for _ in range(40)]
+        workers = [Worker(shard, 2, Environment, interval=0.05, refresh_seconds=0.1) for shard in range(2)]
+        for worker in workers:
+            worker.load_environments = lambda worker=worker: {
+                environment.id: environment for environment in environments
+                if worker.ring.get_shard(environment.id) == worker.shard}
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            tasks = [loop.create_task(worker.run()) for worker in workers]
+            await asyncio.sleep(0.15)
+            environments.pop()
+            environments.append(FakeEnvironment())
+            await asyncio.sleep(0.25)
+            for worker in workers:
+                worker.stop()
+            await asyncio.gather(*tasks)
+            return [set(worker.monitor.environments) for worker in workers]
+
+        with patch.object(Worker, '_lock', return_value=True), patch.object(Worker, '_unlock'):
+            driven = asyncio.run(run())
+
+        # Every environment is driven by exactly one worker
+        self.assertEqual(driven[0] | driven[1], {environment.id for environment in environments})
+        self.assertFalse(driven[0] & driven[1])
+        self.assertTrue(all(environment.readings for environment in environments))
+
+    def test_locked_environments_are_skipped(self):
+        environments = [FakeEnvironment() for _ in range(3)]
+        worker = Worker(0, 1, Environment)
+        worker.load_environments = lambda: {environment.id: environment for environment in environments}
+
+        with patch.object(Worker, '_lock', side_effect=lambda environment_id: environment_id != environments[0].id):
+            asyncio.run(worker.refresh())
+        self.assertEqual(set(worker.monitor.environments), {environment.id for environment in environments[1:]})
+
+    def test_lock_is_kept_until_reading_finishes(self):
+        environment = FakeEnvironment()
+        started, finish = Event(), Event()
+        events = []
+
+        def take_reading():
+            started.set()
+            finish.wait()
+            events.append('reading finished')
+        environment.take_reading = take_reading
+
+        worker = Worker(0, 1, Environment, interval=60)
+        environments = {environment.id: environment}
+        worker.load_environments = lambda: dict(environments)
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            monitor = loop.create_task(worker.monitor.run())
+            await worker.refresh()
+            await loop.run_in_executor(None, started.wait)
+
+            # The environment is removed from the shard mid-reading
+            environments.clear()
+            refresh = loop.create_task(worker.refresh())
+            try:
+                await asyncio.sleep(0.05)
+                self.assertFalse(refresh.done())
+            finally:
+                finish.set()
+            await refresh
+            worker.monitor.stop()
+            await monitor
+
+        with patch.object(Worker, '_lock', return_value=True), \
+                patch.object(Worker, '_unlock', side_effect=lambda environment_id: events.append('unlocked')):
+            asyncio.run(run())
+        self.assertEqual(events, ['reading finished', 'unlocked'])
@@ -0,0 +1,139 @@
+import os
+import random
+import tempfile
+import unittest
+from datetime import date, datetime, time, timedelta
+from unittest.mock import patch
+from sqlalchemy import create_engine, event
+from hothouse import Device, Schedule
+from hothouse.hothouse import Base, Environment
+from hothouse.postgres import CONFIG, get_session, register_engine
+from hothouse.schedules import ScheduleIndex, get_active_schedule, get_next_change
+
+
+def make_schedule(id, start_date, end_date=None, priority=0, phase=None, environment_id='e1', updated_at=None):
+    phase_start_at, phase_end_at = phase or (None, None)
+    return Schedule(id=id, environment_id=environment_id, start_date=start_date, end_date=end_date,
+                    priority=priority, phase_start_at=phase_start_at, phase_end_at=phase_end_at,
+                    updated_at=updated_at)
+
+
+class TestSchedules(unittest.TestCase):
+    def test_overlaps_and_phases(self):
+        schedules = [
+            make_schedule('base', date(2026, 1, 1)),
+            # Overlaps `base`, and started later
+            make_schedule('spring', date(2026, 3, 1), date(2026, 6, 1)),
+            # A night phase that runs past midnight
+            make_schedule('night', date(2026, 1, 1), phase=(time(22), time(6))),
+            # Outranks everything, for a week
+            make_schedule('override', date(2026, 4, 1), date(2026, 4, 8), priority=1),
+        ]
+        expected = {
+            datetime(2025, 12, 31, 12): None,
+            datetime(2026, 2, 1, 12): 'base',
+            datetime(2026, 2, 1, 23): 'night',
+            datetime(2026, 2, 2, 5, 59): 'night',
+            datetime(2026, 3, 1, 0, 0): 'night',
+            datetime(2026, 3, 1, 12): 'spring',
+            datetime(2026, 4, 3, 23): 'override',
+            datetime(2026, 6, 1, 12): 'base',
+        }
+        index = ScheduleIndex()
+        index.update(schedules)
+        for at, schedule_id in expected.items():
+            active = get_active_schedule(schedules, at)
+            self.assertEqual(active and active.id, schedule_id, at)
+            active = index.get_active('e1', at)
+            self.assertEqual(active and active.id, schedule_id, at)
+
+        self.assertEqual(get_next_change(schedules, datetime(2026, 2, 1, 12)), datetime(2026, 2, 1, 22))
+        self.assertEqual(index.get_next_change('e1', datetime(2026, 2, 1, 12)), datetime(2026, 2, 1, 22))
+        self.assertEqual(index.get_next_change('e1', datetime(2026, 4, 7, 23)), datetime(2026, 4, 8))
+
+    def test_index_matches_brute_force(self):
+        randomizer = random.Random(1)
+        schedules = []
+        for i in range(200):
+            start_date = date(2026, 1, 1) + timedelta(days=randomizer.randrange(60))
+            end_date = randomizer.choice([None, start_date + timedelta(days=randomizer.randrange(1, 30))])
+            phase = randomizer.choice([None, (time(randomizer.randrange(24)), time(randomizer.randrange(24)))])
+            schedules.append(make_schedule(
+                f's{i}', start_date, end_date, randomizer.randrange(3), phase, f'e{i % 10}'))
+
+        index = ScheduleIndex()
+        index.update(schedules)
+        for _ in range(500):
+            at = datetime(2026, 1, 1) + timedelta(minutes=randomizer.randrange(100 * 24 * 60))
+            environment_id = f'e{randomizer.randrange(10)}'
+            environment_schedules = [s for s in schedules if s.environment_id == environment_id]
+            self.assertIs(index.get_active(environment_id, at), get_active_schedule(environment_schedules, at))
+            self.assertEqual(index.get_next_change(environment_id, at),
+                             get_next_change(environment_schedules, at))
+
+    def use_test_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        engine = create_engine(f"sqlite:///{os.path.join(directory.name, 'main.db')}")
+        event.listen(engine, 'connect', lambda dbapi_connection, _: dbapi_connection.execute(
+            f"ATTACH DATABASE '{os.path.join(directory.name, 'hh.db')}' AS hh"))
+        Base.metadata.create_all(engine)
+        config = patch.dict(CONFIG, DB_NAME='schedules_test')
+        config.start()
+        self.addCleanup(config.stop)
+        register_engine('schedules_test', engine)
+
+    def test_refresh(self):
+        self.use_test_database()
+        updated_at = datetime(2026, 1, 1)
+        with get_session() as session:
+            session.add_all([
+                make_schedule('a', date(2026, 1, 1), environment_id='e1', updated_at=updated_at),
+                make_schedule('b', date(2026, 1, 1), environment_id='e2', updated_at=updated_at),
+            ])
+            session.commit()
+
+        index = ScheduleIndex()
+        index.load()
+        self.assertEqual(index.refresh(), set())
+
+        with get_session() as session:
+            session.get(Schedule, 'a').priority = -1
+            session.add(make_schedule('c', date(2026, 1, 1), environment_id='e1',
+                                      updated_at=updated_at + timedelta(hours=1)))
+            session.delete(session.get(Schedule, 'b'))
+            session.commit()
+
+        self.assertEqual(index.refresh(), {'e1', 'e2'})
+        self.assertEqual(index.get_active('e1', datetime(2026, 2, 1)).id, 'c')
+        self.assertIsNone(index.get_active('e2', datetime(2026, 2, 1)))
+
+    def test_refresh_reloads_cached_rows(self):
+        self.use_test_database()
+        with get_session() as session:
+            for device_id in ('fan', 'heater', 'humidifier', 'light'):
+                session.add(Device(id=device_id, name=device_id))
+            session.add(Environment(id='e1', name='Test', fan_id='fan', heater_id='heater',
+                                    humidifier_id='humidifier', light_id='light'))
+            session.add(make_schedule('a', date(2026, 1, 1), updated_at=datetime(2026, 1, 1)))
+            session.commit()
+        with get_session() as session:
+            environment = session.get(Environment, 'e1')
+        index = ScheduleIndex()
+        index.load()
+        environment.schedule_index = index
+        environment.cache_rows = True
+
+        # The schedule never ends, so the cached rows would otherwise be used forever
+        at = datetime(2026, 2, 1)
+        rows = environment.get_rows(at)
+        self.assertEqual(rows.schedule.id, 'a')
+        self.assertIsNone(rows.valid_until)
+        self.assertIs(environment.get_rows(at + timedelta(hours=1)), rows)
+
+        with get_session() as session:
+            session.add(make_schedule('b', date(2026, 1, 1), priority=1,
+                                      updated_at=datetime(2026, 1, 2)))
+            session.commit()
+        self.assertEqual(index.refresh(), {'e1'})
+        self.assertEqual(environment.get_rows(at + timedelta(hours=2)).schedule.id, 'b')
@@ -0,0 +1,69 @@
+import threading
+import unittest
+from unittest.mock import Mock
+from threading import Event
+from time import monotonic, sleep
+from hothouse import sensors
+from hothouse.sensors import Sensor, SensorValue, read_sensors
+
+
+class TestSensors(unittest.TestCase):
+    def test_reads_concurrently(self):
+        def slow_read():
+            sleep(0.2)
+            return 70
+
+        sensors = {'temp': Sensor(slow_read), 'humidity': Sensor(slow_read)}
+        started_at = monotonic()
+        values = read_sensors(sensors)
+
+        self.assertLess(monotonic() - started_at, 0.35)
+        self.assertEqual(values, {'temp': SensorValue(70), 'humidity': SensorValue(70)})
+
+    def test_hung_sensor_falls_back_to_last_value(self):
+        unblock = Event()
+        self.addCleanup(unblock.set)
+        read = Mock(return_value=70)
+        sensor = Sensor(read, timeout=0.1)
+        self.assertEqual(read_sensors({'temp': sensor}), {'temp': SensorValue(70)})
+
+        read.side_effect = lambda: unblock.wait()
+        for _ in range(3):
+            self.assertEqual(read_sensors({'temp': sensor}), {
+                'temp': SensorValue(70, stale=True)})
+        # The hung read is never started again
+        self.assertEqual(read.call_count, 2)
+        self.assertEqual(sensor.timeouts, 3)
+
+        sensor.max_age = 0
+        self.assertEqual(read_sensors({'temp': sensor}), {'temp': SensorValue(None)})
+
+    def test_oversampling_and_smoothing(self):
+        # The median ignores the outlier and the failed read
+        read = Mock(side_effect=[70, 99, 71, None, 72, 69])
+        sensor = Sensor(read, samples=6, ema_alpha=0.5)
+        self.assertEqual(read_sensors({'temp': sensor}), {'temp': SensorValue(71)})
+
+        read.side_effect = ValueError
+        self.assertEqual(read_sensors({'temp': sensor}), {'temp': SensorValue(71, stale=True)})
+        self.assertEqual(sensor.errors, 1)
+
+        read.side_effect = None
+        read.return_value = 80
+        self.assertEqual(read_sensors({'temp': sensor}), {'temp': SensorValue((71 + 80) / 2)})
+
+    def test_shared_threads(self):
+        threads = set()
+
+        def read():
+            threads.add(threading.current_thread())
+            return 70
+
+        environments = [{'temp': Sensor(read), 'humidity': Sensor(read)} for _ in range(50)]
+        for _ in range(3):
+            for environment_sensors in environments:
+                read_sensors(environment_sensors)
+
+        # 300 reads reuse a bounded pool of threads, rather than starting one each
+        self.assertLessEqual(len(threads), sensors.MAX_WORKERS)
+        self.assertTrue(all(thread.name.startswith('hothouse-sensor') for thread in threads))
@@ -0,0 +1,58 @@
+import unittest
+from datetime import datetime, timedelta
+from hothouse import Device, Environment, Schedule
+from hothouse.hothouse import Sample
+from hothouse.simulation import Simulation, model_trace
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self):
+        self.heater = Device(id='heater', name='Test Heater', watts=300, active=False)
+        environment = Environment(
+            id='environment', heater_id=self.heater.id, temp_tolerance=3)
+        schedule = Schedule(id='schedule', environment_id=environment.id, temp=70)
+        self.simulation = Simulation(environment, schedule, heater=self.heater)
+
+    def test_replays_trace(self):
+        start_at = datetime(2026, 10, 1)
+        temps = [70, 68, 60, 65, 74, 70]
+        report = self.simulation.run(
+            Sample(start_at + timedelta(minutes=10 * i), temp, None)
+            for i, temp in enumerate(temps)
+        )
+
+        # The heater is on from 20 to 40 minutes
+        self.assertEqual(report.readings, 6)
+        self.assertEqual(report.switches, {'heater': 2})
+        self.assertAlmostEqual(report.kilowatt_hours['heater'], 0.3 * 20 / 60)
+        self.assertEqual(len(self.simulation.store.device_usages), 1)
+        # In tolerance for the first 20 of the 50 minutes
+        self.assertAlmostEqual(report.temp_in_tolerance, 20 / 50)
+        self.assertIsNone(report.humidity_in_tolerance)
+        # The original device is never touched
+        self.assertFalse(self.heater.active)
+
+    def test_model_trace_reacts_to_devices(self):
+        start_at = datetime(2026, 10, 1)
+        report = self.simulation.run(model_trace(
+            self.simulation, start_at, start_at + timedelta(days=1), outside_temp=60))
+
+        self.assertGreater(report.switches['heater'], 2)
+        self.assertGreater(report.temp_in_tolerance, 0.8)
+
+    def test_switch_limits(self):
+        self.heater.min_on_seconds = 600
+        self.heater.min_off_seconds = 600
+        simulation = Simulation(
+            self.simulation.environment, self.simulation.schedule, heater=self.heater)
+
+        # A reading every minute, alternating between too cold and too hot
+        start_at = datetime(2026, 10, 1)
+        report = simulation.run(
+            Sample(start_at + timedelta(minutes=i), 60 if i % 2 == 0 else 80, None)
+            for i in range(60)
+        )
+
+        # Switched every 11 minutes, with 5 commands held back in between
+        self.assertEqual(report.switches['heater'], 6)
+        self.assertEqual(report.suppressed['heater'], 27)
@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import MagicMock
+import os
+from datetime import datetime
+from tempfile import TemporaryDirectory
+from uuid import uuid4
+from hothouse import Reading
+from hothouse.hothouse import DeviceUsage
+from hothouse.postgres import Spool
+
+
+def make_reading() -> Reading:
+    return Reading(
+        id=str(uuid4()),
+        at=datetime(2026, 10, 1, 12, 30),
+        environment_id=str(uuid4()),
+        temp=70.5,
+        humidity=0.5
+    )
+
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.connection = MagicMock()
+        self.cursor = self.connection.cursor.return_value
+
+    def make_spool(self, **kwargs) -> Spool:
+        spool = Spool(
+            self.directory, [Reading, DeviceUsage], drain_seconds=60,
+            connection_factory=lambda: self.connection, **kwargs)
+        self.addCleanup(spool.close)
+        return spool
+
+    def test_replays_after_failure(self):
+        spool = self.make_spool()
+        reading = make_reading()
+        spool.add(reading)
+
+        self.cursor.execute.side_effect = ConnectionError
+        self.assertEqual(spool.flush(), 0)
+        self.assertGreater(spool.pending_bytes, 0)
+
+        # A new process picks up where the last one left off
+        spool = self.make_spool()
+        self.cursor.execute.side_effect = None
+        self.assertEqual(spool.flush(), 1)
+        self.assertEqual(spool.pending_bytes, 0)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        statement, values = self.cursor.execute.call_args.args
+        self.assertTrue(statement.startswith('INSERT INTO hh.readings'))
+        self.assertTrue(statement.endswith('ON CONFLICT DO NOTHING'))
+        self.assertIn(reading.id, values)
+        self.assertIn(reading.at, values)
+
+    def test_ignores_partly_written_record(self):
+        spool = self.make_spool()
+        spool.add(make_reading())
+        spool.add(make_reading())
+        path = spool.segment.name
+        spool.segment.truncate(spool.segment_size - 10)
+
+        self.assertEqual(spool.flush(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_drops_oldest_segments_past_max_bytes(self):
+        spool = self.make_spool(segment_bytes=1, max_bytes=1000)
+        self.cursor.execute.side_effect = ConnectionError
+        for _ in range(20):
+            spool.add(make_reading())
+
+        self.assertLessEqual(spool.pending_bytes, 1000)
+        self.assertEqual(spool.dropped + len(spool.segments), 20)